@@ -0,0 +1,433 @@
+"""Бенчмарки производительности сортировки рабочего стола"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from rule_index import RuleIndex
+from shortcuts import create_shortcut_writer, BACKEND_LNK, BACKEND_SYMLINK, BACKEND_DESKTOP, BACKEND_WIN32
+from transfer import copy_file, available_methods
+
+RULE_COUNTS = (10, 100, 300, 1000)
+
+# Сценарии бенчмарка конвейера сортировки: число элементов и число правил
+PIPELINE_ITEMS = (100, 10000, 100000)
+PIPELINE_RULES = (10, 100, 1000)
+# Доля больших файлов и папок среди элементов синтетического рабочего стола
+LARGE_FILE_EVERY = 100
+LARGE_FILE_SIZE = 32 * 1024 * 1024
+FOLDER_EVERY = 20
+
+
+def make_rules(count, seed=0):
+    """Генерирует count правил с уникальными расширениями и именами папок"""
+    rnd = random.Random(seed)
+    rules = []
+    seen = set()
+    while len(rules) < count:
+        key = "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 5)))
+        if key in seen:
+            continue
+        seen.add(key)
+        if rnd.random() < 0.8:
+            rules.append({"type": "extension", "extension": f".{key}", "folder": f"Folder_{key}"})
+        else:
+            rules.append({"type": "folder", "extension": key, "folder": f"Folder_{key}"})
+    return rules
+
+
+def make_names(rules, count, seed=1):
+    """Генерирует имена элементов: половина совпадает с правилами, половина нет"""
+    rnd = random.Random(seed)
+    names = []
+    for i in range(count):
+        rule = rnd.choice(rules)
+        if i % 2:
+            names.append((f"file_{i}.unmatched", False))
+        elif rule["type"] == "extension":
+            names.append((f"file_{i}{rule['extension'].upper()}", False))
+        else:
+            names.append((rule["extension"], True))
+    return names
+
+
+def linear_match(rules, name, is_dir):
+    """Исходный алгоритм: перебор всех правил для каждого элемента"""
+    for rule in rules:
+        if rule["type"] == "extension" and not is_dir:
+            if name.lower().endswith(rule["extension"].lower()):
+                return rule
+        elif rule["type"] == "folder" and is_dir:
+            if name.lower() == rule["extension"].lower():
+                return rule
+    return None
+
+
+def bench_rule_index(rule_counts=RULE_COUNTS, item_count=5000, repeat=3):
+    """Сравнивает стоимость сопоставления RuleIndex и линейного перебора"""
+    results = []
+    for rule_count in rule_counts:
+        rules = make_rules(rule_count)
+        names = make_names(rules, item_count)
+
+        best_linear = best_index = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for name, is_dir in names:
+                linear_match(rules, name, is_dir)
+            best_linear = min(best_linear, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            index = RuleIndex(rules)
+            for name, is_dir in names:
+                index.match(name, is_dir)
+            best_index = min(best_index, time.perf_counter() - start)
+
+        results.append({
+            "rules": rule_count,
+            "items": item_count,
+            "linear_us_per_item": best_linear / item_count * 1e6,
+            "index_us_per_item": best_index / item_count * 1e6,
+        })
+    return results
+
+
+def print_rule_index_results(results):
+    print(f"{'rules':>6} {'items':>7} {'linear us/item':>15} {'index us/item':>14}")
+    for r in results:
+        print(f"{r['rules']:>6} {r['items']:>7} {r['linear_us_per_item']:>15.2f} {r['index_us_per_item']:>14.2f}")
+
+
+def bench_shortcuts(count=1000, backends=None):
+    """Измеряет время создания ярлыков пачкой для доступных бэкендов"""
+    if backends is None:
+        backends = [BACKEND_LNK, BACKEND_DESKTOP]
+        if sys.platform == "win32":
+            backends.append(BACKEND_WIN32)
+        else:
+            backends.append(BACKEND_SYMLINK)
+
+    results = []
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = os.path.join(tmp, "targets")
+            links = os.path.join(tmp, "links")
+            os.makedirs(targets)
+            os.makedirs(links)
+            pairs = []
+            for i in range(count):
+                target = os.path.join(targets, f"file_{i}.txt")
+                open(target, "w").close()
+                pairs.append((target, os.path.join(links, f"file_{i}.txt")))
+
+            with create_shortcut_writer(backend) as writer:
+                start = time.perf_counter()
+                writer.write_batch([(t, writer.shortcut_path(links, os.path.basename(s))) for t, s in pairs])
+                elapsed = time.perf_counter() - start
+                summary = writer.timing_summary()
+        results.append({
+            "backend": backend,
+            "shortcuts": count,
+            "total_s": elapsed,
+            "avg_us": summary["avg"] * 1e6,
+            "max_us": summary["max"] * 1e6,
+        })
+    return results
+
+
+def print_shortcut_results(results):
+    print(f"{'backend':>8} {'count':>6} {'total s':>8} {'avg us':>8} {'max us':>8}")
+    for r in results:
+        print(f"{r['backend']:>8} {r['shortcuts']:>6} {r['total_s']:>8.3f} {r['avg_us']:>8.1f} {r['max_us']:>8.1f}")
+
+
+def bench_transfer(size_mb=256, target_dir=None, repeat=3, verify=False):
+    """
+    Пропускная способность копирования файла size_mb МБ каждым доступным
+    способом transfer и через shutil.copyfile. target_dir - папка на
+    другом томе, чтобы измерить межтомовое копирование (по умолчанию -
+    временная папка рядом с исходным файлом).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory(dir=target_dir) as dst_dir:
+        source = os.path.join(tmp, "source.bin")
+        block = os.urandom(1024 * 1024)
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+        target = os.path.join(dst_dir, "target.bin")
+
+        strategies = [(method, lambda m=method: copy_file(source, target, verify, methods=[m]))
+                      for method in available_methods()]
+        strategies.append(("shutil", lambda: shutil.copyfile(source, target)))
+        for name, run in strategies:
+            best = float("inf")
+            for _ in range(repeat):
+                if os.path.exists(target):
+                    os.remove(target)
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            results.append({"method": name, "size_mb": size_mb, "seconds": best,
+                            "mb_per_s": size_mb / best if best else float("inf")})
+    return results
+
+
+def print_transfer_results(results):
+    print(f"{'method':>16} {'MB':>6} {'best s':>8} {'MB/s':>9}")
+    for r in results:
+        print(f"{r['method']:>16} {r['size_mb']:>6} {r['seconds']:>8.3f} {r['mb_per_s']:>9.1f}")
+
+
+def make_desktop(path, items, rules, seed=2):
+    """
+    Создает синтетический рабочий стол в папке path: items элементов,
+    половина из которых подходит под rules (см. make_names). Каждый
+    LARGE_FILE_EVERY-й файл - большой (разреженный, LARGE_FILE_SIZE байт),
+    каждый FOLDER_EVERY-й элемент - папка с вложенными папками и файлами.
+    Возвращает число созданных элементов верхнего уровня.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    names = make_names(rules, items, seed)
+    for i, (name, is_dir) in enumerate(names):
+        item_path = os.path.join(path, name)
+        if is_dir or (i % FOLDER_EVERY == FOLDER_EVERY - 1):
+            if not is_dir:
+                item_path = os.path.join(path, f"folder_{i}")
+            nested = os.path.join(item_path, "nested", "deeper")
+            os.makedirs(nested, exist_ok=True)
+            for j in range(3):
+                with open(os.path.join(nested, f"inner_{j}.txt"), "wb") as f:
+                    f.write(b"x" * rnd.randint(1, 4096))
+            continue
+        if os.path.exists(item_path):
+            continue
+        with open(item_path, "wb") as f:
+            if i % LARGE_FILE_EVERY == 0:
+                f.truncate(LARGE_FILE_SIZE)
+            else:
+                f.write(b"x" * rnd.randint(0, 16 * 1024))
+    return len(os.listdir(path))
+
+
+def _proc_io():
+    """Счетчики системных вызовов чтения и записи процесса (только Linux)"""
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+class _AuditCounter:
+    """Считает файловые операции через аудит-события Python (open, os.*, shutil.*)"""
+
+    def __init__(self):
+        self.counts = {}
+        self.enabled = False
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if self.enabled and (event == "open" or event.startswith(("os.", "shutil."))):
+            self.counts[event] = self.counts.get(event, 0) + 1
+
+
+def run_pipeline_scenario(items, rule_count, workers=4, shortcut_backend="none", history_backend="journal",
+                          trace_memory=False):
+    """
+    Прогоняет полный конвейер сортировки (сканирование, сопоставление,
+    перемещение, ярлыки, история) на синтетическом рабочем столе во
+    временной папке. Рабочая папка процесса меняется на временную, поэтому
+    config.json, история и кэши бенчмарка не смешиваются с настоящими;
+    вызывайте в отдельном процессе (см. bench_pipeline).
+    Возвращает словарь с временем этапов, числом файловых операций и пиковой памятью.
+    """
+    from config_manager import get_default_config, load_config, save_config
+    from file_sorter import plan_sort, execute_plan
+    from scan_state import ScanState, config_fingerprint
+
+    with tempfile.TemporaryDirectory(prefix="organizer_bench_") as tmp:
+        os.chdir(tmp)
+        desktop = os.path.join(tmp, "Desktop")
+        rules = make_rules(rule_count)
+        start = time.perf_counter()
+        top_level = make_desktop(desktop, items, rules)
+        generate_s = time.perf_counter() - start
+
+        # Хранилище конфигурации закэшировало config.json из прежней рабочей
+        # папки: сценарий начинается с настроек по умолчанию, чтобы dedup,
+        # collision_policy, source_roots и прочие настройки пользователя не
+        # влияли на замеры
+        config = get_default_config()
+        config.update({"sorting_rules": rules, "organized_files_dir": os.path.join(tmp, "Organized"),
+                       "shortcut_backend": shortcut_backend, "history_backend": history_backend,
+                       "move_workers": workers, "log_level": "WARNING"})
+        save_config(config)
+        config = load_config()
+
+        audit = _AuditCounter()
+        io_before = _proc_io()
+        if trace_memory:
+            tracemalloc.start()
+        timings = {}
+        audit.enabled = True
+        start = time.perf_counter()
+        scan_state = ScanState(config_fingerprint(config))
+        plan = plan_sort(config=config, scan_state=scan_state, desktop_path=desktop, timings=timings)
+        operation = execute_plan(plan, scan_state, workers, timings=timings)
+        total_s = time.perf_counter() - start
+        audit.enabled = False
+        peak_traced = None
+        if trace_memory:
+            peak_traced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        io_after = _proc_io()
+
+        try:
+            import resource
+            # ru_maxrss: килобайты на Linux, байты на macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_rss_kb = peak_rss // 1024 if sys.platform == "darwin" else peak_rss
+        except ImportError:
+            peak_rss_kb = None
+
+        return {
+            "items": items,
+            "top_level_items": top_level,
+            "rules": rule_count,
+            "workers": workers,
+            "shortcut_backend": shortcut_backend,
+            "history_backend": history_backend,
+            "moved": len(operation["moved_files"]),
+            "generate_s": generate_s,
+            "total_s": total_s,
+            "stages_s": timings,
+            "file_ops": dict(sorted(audit.counts.items())),
+            "file_ops_total": sum(audit.counts.values()),
+            "read_syscalls": io_after.get("syscr", 0) - io_before.get("syscr", 0) if io_before else None,
+            "write_syscalls": io_after.get("syscw", 0) - io_before.get("syscw", 0) if io_before else None,
+            "peak_rss_kb": peak_rss_kb,
+            "peak_traced_bytes": peak_traced,
+        }
+
+
+def bench_pipeline(items_list=PIPELINE_ITEMS, rules_list=PIPELINE_RULES, **options):
+    """Запускает каждый сценарий (items x rules) в отдельном процессе и возвращает результаты"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for items in items_list:
+        for rule_count in rules_list:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_pipeline_scenario, (items, rule_count), options)
+            print_pipeline_results([result], header=not results)
+            results.append(result)
+    return results
+
+
+def print_pipeline_results(results, header=True):
+    stages = ("scan", "match", "move", "shortcuts", "history")
+    if header:
+        print(f"{'items':>7} {'rules':>6} {'total s':>8} " + " ".join(f"{s:>9}" for s in stages)
+              + f" {'file ops':>9} {'rss MB':>7}")
+    for r in results:
+        rss = f"{r['peak_rss_kb'] / 1024:>7.1f}" if r["peak_rss_kb"] is not None else f"{'-':>7}"
+        print(f"{r['items']:>7} {r['rules']:>6} {r['total_s']:>8.3f} "
+              + " ".join(f"{r['stages_s'].get(s, 0.0):>9.3f}" for s in stages)
+              + f" {r['file_ops_total']:>9} {rss}")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    """Сохраняет результаты в JSON вместе с версией кода и окружением для сравнения между коммитами"""
+    data = {
+        "revision": _git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def compare_results(old_path, results):
+    """Печатает изменение общего времени относительно сохраненных результатов"""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    baseline = {(r["items"], r["rules"]): r for r in old["results"]}
+    print(f"Compared with {old.get('revision') or old_path}:")
+    for r in results:
+        before = baseline.get((r["items"], r["rules"]))
+        if before is None:
+            continue
+        ratio = r["total_s"] / before["total_s"] if before["total_s"] else float("inf")
+        print(f"{r['items']:>7} items {r['rules']:>5} rules: {before['total_s']:.3f} s -> {r['total_s']:.3f} s "
+              f"({ratio:.2f}x)")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Desktop Organizer benchmarks")
+    parser.add_argument('--items', type=int, default=5000, help='Number of desktop items to match')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions (best time is reported)')
+    parser.add_argument('--shortcuts', type=int, default=1000, help='Number of shortcuts to create per backend')
+    parser.add_argument('--transfer-mb', type=int, default=256, help='Size of the file copied by the transfer benchmark (MB, 0 to skip)')
+    parser.add_argument('--transfer-dir', help='Target directory for the transfer benchmark (use another volume to measure cross-volume copies)')
+    parser.add_argument('--verify', action='store_true', help='Verify checksums in the transfer benchmark')
+    parser.add_argument('--pipeline', action='store_true', help='Run the full sorting pipeline on synthetic desktops instead of the micro-benchmarks')
+    parser.add_argument('--items-list', type=_int_list, default=list(PIPELINE_ITEMS), help='Pipeline: comma-separated desktop sizes')
+    parser.add_argument('--rules-list', type=_int_list, default=list(PIPELINE_RULES), help='Pipeline: comma-separated rule counts')
+    parser.add_argument('--workers', type=int, default=4, help='Pipeline: number of move workers')
+    parser.add_argument('--shortcut-backend', default='none', help='Pipeline: shortcut backend (none is a no-op stub)')
+    parser.add_argument('--history-backend', choices=['journal', 'sqlite'], default='journal', help='Pipeline: history backend')
+    parser.add_argument('--trace-memory', action='store_true', help='Pipeline: also report peak Python allocations (tracemalloc, slower)')
+    parser.add_argument('--output', help='Pipeline: write results to this JSON file')
+    parser.add_argument('--compare', help='Pipeline: compare with results from an earlier JSON file')
+    args = parser.parse_args()
+
+    if args.pipeline:
+        results = bench_pipeline(args.items_list, args.rules_list, workers=args.workers,
+                                 shortcut_backend=args.shortcut_backend, history_backend=args.history_backend,
+                                 trace_memory=args.trace_memory)
+        if args.output:
+            write_results(args.output, results)
+        if args.compare:
+            compare_results(args.compare, results)
+        return
+
+    print_rule_index_results(bench_rule_index(item_count=args.items, repeat=args.repeat))
+    print()
+    print_shortcut_results(bench_shortcuts(count=args.shortcuts))
+    if args.transfer_mb > 0:
+        print()
+        print_transfer_results(bench_transfer(args.transfer_mb, args.transfer_dir, args.repeat, args.verify))
+
+
+if __name__ == "__main__":
+    main()
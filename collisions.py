@@ -0,0 +1,125 @@
+"""Разрешение конфликтов имен в папках назначения"""
+
+import filecmp
+import os
+import re
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Политики при существующем назначении
+COLLISION_RENAME = "rename"
+COLLISION_OVERWRITE_IF_IDENTICAL = "overwrite_if_identical"
+COLLISION_SKIP = "skip"
+COLLISION_POLICIES = (COLLISION_RENAME, COLLISION_OVERWRITE_IF_IDENTICAL, COLLISION_SKIP)
+
+# Решения по конкретному конфликту (поле collision в PlannedMove)
+RESOLVED_RENAMED = "renamed"
+RESOLVED_OVERWRITE = "overwrite"
+RESOLVED_SKIP = "skip"
+
+# "имя (N).ext" - имя, уже выделенное при прошлых конфликтах
+_SUFFIX_RE = re.compile(r"^(?P<stem>.*) \((?P<n>\d+)\)$")
+
+
+def split_name(name, is_dir=False):
+    """Делит имя на основу и расширение (у папок расширения нет)"""
+    if is_dir:
+        return name, ""
+    stem, ext = os.path.splitext(name)
+    return stem, ext
+
+
+class FolderNameIndex:
+    """
+    Множества существующих имен в папках назначения.
+
+    Каждая папка читается одним scandir при первом обращении, после чего
+    индекс обновляется по мере планирования перемещений. Для каждой пары
+    (основа, расширение) хранится наибольший занятый номер "имя (N)",
+    поэтому свободное имя выделяется без перебора.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._counters = {}
+
+    def _key(self, name):
+        return os.path.normcase(name)
+
+    def _folder(self, folder):
+        names = self._names.get(folder)
+        if names is None:
+            names = set()
+            counters = {}
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        names.add(self._key(entry.name))
+                        self._count(counters, entry.name, entry.is_dir(follow_symlinks=False))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать папку назначения {folder}: {e}")
+            self._names[folder] = names
+            self._counters[folder] = counters
+        return names
+
+    def _count(self, counters, name, is_dir):
+        stem, ext = split_name(name, is_dir)
+        match = _SUFFIX_RE.match(stem)
+        if match:
+            key = (self._key(match.group("stem")), self._key(ext))
+            counters[key] = max(counters.get(key, 0), int(match.group("n")))
+
+    def contains(self, folder, name):
+        return self._key(name) in self._folder(folder)
+
+    def add(self, folder, name, is_dir=False):
+        self._folder(folder).add(self._key(name))
+        self._count(self._counters[folder], name, is_dir)
+
+    def allocate(self, folder, name, is_dir=False):
+        """Свободное имя вида "имя (N).ext" в папке; имя сразу считается занятым"""
+        names = self._folder(folder)
+        stem, ext = split_name(name, is_dir)
+        key = (self._key(stem), self._key(ext))
+        counters = self._counters[folder]
+        n = counters.get(key, 0) + 1
+        candidate = f"{stem} ({n}){ext}"
+        # Счетчик учитывает все имена вида "основа (N)", цикл - только страховка
+        while self._key(candidate) in names:
+            n += 1
+            candidate = f"{stem} ({n}){ext}"
+        counters[key] = n
+        names.add(self._key(candidate))
+        return candidate
+
+
+def is_identical(source, destination):
+    """Совпадает ли файл source с существующим файлом destination"""
+    try:
+        if not (os.path.isfile(source) and os.path.isfile(destination)):
+            return False
+        if os.path.getsize(source) != os.path.getsize(destination):
+            return False
+        return filecmp.cmp(source, destination, shallow=False)
+    except OSError:
+        return False
+
+
+def resolve_collision(policy, name_index, folder, entry):
+    """
+    Определяет имя назначения для элемента entry в папке folder.
+    Возвращает (имя, решение): решение None - конфликта нет, иначе одно из
+    RESOLVED_RENAMED, RESOLVED_OVERWRITE, RESOLVED_SKIP.
+    """
+    name = entry.name
+    if not name_index.contains(folder, name):
+        name_index.add(folder, name, entry.is_dir)
+        return name, None
+    if policy == COLLISION_SKIP:
+        return name, RESOLVED_SKIP
+    if policy == COLLISION_OVERWRITE_IF_IDENTICAL and is_identical(entry.path, os.path.join(folder, name)):
+        return name, RESOLVED_OVERWRITE
+    return name_index.allocate(folder, name, entry.is_dir), RESOLVED_RENAMED
@@ -1,5 +1,8 @@
+import copy
 import json
 import os
+import tempfile
+import threading
 from pathlib import Path
 
 CONFIG_FILE = 'config.json'
@@ -31,34 +34,191 @@ def get_default_config():
         ],
         "organized_files_dir": organized_path,
         "check_interval": 300,
+        "monitor_mode": "interval",
+        "watch_backend": "auto",
+        "watch_debounce": 2,
+        "move_workers": 4,
+        "history_backend": "journal",
+        "shortcut_backend": "auto",
+        "collision_policy": "rename",
+        "dedup_enabled": False,
+        "transfer_verify": False,
+        "source_roots": [],
+        "profiles": [],
+        "io_concurrency": 4,
+        "metrics_port": 0,
+        "profile_cpu": False,
+        "profile_memory": False,
         "folder_shortcut_mode": "Others",
-        "log_level": "INFO"
+        "log_level": "INFO",
+        "log_max_bytes": 1048576,
+        "log_backup_count": 3
     }
 
+# Параметры, для которых None - допустимое значение: folder_shortcut_mode
+# None (или пустая строка) - папки без правил остаются на рабочем столе
+NULLABLE_KEYS = ("folder_shortcut_mode",)
+
+
+def _same_kind(value, default):
+    """Совпадает ли тип значения с типом значения по умолчанию (int и float взаимозаменяемы)"""
+    if isinstance(default, bool) or isinstance(value, bool):
+        return type(value) is type(default)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float))
+    return isinstance(value, type(default))
+
+
+def validate_config(config, default_config):
+    """
+    Дополняет конфигурацию недостающими параметрами и заменяет значения
+    неверного типа значениями по умолчанию
+    """
+    for key, default in default_config.items():
+        if key not in config:
+            config[key] = copy.deepcopy(default)
+        elif config[key] is None and key in NULLABLE_KEYS:
+            continue
+        elif not _same_kind(config[key], default):
+            print(f"Неверное значение параметра {key}: {config[key]!r}, используется значение по умолчанию")
+            config[key] = copy.deepcopy(default)
+    if config["check_interval"] <= 0:
+        config["check_interval"] = default_config["check_interval"]
+    return config
+
+
+class ConfigStore:
+    """
+    Общий для процесса кэш конфигурации.
+
+    Файл перечитывается, только если изменились его mtime или размер.
+    Подписчики (callback(new_config, old_config)) уведомляются, когда
+    обнаружено изменение файла или конфигурация сохранена через save().
+    """
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._config = None
+        self._signature = None
+        self._default_config = None
+        self._subscribers = []
+        # Запись отсутствующего файла не удалась: повторно не пытаемся на каждом чтении
+        self._write_failed = False
+
+    def _defaults(self):
+        if self._default_config is None:
+            self._default_config = get_default_config()
+        return self._default_config
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Возвращает копию актуальной конфигурации"""
+        changed = None
+        with self._lock:
+            signature = self._file_signature()
+            if signature is None:
+                if self._config is None:
+                    self._config = copy.deepcopy(self._defaults())
+                if not self._write_failed:
+                    self._write_failed = not self._write(self._config)
+            elif signature != self._signature:
+                old = self._config
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        config = json.load(f)
+                    if not isinstance(config, dict):
+                        raise ValueError("ожидался объект JSON")
+                    self._config = validate_config(config, self._defaults())
+                    self._signature = signature
+                    if old is not None and old != self._config:
+                        changed = (old, self._config)
+                except Exception as e:
+                    print(f"Ошибка при загрузке конфигурации: {e}")
+                    if self._config is None:
+                        return copy.deepcopy(self._defaults())
+            config = copy.deepcopy(self._config)
+        if changed:
+            self._notify(*changed)
+        return config
+
+    def save(self, config):
+        """Атомарно сохраняет конфигурацию (временный файл + переименование)"""
+        with self._lock:
+            old = self._config
+            self._config = copy.deepcopy(config)
+            self._write_failed = not self._write(self._config)
+        if old is not None and old != config:
+            self._notify(old, self._config)
+
+    def _write(self, config):
+        """Атомарно записывает файл; возвращает True при успехе"""
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=4, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._signature = self._file_signature()
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении конфигурации: {e}")
+            return False
+
+    def subscribe(self, callback):
+        """Подписывает callback(new_config, old_config) на изменения конфигурации"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _notify(self, old, new):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(copy.deepcopy(new), old)
+            except Exception as e:
+                print(f"Ошибка в обработчике изменения конфигурации: {e}")
+
+
+_store = ConfigStore()
+
+
+def get_config_store():
+    """Общий для процесса ConfigStore"""
+    return _store
+
+
 def load_config():
-    """Загружает конфигурацию из файла"""
-    if not os.path.exists(CONFIG_FILE):
-        default_config = get_default_config()
-        save_config(default_config)
-        return default_config
-        
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-            # Проверяем наличие всех необходимых параметров
-            default_config = get_default_config()
-            for key in default_config:
-                if key not in config:
-                    config[key] = default_config[key]
-            return config
-    except Exception as e:
-        print(f"Ошибка при загрузке конфигурации: {e}")
-        return get_default_config()
+    """Загружает конфигурацию (из кэша, если файл не изменился)"""
+    return _store.get()
+
 
 def save_config(config):
     """Сохраняет конфигурацию в файл"""
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"Ошибка при сохранении конфигурации: {e}")
+    _store.save(config)
+
+
+def subscribe(callback):
+    """Подписка на изменения конфигурации, см. ConfigStore.subscribe"""
+    _store.subscribe(callback)
+
+
+def unsubscribe(callback):
+    _store.unsubscribe(callback)
@@ -0,0 +1,176 @@
+"""Поиск дубликатов среди сортируемых файлов"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+HASH_CACHE_FILE = 'hash_cache.json'
+
+# Размер блока в начале и в конце файла для частичного хэша
+PARTIAL_CHUNK = 64 * 1024
+# Размер блока при потоковом чтении для полного хэша
+READ_CHUNK = 1024 * 1024
+# Пустые файлы не считаются дубликатами друг друга
+MIN_SIZE = 1
+
+
+def partial_hash(path, size):
+    """Хэш первых и последних PARTIAL_CHUNK байт файла (вместе с размером)"""
+    h = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_CHUNK))
+        if size > 2 * PARTIAL_CHUNK:
+            f.seek(-PARTIAL_CHUNK, os.SEEK_END)
+            h.update(f.read(PARTIAL_CHUNK))
+        elif size > PARTIAL_CHUNK:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def full_hash(path):
+    """Полный хэш файла, читаемого блоками"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class HashCache:
+    """
+    Кэш хэшей файлов между запусками: ключ - путь, запись действительна,
+    пока у файла те же size и mtime. Хранит частичный и полный хэши.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries or {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=HASH_CACHE_FILE):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f).get("entries", {}))
+        except FileNotFoundError:
+            return cls()
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш хэшей: {e}")
+            return cls()
+
+    def get(self, entry, kind):
+        """Сохраненный хэш вида kind ("partial" или "full") для ScanEntry"""
+        cached = self.entries.get(entry.path)
+        if cached and cached["size"] == entry.size and cached["mtime"] == entry.mtime:
+            return cached.get(kind)
+        return None
+
+    def put(self, entry, kind, digest):
+        cached = self.entries.get(entry.path)
+        if not cached or cached["size"] != entry.size or cached["mtime"] != entry.mtime:
+            cached = self.entries[entry.path] = {"size": entry.size, "mtime": entry.mtime}
+        cached[kind] = digest
+        self.dirty = True
+
+    def prune(self):
+        """Удаляет записи о файлах, которых больше нет"""
+        stale = [path for path in self.entries if not os.path.exists(path)]
+        for path in stale:
+            del self.entries[path]
+        if stale:
+            self.dirty = True
+
+    def save(self, path=HASH_CACHE_FILE):
+        """Сохраняет кэш, если он изменился"""
+        if not self.dirty:
+            return
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"entries": self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.dirty = False
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении кэша хэшей: {e}")
+
+
+def _hash_entries(entries, kind, cache, pool):
+    """Хэши вида kind для записей: из кэша или вычисленные пулом потоков"""
+    digests = {}
+    missing = []
+    for entry in entries:
+        digest = cache.get(entry, kind)
+        if digest is None:
+            missing.append(entry)
+        else:
+            digests[entry.path] = digest
+
+    def compute(entry):
+        try:
+            if kind == "partial":
+                return entry, partial_hash(entry.path, entry.size)
+            return entry, full_hash(entry.path)
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать {entry.path} для поиска дубликатов: {e}")
+            return entry, None
+
+    for entry, digest in pool.map(compute, missing):
+        if digest is not None:
+            cache.put(entry, kind, digest)
+            digests[entry.path] = digest
+    logger.debug("Хэши дубликатов (%s): из кэша %d, вычислено %d", kind, len(entries) - len(missing), len(missing))
+    return digests
+
+
+def _group_by(entries, key):
+    groups = {}
+    for entry in entries:
+        k = key(entry)
+        if k is not None:
+            groups.setdefault(k, []).append(entry)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def find_duplicates(candidates, existing=(), cache=None, workers=4, scope=None):
+    """
+    Ищет дубликаты среди файлов candidates (ScanEntry) и уже существующих
+    файлов existing. Кандидаты группируются по размеру, затем по частичному
+    хэшу начала и конца файла и только потом по полному хэшу.
+    scope(entry) - область сравнения (например, папка назначения): файлы
+    из разных областей дубликатами не считаются.
+    Возвращает список групп одинаковых файлов (списки ScanEntry).
+    """
+    if cache is None:
+        cache = HashCache()
+    if scope is None:
+        def scope(entry):
+            return None
+    candidate_paths = {e.path for e in candidates}
+    pool_entries = [e for e in list(candidates) + list(existing) if e.is_file and e.size >= MIN_SIZE]
+
+    # Группа интересна, только если в ней есть хотя бы один кандидат
+    def with_candidate(groups):
+        return [g for g in groups if any(e.path in candidate_paths for e in g)]
+
+    groups = with_candidate(_group_by(pool_entries, lambda e: (scope(e), e.size)))
+    if not groups:
+        return []
+
+    def regroup(groups, kind, pool):
+        # Все файлы стадии хэшируются пулом за один проход
+        entries = [e for group in groups for e in group]
+        digests = _hash_entries(entries, kind, cache, pool)
+        return with_candidate(_group_by(
+            entries, lambda e: (scope(e), e.size, digests[e.path]) if e.path in digests else None))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hash") as pool:
+        groups = regroup(groups, "partial", pool)
+        # Файлы не больше двух блоков частичный хэш уже покрыл целиком
+        small = [g for g in groups if g[0].size <= 2 * PARTIAL_CHUNK]
+        large = [g for g in groups if g[0].size > 2 * PARTIAL_CHUNK]
+        if large:
+            large = regroup(large, "full", pool)
+    return small + large
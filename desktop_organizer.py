@@ -3,19 +3,54 @@ import time
 import argparse
 from config_manager import load_config, save_config
 from monitor import start_monitoring
-from file_sorter import sort_desktop
+from metrics import start_metrics_server
+from file_sorter import sort_all, plan_sort
+from profiling import profiled, profiling_options
+from sort_plan import format_plan
+from rule_index import RuleIndex, Condition
+from sort_worker import SortWorker, format_event, TERMINAL_EVENTS
 from logger import get_logger
 
 logger = get_logger(__name__)
 
+def run_sort_with_progress(workers, profile=None):
+    """Runs the sort in a background worker and prints its progress events"""
+    worker = SortWorker(workers=workers, profile=profile)
+    worker.start()
+    while True:
+        try:
+            event = worker.next_event(timeout=0.5)
+        except KeyboardInterrupt:
+            print("Cancelling after the current item...")
+            worker.cancel()
+            continue
+        if event is None:
+            continue
+        print(format_event(event))
+        if event["event"] in TERMINAL_EVENTS:
+            break
+    worker.join()
+
 def main():
     parser = argparse.ArgumentParser(description="Desktop Organizer")
-    parser.add_argument('--sort', action='store_true', help='Sort desktop immediately')
+    parser.add_argument('--sort', action='store_true', help='Sort desktop and configured source roots immediately')
+    parser.add_argument('--dry-run', action='store_true', help='Print the sorting plan and its estimated I/O cost without moving anything')
+    parser.add_argument('--progress', action='store_true', help='Print sorting progress (with --sort); Ctrl+C cancels between items')
     parser.add_argument('--monitor', action='store_true', help='Start monitoring desktop and sorting files automatically')
+    parser.add_argument('--monitor-mode', choices=['interval', 'watch'], help='Monitoring mode: periodic full sort or event-driven watcher')
+    parser.add_argument('--watch-backend', choices=['auto', 'inotify', 'polling'], help='Watcher backend for the watch monitoring mode')
+    parser.add_argument('--workers', type=int, help='Number of parallel move workers (overrides move_workers from config)')
     parser.add_argument('--set-interval', type=int, help='Set the interval (in seconds) for checking the desktop')
-    parser.add_argument('--add-rule', metavar=('TYPE', 'EXTENSION', 'FOLDER'), nargs=3, help='Add a new sorting rule (extension or date, extension, folder name)')
+    parser.add_argument('--add-rule', metavar=('TYPE', 'EXTENSION', 'FOLDER'), nargs=3, help='Add a new sorting rule: TYPE (extension, folder, mime, date, size, glob, regex), EXTENSION (extension, folder name, MIME type such as image/*, glob such as Screenshot*.png or regex; "" for any file in date/size rules), FOLDER (may use {year}, {month}, {day} from the file date)')
+    parser.add_argument('--older-than', type=float, metavar='DAYS', help='With --add-rule date/size: only match files modified more than DAYS days ago')
+    parser.add_argument('--newer-than', type=float, metavar='DAYS', help='With --add-rule date/size: only match files modified less than DAYS days ago')
+    parser.add_argument('--min-size', type=str, help='With --add-rule date/size: minimum file size (bytes or e.g. 100MB)')
+    parser.add_argument('--max-size', type=str, help='With --add-rule date/size: maximum file size (bytes or e.g. 100MB)')
     parser.add_argument('--list-rules', action='store_true', help='List current sorting rules')
     parser.add_argument('--remove-rule', type=str, help='Remove a sorting rule by extension')
+    parser.add_argument('--metrics-port', type=int, help='With --monitor: serve Prometheus metrics on http://127.0.0.1:PORT/metrics (overrides metrics_port from config)')
+    parser.add_argument('--profile', action='store_true', help='With --sort or --monitor: profile the sort (or the first monitor cycle) with cProfile; .pstats and a text report are written next to the log')
+    parser.add_argument('--trace-memory', action='store_true', help='With --sort or --monitor: trace allocations with tracemalloc and report the peak and top allocation sites next to the log')
     parser.add_argument('--log-level', type=str, help='Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
 
     args = parser.parse_args()
@@ -33,24 +68,38 @@ def main():
             "extension": extension,
             "folder": folder
         }
+        conditions = {
+            "older_than_days": args.older_than,
+            "newer_than_days": args.newer_than,
+            "min_size": args.min_size,
+            "max_size": args.max_size,
+        }
+        new_rule.update({key: value for key, value in conditions.items() if value is not None})
+        if rule_type in ("date", "size"):
+            try:
+                Condition(0, new_rule, time.time())
+            except (ValueError, TypeError) as e:
+                parser.error(f"invalid rule condition: {e}")
         config['sorting_rules'].append(new_rule)
         save_config(config)
         logger.info("Added new rule: %s", new_rule)
 
     if args.list_rules:
-        rules = config.get('sorting_rules', [])
-        if rules:
+        rule_index = RuleIndex.from_config(config)
+        if rule_index.rules:
             print("Current sorting rules:")
-            for i, r in enumerate(rules, start=1):
-                print(f"{i}. Type: {r['type']}, Extension: {r['extension']}, Folder: {r['folder']}")
+            for i, r in enumerate(rule_index.rules, start=1):
+                conditions = RuleIndex.describe_conditions(r)
+                suffix = f", Conditions: {conditions}" if conditions else ""
+                print(f"{i}. Type: {r['type']}, Extension: {r.get('extension', '')}, Folder: {r['folder']}{suffix}")
         else:
             print("No sorting rules found.")
 
     if args.remove_rule:
         extension_to_remove = args.remove_rule
-        rules = config.get('sorting_rules', [])
-        new_rules = [r for r in rules if r['extension'].lower() != extension_to_remove.lower()]
-        if len(new_rules) < len(rules):
+        rule_index = RuleIndex.from_config(config)
+        new_rules = rule_index.without_extension(extension_to_remove)
+        if len(new_rules) < len(rule_index):
             config['sorting_rules'] = new_rules
             save_config(config)
             logger.info("Removed rule for extension: %s", extension_to_remove)
@@ -62,11 +111,29 @@ def main():
         save_config(config)
         logger.info("Log level set to %s", config['log_level'])
 
-    if args.sort:
-        sort_desktop()
+    profile = profiling_options(config, args.profile, args.trace_memory)
+
+    if args.dry_run:
+        plan = plan_sort()
+        if plan is None:
+            print("Could not build the sorting plan, see the log for details.")
+        else:
+            print(format_plan(plan))
+    elif args.sort:
+        if args.progress:
+            run_sort_with_progress(args.workers, profile)
+        else:
+            with profiled("sort", *profile):
+                sort_all(workers=args.workers)
 
     if args.monitor:
-        start_monitoring()
+        metrics_port = args.metrics_port if args.metrics_port is not None else config.get('metrics_port', 0)
+        if metrics_port:
+            try:
+                start_metrics_server(metrics_port)
+            except OSError as e:
+                parser.error(f"cannot serve metrics on port {metrics_port}: {e}")
+        start_monitoring(mode=args.monitor_mode, backend=args.watch_backend, workers=args.workers, profile=profile)
         try:
             while True:
                 time.sleep(1)
@@ -5,19 +5,31 @@ Licensed under the MIT License - see LICENSE file for details
 """
 
 import os
+import re
 import time
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from config_manager import load_config, save_config
-from file_sorter import sort_desktop
+from file_sorter import sort_all
+from monitor import start_watching, CONFIG_POLL_INTERVAL
+from sort_worker import SortWorker, TERMINAL_EVENTS
+from rule_index import RuleIndex
 from logger import get_logger
-from history_manager import load_history, save_history
+from history_manager import (count_operations, list_operations, get_operation_categories, get_operation_moves,
+                             get_operation_duplicates)
+from revert import RevertWorker
+from sort_plan import format_size
+from metrics import load_recent_runs
 import threading
-import datetime
-import shutil
+import queue
 
 logger = get_logger(__name__)
 
+# Сколько операций истории загружается за раз
+HISTORY_PAGE_SIZE = 50
+# Сколько последних запусков показывается на вкладке статистики
+STATS_RUNS_LIMIT = 100
+
 class DesktopOrganizerGUI(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -28,8 +40,17 @@ class DesktopOrganizerGUI(tk.Tk):
         
         self.config_data = load_config()
         self.monitor_thread = None
+        self.desktop_watcher = None
+        self.sort_worker = None
+        self.revert_worker = None
+        self.history_nodes = {}
         self.monitoring = False
         
+        # Вызовы из фоновых потоков, выполняемые в потоке Tk
+        self.ui_queue = queue.Queue()
+        self.history_offset = 0
+        self.history_last_id = 0
+        
         # Стили
         style = ttk.Style(self)
         style.theme_use('classic')
@@ -49,10 +70,12 @@ class DesktopOrganizerGUI(tk.Tk):
         self.create_rules_tab()
         self.create_settings_tab()
         self.create_history_tab()
+        self.create_stats_tab()
         self.create_control_tab()
 
         # Загружаем текущие настройки и обновляем UI
         self.load_current_config()
+        self.process_ui_queue()
         
     def create_rules_tab(self):
         self.rules_tab = ttk.Frame(self.notebook, padding="10")
@@ -132,6 +155,20 @@ class DesktopOrganizerGUI(tk.Tk):
         folder_mode_others_rb.pack(anchor=tk.W, pady=2)
         folder_mode_per_folder_rb.pack(anchor=tk.W, pady=2)
 
+        # Режим мониторинга
+        monitor_mode_label = ttk.Label(settings_frame, text="Режим мониторинга:")
+        monitor_mode_label.grid(row=3, column=0, sticky=tk.W, pady=5)
+
+        self.monitor_mode = tk.StringVar(value=self.config_data.get("monitor_mode", "interval"))
+        monitor_mode_frame = ttk.Frame(settings_frame)
+        monitor_mode_frame.grid(row=3, column=1, columnspan=2, sticky=tk.W, pady=5)
+
+        monitor_mode_interval_rb = ttk.Radiobutton(monitor_mode_frame, text="Проверять по интервалу", variable=self.monitor_mode, value="interval")
+        monitor_mode_watch_rb = ttk.Radiobutton(monitor_mode_frame, text="Отслеживать изменения", variable=self.monitor_mode, value="watch")
+
+        monitor_mode_interval_rb.pack(anchor=tk.W, pady=2)
+        monitor_mode_watch_rb.pack(anchor=tk.W, pady=2)
+
         # Buttons Frame
         buttons_frame = ttk.Frame(self.settings_tab, padding="10")
         buttons_frame.pack(fill=tk.X, side=tk.BOTTOM)
@@ -142,6 +179,9 @@ class DesktopOrganizerGUI(tk.Tk):
         save_folder_mode_button = ttk.Button(buttons_frame, text="Сохранить настройку папок", command=self.save_folder_mode, style='TButton')
         save_folder_mode_button.pack(side=tk.LEFT, padx=5, pady=10)
 
+        save_monitor_mode_button = ttk.Button(buttons_frame, text="Сохранить режим мониторинга", command=self.save_monitor_mode, style='TButton')
+        save_monitor_mode_button.pack(side=tk.LEFT, padx=5, pady=10)
+
         choose_dir_button = ttk.Button(buttons_frame, text="Выбрать директорию", command=self.choose_destination_dir, style='TButton')
         choose_dir_button.pack(side=tk.LEFT, padx=5, pady=10)
 
@@ -165,6 +205,12 @@ class DesktopOrganizerGUI(tk.Tk):
         self.history_tree.column("timestamp", width=250, anchor=tk.W)
         self.history_tree.column("details", width=350, anchor=tk.W)
         self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.history_tree.bind("<<TreeviewOpen>>", self.on_history_open)
+
+        # Настройка стилей для дерева
+        style = ttk.Style()
+        style.configure("History.Treeview", font=('Consolas', 10))  # Моноширинный шрифт
+        self.history_tree.configure(style="History.Treeview")
 
         # Горизонтальная прокрутка
         h_scroll = ttk.Scrollbar(history_frame, orient=tk.HORIZONTAL, command=self.history_tree.xview)
@@ -186,6 +232,52 @@ class DesktopOrganizerGUI(tk.Tk):
         self.revert_history_button = ttk.Button(history_buttons_frame, text="Откатить выбранное", command=self.revert_selected_history, style='TButton')
         self.revert_history_button.pack(side=tk.LEFT, padx=5)
 
+        self.load_more_history_button = ttk.Button(history_buttons_frame, text="Загрузить более ранние", command=self.load_older_history, style='TButton')
+        self.load_more_history_button.pack(side=tk.LEFT, padx=5)
+
+        self.revert_progress_label = ttk.Label(history_buttons_frame, text="")
+        self.revert_progress_label.pack(side=tk.LEFT, padx=5)
+
+    def create_stats_tab(self):
+        self.stats_tab = ttk.Frame(self.notebook, padding="10")
+        self.notebook.add(self.stats_tab, text="Статистика")
+
+        header_label = ttk.Label(self.stats_tab, text="Последние запуски сортировки", style='Header.TLabel')
+        header_label.pack(pady=10)
+
+        stats_frame = ttk.Frame(self.stats_tab)
+        stats_frame.pack(fill=tk.BOTH, expand=True)
+
+        columns = ("timestamp", "source", "scanned", "moved", "size", "duration", "stages")
+        self.stats_tree = ttk.Treeview(stats_frame, columns=columns, show="headings")
+        for column, text, width in (("timestamp", "Время", 140), ("source", "Источник", 120),
+                                    ("scanned", "Просмотрено", 80), ("moved", "Перемещено", 80),
+                                    ("size", "Объём", 80), ("duration", "Длительность", 90),
+                                    ("stages", "Этапы", 300)):
+            self.stats_tree.heading(column, text=text)
+            self.stats_tree.column(column, width=width, anchor=tk.W)
+        self.stats_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        stats_scroll = ttk.Scrollbar(stats_frame, orient=tk.VERTICAL, command=self.stats_tree.yview)
+        stats_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.stats_tree.configure(yscrollcommand=stats_scroll.set)
+
+        refresh_stats_button = ttk.Button(self.stats_tab, text="Обновить", command=self.refresh_stats, style='TButton')
+        refresh_stats_button.pack(pady=10)
+
+    def refresh_stats(self):
+        # Последние запуски из журнала метрик, новые сверху
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for run in reversed(load_recent_runs(STATS_RUNS_LIMIT)):
+            counters = run.get("counters", {})
+            stages = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in run.get("stages", {}).items())
+            source = run.get("source", "")
+            if run.get("cancelled"):
+                source += " (отменен)"
+            self.stats_tree.insert("", tk.END, values=(
+                run.get("timestamp", ""), source, counters.get("scanned", 0), counters.get("moved", 0),
+                format_size(counters.get("bytes_moved", 0)), f"{run.get('duration', 0):.2f} с", stages))
+
     def create_control_tab(self):
         self.control_tab = ttk.Frame(self.notebook, padding="10")
         self.notebook.add(self.control_tab, text="Управление")
@@ -209,6 +301,19 @@ class DesktopOrganizerGUI(tk.Tk):
         self.status_label = ttk.Label(control_frame, text="Статус: Ожидание...", foreground="#333333")
         self.status_label.pack(side=tk.RIGHT)
 
+        # Ход сортировки
+        progress_frame = ttk.Frame(self.control_tab, padding="10")
+        progress_frame.pack(fill=tk.X, pady=5)
+
+        self.sort_progress = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.sort_progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+
+        self.cancel_sort_button = ttk.Button(progress_frame, text="Отменить", command=self.cancel_sort, style='TButton', state=tk.DISABLED)
+        self.cancel_sort_button.pack(side=tk.RIGHT, padx=5)
+
+        self.progress_label = ttk.Label(self.control_tab, text="", foreground="#333333")
+        self.progress_label.pack(fill=tk.X, padx=15)
+
     def load_current_config(self):
         # Очистить список правил
         for row in self.rules_tree.get_children():
@@ -216,14 +321,20 @@ class DesktopOrganizerGUI(tk.Tk):
         
         # Добавить правила из конфигурации
         for rule in self.config_data.get("sorting_rules", []):
-            self.rules_tree.insert("", tk.END, values=(rule["type"], rule["extension"], rule["folder"]))
+            extension = rule.get("extension", "")
+            conditions = RuleIndex.describe_conditions(rule)
+            if conditions:
+                extension = f"{extension} ({conditions})" if extension else conditions
+            self.rules_tree.insert("", tk.END, values=(rule["type"], extension, rule["folder"]))
         
         self.interval_var.set(self.config_data.get("check_interval", 300))
         self.destination_var.set(self.config_data.get("destination_dir", ""))
         self.folder_shortcut_mode.set(self.config_data.get("folder_shortcut_mode", "others"))
+        self.monitor_mode.set(self.config_data.get("monitor_mode", "interval"))
 
         # Обновляем вкладку "История"
         self.refresh_history()
+        self.refresh_stats()
         
     def add_rule_popup(self):
         popup = tk.Toplevel(self)
@@ -235,10 +346,10 @@ class DesktopOrganizerGUI(tk.Tk):
         rule_type_label.pack(pady=5)
         
         rule_type_var = tk.StringVar(value="extension")
-        rule_type_combo = ttk.Combobox(popup, textvariable=rule_type_var, values=["extension", "folder"], state="readonly")
+        rule_type_combo = ttk.Combobox(popup, textvariable=rule_type_var, values=["extension", "folder", "mime", "glob", "regex"], state="readonly")
         rule_type_combo.pack(pady=5)
         
-        extension_label = ttk.Label(popup, text="Расширение файла/название папки:")
+        extension_label = ttk.Label(popup, text="Расширение/папка/MIME-тип/шаблон:")
         extension_label.pack(pady=5)
         
         extension_var = tk.StringVar(value="")
@@ -265,9 +376,21 @@ class DesktopOrganizerGUI(tk.Tk):
                 messagebox.showerror("Ошибка", "Пожалуйста, заполните все поля.")
                 return
 
+            if rule_type == "mime" and "/" not in extension:
+                messagebox.showerror("Ошибка", "MIME-тип должен содержать '/', например: application/pdf или image/*")
+                return
+
+            if rule_type == "regex":
+                try:
+                    re.compile(extension)
+                except re.error as e:
+                    messagebox.showerror("Ошибка", f"Неверное регулярное выражение: {e}")
+                    return
+
             new_rule = {
                 "type": rule_type,
-                "extension": extension.lower(),
+                # Шаблоны сохраняются как есть: в regex регистр важен (\D и \d)
+                "extension": extension if rule_type in ("glob", "regex") else extension.lower(),
                 "folder": folder
             }
             self.config_data["sorting_rules"].append(new_rule)
@@ -283,14 +406,16 @@ class DesktopOrganizerGUI(tk.Tk):
         if not selected_item:
             messagebox.showerror("Ошибка", "Выберите правило для удаления.")
             return
-        item_values = self.rules_tree.item(selected_item, "values")
-        extension_to_remove = item_values[1]  # Расширение файла/название папки
-
-        new_rules = [r for r in self.config_data.get('sorting_rules', []) if r['extension'].lower() != extension_to_remove.lower()]
-        self.config_data['sorting_rules'] = new_rules
+        # Строки таблицы идут в порядке списка правил; у правил date/size
+        # в колонке расширения показаны и условия, поэтому удаляем по позиции
+        position = self.rules_tree.index(selected_item[0])
+        rules = self.config_data.get('sorting_rules', [])
+        if position >= len(rules):
+            return
+        removed = rules.pop(position)
         save_config(self.config_data)
         self.load_current_config()
-        messagebox.showinfo("Успех", f"Правило для {extension_to_remove} удалено.")
+        messagebox.showinfo("Успех", f"Правило для {removed.get('extension') or removed['folder']} удалено.")
         
     def save_interval(self):
         interval_value = self.interval_var.get()
@@ -322,13 +447,76 @@ class DesktopOrganizerGUI(tk.Tk):
             f"Настройка обработки папок установлена: {message}"
         )
         
+    def save_monitor_mode(self):
+        mode_value = self.monitor_mode.get()
+        self.config_data['monitor_mode'] = mode_value
+        save_config(self.config_data)
+        if mode_value == 'watch':
+            message = 'Отслеживать изменения'
+        else:
+            message = 'Проверять по интервалу'
+        messagebox.showinfo(
+            "Успех",
+            f"Режим мониторинга установлен: {message}. Изменение вступит в силу при следующем запуске мониторинга."
+        )
+
     def sort_desktop_now(self):
         if not self.destination_var.get():
             messagebox.showwarning("Внимание", "Пожалуйста, выберите директорию для организованных файлов.")
             return
-        sort_desktop()
-        messagebox.showinfo("Успех", "Рабочий стол отсортирован.")
-        self.refresh_history()
+        if self.sort_worker is not None:
+            return
+        self.sort_worker = SortWorker()
+        self.sort_worker.start()
+        self.sort_button.configure(state=tk.DISABLED)
+        self.cancel_sort_button.configure(state=tk.NORMAL)
+        self.sort_progress.configure(mode='indeterminate')
+        self.sort_progress.start(10)
+        self.progress_label.configure(text="Сканирование рабочего стола...")
+        self.after(100, self.poll_sort_progress)
+
+    def poll_sort_progress(self):
+        # Обрабатывает события фоновой сортировки в потоке Tk
+        for event in self.sort_worker.poll():
+            kind = event["event"]
+            if kind == "scanned":
+                self.progress_label.configure(text=f"Найдено элементов: {event['scanned']}")
+            elif kind == "matched":
+                self.sort_progress.stop()
+                self.sort_progress.configure(mode='determinate', maximum=max(event["matched"], 1), value=0)
+                self.progress_label.configure(text=f"К перемещению: {event['matched']}")
+            elif kind == "moved":
+                self.sort_progress.configure(value=event["moved"])
+                self.progress_label.configure(
+                    text=f"Перемещено {event['moved']} из {event['matched']} ({event['bytes'] // 1024} КБ): {event['name']}")
+            elif kind in TERMINAL_EVENTS:
+                self.finish_sort(event)
+                return
+        self.after(100, self.poll_sort_progress)
+
+    def finish_sort(self, event):
+        self.sort_worker = None
+        self.sort_progress.stop()
+        self.sort_button.configure(state=tk.NORMAL)
+        self.cancel_sort_button.configure(state=tk.DISABLED)
+        if event["event"] == "error":
+            self.progress_label.configure(text="")
+            messagebox.showerror("Ошибка", f"Ошибка при сортировке: {event['error']}")
+            return
+        self.append_new_history()
+        self.refresh_stats()
+        if event["cancelled"]:
+            self.progress_label.configure(text=f"Сортировка отменена. Перемещено: {event['moved']}")
+            messagebox.showinfo("Отменено", f"Сортировка отменена. Перемещено объектов: {event['moved']}.")
+        else:
+            self.progress_label.configure(text=f"Перемещено: {event['moved']}")
+            messagebox.showinfo("Успех", "Рабочий стол отсортирован.")
+
+    def cancel_sort(self):
+        if self.sort_worker is not None:
+            self.sort_worker.cancel()
+            self.cancel_sort_button.configure(state=tk.DISABLED)
+            self.progress_label.configure(text="Отмена после текущего элемента...")
         
     def toggle_monitoring(self):
         if not self.monitoring:
@@ -338,72 +526,148 @@ class DesktopOrganizerGUI(tk.Tk):
             self.monitoring = True
             self.monitor_button.configure(text="Остановить мониторинг")
             self.status_label.configure(text="Статус: Мониторинг включён", foreground="#007AFF")
-            self.monitor_thread = threading.Thread(target=self.monitor_desktop_loop, daemon=True)
-            self.monitor_thread.start()
+            if self.monitor_mode.get() == "watch":
+                self.desktop_watcher = start_watching(
+                    on_sorted=lambda: self.run_on_ui_thread(self.append_new_history))
+            else:
+                self.monitor_thread = threading.Thread(target=self.monitor_desktop_loop, daemon=True)
+                self.monitor_thread.start()
         else:
             self.monitoring = False
+            if self.desktop_watcher is not None:
+                self.desktop_watcher.stop()
+                self.desktop_watcher = None
             self.monitor_button.configure(text="Начать мониторинг")
             self.status_label.configure(text="Статус: Мониторинг остановлен", foreground="#d32f2f")
             
     def monitor_desktop_loop(self):
-        interval = self.config_data.get("check_interval", 300)
         while self.monitoring:
-            sort_desktop()
-            self.refresh_history()
-            time.sleep(interval)
+            sort_all()
+            self.run_on_ui_thread(self.append_new_history)
+            started = time.monotonic()
+            while self.monitoring:
+                # Интервал перечитывается через общий кэш конфигурации, изменения применяются сразу
+                remaining = load_config().get("check_interval", 300) - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, CONFIG_POLL_INTERVAL))
 
     def refresh_history(self):
-        # Обновляет историю в UI, сохраняя текущее состояние раскрытия дерева
+        # Полностью перестраивает историю в UI, сохраняя состояние раскрытия дерева.
+        # Загружаются только корневые узлы последней страницы операций,
+        # категории и файлы подгружаются при раскрытии узла
         expanded_nodes = self.get_expanded_nodes(self.history_tree)
         
-        history = load_history()
         self.history_tree.delete(*self.history_tree.get_children())
+        # Что стоит за каждым узлом дерева: операция, категория или файл
+        self.history_nodes = {}
         
-        # Настройка стилей для дерева
-        style = ttk.Style()
-        style.configure("History.Treeview", font=('Consolas', 10))  # Моноширинный шрифт
-        self.history_tree.configure(style="History.Treeview")
-        
-        for i, entry in enumerate(history):
-            timestamp = entry["timestamp"]
-            moved_files = entry["moved_files"]
-            
-            # Группируем файлы по папке назначения
-            grouped_files = {}
-            for old_path, new_path in moved_files:
-                folder_name = os.path.basename(os.path.dirname(new_path))
-                if folder_name not in grouped_files:
-                    grouped_files[folder_name] = []
-                grouped_files[folder_name].append((old_path, new_path))
-            
-            # Добавляем корневой элемент для каждой записи истории (по времени)
-            entry_id = self.history_tree.insert("", tk.END, iid=f"entry_{i}", 
-                                              values=(f"📅 Операция {i+1} - {timestamp}", ""))
-            
-            # Добавляем категории и файлы с отступами
-            for category, files in grouped_files.items():
-                # Добавляем узел категории с иконкой папки
-                category_node_id = self.history_tree.insert(entry_id, tk.END, 
-                    values=(f"    📁 {category} ({len(files)} файлов)", ""))
-                
-                # Добавляем файлы с дополнительным отступом и иконкой файла
-                for file_info in files:
-                    old_path, new_path = file_info
-                    file_name = os.path.basename(new_path)
-                    # Определяем иконку на основе расширения файла
-                    icon = self.get_file_icon(file_name)
-                    self.history_tree.insert(category_node_id, tk.END, 
-                        values=(f"        {icon} {file_name}", 
-                               f"🔄 {old_path} ➜ {new_path}"))
+        total = count_operations()
+        self.history_offset = max(0, total - HISTORY_PAGE_SIZE)
+        self.history_last_id = 0
+        self.insert_history_operations(list_operations(offset=self.history_offset), self.history_offset, tk.END)
+        self.update_load_more_button()
 
         # Восстановление состояния раскрытия дерева
         self.restore_expanded_nodes(self.history_tree, expanded_nodes)
-        
-        # Автоматически раскрываем все узлы для лучшей видимости
-        for item in self.history_tree.get_children():
-            self.history_tree.item(item, open=True)
-            for child in self.history_tree.get_children(item):
-                self.history_tree.item(child, open=True)
+
+    def append_new_history(self):
+        # Добавляет в дерево только операции, появившиеся после последней загруженной
+        new_operations = list_operations(after_id=self.history_last_id)
+        first_number = self.history_offset + len(self.history_tree.get_children())
+        self.insert_history_operations(new_operations, first_number, tk.END)
+
+    def load_older_history(self):
+        # Подгружает предыдущую страницу операций в начало дерева
+        if self.history_offset == 0:
+            return
+        new_offset = max(0, self.history_offset - HISTORY_PAGE_SIZE)
+        operations = list_operations(offset=new_offset, limit=self.history_offset - new_offset)
+        self.history_offset = new_offset
+        self.insert_history_operations(operations, new_offset, 0)
+        self.update_load_more_button()
+
+    def update_load_more_button(self):
+        state = tk.NORMAL if self.history_offset > 0 else tk.DISABLED
+        self.load_more_history_button.configure(state=state)
+
+    def insert_history_operations(self, operations, first_number, position):
+        # Вставляет корневые узлы операций с заглушкой для ленивой загрузки
+        for i, operation in enumerate(operations):
+            op_id = operation["id"]
+            profile = f" [{operation['profile']}]" if operation.get("profile") else ""
+            entry_id = self.history_tree.insert("", tk.END if position == tk.END else position + i,
+                                                iid=f"entry_{op_id}",
+                                                values=(f"📅 Операция {first_number + i + 1} - {operation['timestamp']}{profile}",
+                                                        f"{operation['move_count'] + operation['duplicate_count']} объектов"))
+            self.history_nodes[entry_id] = ("entry", op_id)
+            self.history_tree.insert(entry_id, tk.END, iid=f"{entry_id}_placeholder", values=("⏳", ""))
+            self.history_last_id = max(self.history_last_id, op_id)
+
+    def on_history_open(self, event=None):
+        # Подгружает дочерние узлы раскрываемой операции или категории
+        self.populate_history_node(self.history_tree.focus())
+
+    def populate_history_node(self, node_id):
+        placeholder = f"{node_id}_placeholder"
+        if not self.history_tree.exists(placeholder):
+            return
+        self.history_tree.delete(placeholder)
+
+        node = self.history_nodes.get(node_id)
+        if node is None:
+            return
+        if node[0] == "entry":
+            op_id = node[1]
+            # Добавляем категории с иконкой папки
+            for n, (category, count) in enumerate(get_operation_categories(op_id)):
+                category_node_id = self.history_tree.insert(node_id, tk.END, iid=f"cat_{op_id}_{n}",
+                    values=(f"    📁 {category} ({count} файлов)", ""))
+                self.history_nodes[category_node_id] = ("category", op_id, category)
+                self.history_tree.insert(category_node_id, tk.END, iid=f"{category_node_id}_placeholder",
+                                         values=("⏳", ""))
+            duplicates = get_operation_duplicates(op_id)
+            if duplicates:
+                duplicates_node_id = self.history_tree.insert(node_id, tk.END, iid=f"dup_{op_id}",
+                    values=(f"    🗐 Дубликаты ({len(duplicates)} файлов)", ""))
+                self.history_nodes[duplicates_node_id] = ("duplicates", op_id)
+                self.history_tree.insert(duplicates_node_id, tk.END, iid=f"{duplicates_node_id}_placeholder",
+                                         values=("⏳", ""))
+        elif node[0] == "duplicates":
+            op_id = node[1]
+            # Удаленные дубликаты со ссылкой на оставленную копию
+            for original_path, kept_path in get_operation_duplicates(op_id):
+                file_name = os.path.basename(original_path)
+                icon = self.get_file_icon(file_name)
+                file_node_id = self.history_tree.insert(node_id, tk.END,
+                    values=(f"        {icon} {file_name}",
+                           f"🗐 {original_path} = {kept_path}"))
+                self.history_nodes[file_node_id] = ("duplicate", op_id, original_path, kept_path)
+        elif node[0] == "category":
+            op_id, category = node[1], node[2]
+            # Добавляем файлы с дополнительным отступом и иконкой файла
+            for old_path, new_path in get_operation_moves(op_id, category):
+                file_name = os.path.basename(new_path)
+                # Определяем иконку на основе расширения файла
+                icon = self.get_file_icon(file_name)
+                file_node_id = self.history_tree.insert(node_id, tk.END, 
+                    values=(f"        {icon} {file_name}", 
+                           f"🔄 {old_path} ➜ {new_path}"))
+                self.history_nodes[file_node_id] = ("file", op_id, old_path, new_path)
+
+    def run_on_ui_thread(self, func, *args):
+        # Передаёт вызов из фонового потока в поток Tk
+        self.ui_queue.put((func, args))
+
+    def process_ui_queue(self):
+        # Выполняет вызовы, переданные фоновыми потоками
+        try:
+            while True:
+                func, args = self.ui_queue.get_nowait()
+                func(*args)
+        except queue.Empty:
+            pass
+        self.after(100, self.process_ui_queue)
 
     def get_file_icon(self, file_name):
         """Возвращает иконку в зависимости от типа файла"""
@@ -432,136 +696,89 @@ class DesktopOrganizerGUI(tk.Tk):
         return icons.get(ext, '📄')  # если расширение не найдено, возвращаем стандартную иконку
 
     def revert_selected_history(self):
+        if self.revert_worker is not None:
+            return
         selected_item = self.history_tree.selection()
         if not selected_item:
             messagebox.showerror("Ошибка", "Выберите операцию или файл для отката.")
             return
         
-        history = load_history()
-        
-        # Идентификатор выбранного элемента
-        selected_id = selected_item[0]
+        # Определяем тип узла (операция, категория, файл)
+        node = self.history_nodes.get(selected_item[0])
+        if node is None:
+            messagebox.showerror("Ошибка", "Не удалось определить операцию в истории.")
+            return
         
-        # Определяем тип узла (entry_*, категория, файл)
-        if selected_id.startswith("entry_"):
-            # Откат всей операции
-            entry_index = int(selected_id.replace("entry_", ""))
-            if entry_index < len(history):
-                entry = history[entry_index]
-                self.revert_entry(entry)
-                # Удаляем операцию из истории только если все файлы откатаны
-                if not entry["moved_files"]:
-                    history.pop(entry_index)
-                save_history(history)
-                self.refresh_history()
-                messagebox.showinfo("Успех", "Операция успешно откатана и файлы возвращены.")
-            else:
+        kind, op_id = node[0], node[1]
+        moves, duplicates = [], []
+        if kind == "entry":
+            # Откат всей операции; операция исчезает из истории, когда откатаны все её файлы
+            moves = get_operation_moves(op_id)
+            duplicates = get_operation_duplicates(op_id)
+            if not moves and not duplicates:
                 messagebox.showerror("Ошибка", "Не удалось найти выбранную операцию в истории.")
+                return
+            success = "Операция успешно откатана и файлы возвращены."
+        elif kind == "category":
+            # Откат только файлов этой категории
+            category_name = node[2]
+            moves = get_operation_moves(op_id, category_name)
+            success = f"Откатаны все объекты из категории {category_name}."
+        elif kind == "duplicates":
+            # Восстановление всех дубликатов операции
+            duplicates = get_operation_duplicates(op_id)
+            success = "Дубликаты восстановлены."
+        elif kind == "duplicate":
+            original_path, kept_path = node[2], node[3]
+            duplicates = [[original_path, kept_path]]
+            success = f"Дубликат {os.path.basename(original_path)} восстановлен."
         else:
-            # Узел категории или файл
-            parent_id = self.history_tree.parent(selected_id)
-            if not parent_id:
-                # Если нет родителя, это корневой элемент - откатываем всю операцию
-                entry_index = self.get_entry_index_from_node(selected_id)
-                if entry_index < len(history):
-                    entry = history[entry_index]
-                    self.revert_entry(entry)
-                    # Удаляем операцию из истории только если все файлы откатаны
-                    if not entry["moved_files"]:
-                        history.pop(entry_index)
-                    save_history(history)
-                    self.refresh_history()
-                    messagebox.showinfo("Успех", "Операция успешно откатана и файлы возвращены.")
-                else:
-                    messagebox.showerror("Ошибка", "Не удалось найти операцию в истории.")
+            # Откат отдельного файла
+            old_path, new_path = node[2], node[3]
+            moves = [[old_path, new_path]]
+            success = f"Объект {os.path.basename(new_path)} откатан."
+
+        # План и перемещения выполняются в фоне, окно остается отзывчивым
+        self.revert_worker = RevertWorker(op_id, moves, duplicates)
+        self.revert_worker.start()
+        self.revert_history_button.configure(state=tk.DISABLED)
+        self.revert_progress_label.configure(text="Подготовка отката...")
+        self.after(100, self.poll_revert_progress, success)
+
+    def poll_revert_progress(self, success):
+        # Обрабатывает события фонового отката в потоке Tk
+        for event in self.revert_worker.poll():
+            kind = event["event"]
+            if kind == "planned":
+                self.revert_progress_label.configure(text=f"К откату: {event['total']}")
+            elif kind == "reverted":
+                self.revert_progress_label.configure(
+                    text=f"Откатано {event['reverted']} из {event['total']}: {event['name']}")
+            elif kind in TERMINAL_EVENTS:
+                self.finish_revert(event, success)
                 return
+        self.after(100, self.poll_revert_progress, success)
 
-            if parent_id.startswith("entry_"):
-                # Это категория
-                entry_index = int(parent_id.replace("entry_", ""))
-                if entry_index < len(history):
-                    entry = history[entry_index]
-                    category_name = self.history_tree.item(selected_id, "values")[0].replace("Категория: ", "")
-                    # Откат только файлов этой категории
-                    self.revert_category(entry, category_name)
-                    # Удаляем операцию из истории только если все файлы откатаны
-                    if not entry["moved_files"]:
-                        history.pop(entry_index)
-                    save_history(history)
-                    self.refresh_history()
-                    messagebox.showinfo("Успех", f"Откатаны все объекты из категории {category_name}.")
-                else:
-                    messagebox.showerror("Ошибка", "Не удалось найти операцию в истории.")
-            else:
-                # Файл
-                grand_parent_id = self.history_tree.parent(parent_id)
-                if not grand_parent_id.startswith("entry_"):
-                    messagebox.showerror("Ошибка", "Не удалось определить операцию в истории.")
-                    return
-                entry_index = int(grand_parent_id.replace("entry_", ""))
-                if entry_index < len(history):
-                    entry = history[entry_index]
-                    file_values = self.history_tree.item(selected_id, "values")
-                    if file_values:
-                        # file_values[0] - имя файла/папки, file_values[1] - старый->новый путь
-                        paths = file_values[1].split(" -> ")
-                        if len(paths) == 2:
-                            old_path, new_path = paths
-                            # Откат отдельного файла
-                            self.revert_file(entry, old_path, new_path)
-                            # Удаляем операцию из истории только если все файлы откатаны
-                            if not entry["moved_files"]:
-                                history.pop(entry_index)
-                            save_history(history)
-                            self.refresh_history()
-                            messagebox.showinfo("Успех", f"Объект {os.path.basename(new_path)} откатан.")
-                else:
-                    messagebox.showerror("Ошибка", "Не удалось найти операцию в истории.")
-
-    def revert_entry(self, entry):
-        # Откатывает всю операцию
-        files_to_remove = []
-        for file_info in entry["moved_files"]:
-            old_path, new_path = file_info
-            if self.revert_file_movement(old_path, new_path):
-                files_to_remove.append(file_info)
-        for f in files_to_remove:
-            entry["moved_files"].remove(f)
-
-    def revert_category(self, entry, category_name):
-        # Откатывает все файлы в категории
-        moved_files = entry["moved_files"]
-        files_to_remove = []
-        for file_info in moved_files:
-            old_path, new_path = file_info
-            folder_name = os.path.basename(os.path.dirname(new_path))
-            if folder_name == category_name:
-                if self.revert_file_movement(old_path, new_path):
-                    files_to_remove.append(file_info)
-        
-        # Удаляем откатанные файлы из списка
-        for f in files_to_remove:
-            moved_files.remove(f)
-
-    def revert_file(self, entry, old_path, new_path):
-        # Откатывает отдельный файл
-        moved_files = entry["moved_files"]
-        for file_info in moved_files:
-            if file_info[0] == old_path and file_info[1] == new_path:
-                if self.revert_file_movement(old_path, new_path):
-                    moved_files.remove(file_info)
-                    break
-
-    def revert_file_movement(self, old_path, new_path):
-        # Возвращает True, если откат успешно выполнен
-        if os.path.exists(new_path):
-            os.makedirs(os.path.dirname(old_path), exist_ok=True)
-            shutil.move(new_path, old_path)
-            logger.info(f"Объект откатан: {new_path} -> {old_path}")
-            return True
+    def finish_revert(self, event, success):
+        self.revert_worker = None
+        self.revert_history_button.configure(state=tk.NORMAL)
+        self.revert_progress_label.configure(text="")
+        self.refresh_history()
+        if event["event"] == "error":
+            messagebox.showerror("Ошибка", f"Ошибка при откате: {event['error']}")
+            return
+        problems = []
+        if event["missing"]:
+            problems.append(f"не найдено: {event['missing']}")
+        if event["conflicts"]:
+            problems.append(f"путь занят: {event['conflicts']}")
+        if event["errors"]:
+            problems.append(f"ошибок: {event['errors']}")
+        if problems:
+            messagebox.showwarning("Откат выполнен частично",
+                                   f"Откатано объектов: {event['reverted']}; " + ", ".join(problems) + ".")
         else:
-            logger.warning(f"Объект для отката не найден: {new_path}")
-            return False
+            messagebox.showinfo("Успех", success)
 
     def get_expanded_nodes(self, tree):
         # Возвращает список ID раскрытых узлов дерева
@@ -578,17 +795,13 @@ class DesktopOrganizerGUI(tk.Tk):
         return expanded
 
     def restore_expanded_nodes(self, tree, expanded_nodes):
-        # Восстанавливает состояние раскрытия узлов дерева
+        # Восстанавливает состояние раскрытия узлов дерева.
+        # Родители идут раньше детей, поэтому дочерние узлы успевают подгрузиться
         for node in expanded_nodes:
             if tree.exists(node):
+                self.populate_history_node(node)
                 tree.item(node, open=True)
 
-    def get_entry_index_from_node(self, node_id):
-        # Возвращает индекс операции из ID узла (формат 'entry_...')
-        if node_id.startswith("entry_"):
-            return int(node_id.replace("entry_", ""))
-        return -1
-
 def main():
     """Основная функция запуска приложения"""
     app = DesktopOrganizerGUI()
@@ -1,25 +1,42 @@
 import os
-import shutil
-import win32com.client
-from win32com.shell import shell, shellcon
-import pythoncom
 from config_manager import load_config
 from logger import get_logger
-from history_manager import load_history, save_history
+from history_manager import append_history_entry
+from rule_index import RuleIndex
+from transfer import mover
+from move_scheduler import MoveScheduler, MoveTask, FairLimiter, DEFAULT_WORKERS
+from scanner import scan_directory, scan_names, TreeWalker, DEFAULT_EXCLUDES
+from shortcuts import create_shortcut_writer, SHORTCUT_SUFFIXES
+from scan_state import ScanState, config_fingerprint, DECISION_SKIPPED, DECISION_UNMATCHED, DECISION_COLLISION
+from sort_plan import PlannedMove, PlannedDuplicate, SortPlan, device_of, tree_size, order_for_locality
+from dedup import HashCache, find_duplicates
+from metrics import RunMetrics, record_run
+from profiles import load_profiles, profile_config, profile_root, DEFAULT_IO_CONCURRENCY
+from collisions import FolderNameIndex, resolve_collision, COLLISION_POLICIES, COLLISION_RENAME, RESOLVED_SKIP, RESOLVED_OVERWRITE
 import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from win32com.shell import shell, shellcon
+except ImportError:
+    # pywin32 доступен только на Windows
+    shell = None
 
 logger = get_logger(__name__)
 
 def get_desktop_path():
     """Получает путь к рабочему столу через WinAPI"""
-    try:
-        # Пробуем получить путь через WinAPI
-        desktop_path = shell.SHGetFolderPath(0, shellcon.CSIDL_DESKTOP, 0, 0)
-        if os.path.exists(desktop_path):
-            logger.info(f"Найден путь к рабочему столу через WinAPI: {desktop_path}")
-            return desktop_path
-    except Exception as e:
-        logger.warning(f"Не удалось получить путь к рабочему столу через WinAPI: {e}")
+    if shell is not None:
+        try:
+            # Пробуем получить путь через WinAPI
+            desktop_path = shell.SHGetFolderPath(0, shellcon.CSIDL_DESKTOP, 0, 0)
+            if os.path.exists(desktop_path):
+                logger.debug("Найден путь к рабочему столу через WinAPI: %s", desktop_path)
+                return desktop_path
+        except Exception as e:
+            logger.warning(f"Не удалось получить путь к рабочему столу через WinAPI: {e}")
     
     # Пробуем стандартные пути
     possible_paths = [
@@ -31,143 +48,650 @@ def get_desktop_path():
     
     for path in possible_paths:
         if os.path.exists(path):
-            logger.info(f"Найден путь к рабочему столу: {path}")
+            logger.debug("Найден путь к рабочему столу: %s", path)
             return path
             
     raise FileNotFoundError("Не удалось найти путь к рабочему столу")
 
-def create_shortcut(target_path, shortcut_path):
-    """Создает ярлык для файла или папки"""
+def create_shortcut(target_path, shortcut_path, backend="auto"):
+    """
+    Создает один ярлык для файла или папки. Для нескольких ярлыков
+    используйте create_shortcut_writer, чтобы не открывать сессию на каждый.
+    """
     try:
-        pythoncom.CoInitialize()  # Инициализация COM
-        shell = win32com.client.Dispatch("WScript.Shell")
-        shortcut = shell.CreateShortCut(shortcut_path)
-        shortcut.Targetpath = target_path
-        shortcut.WorkingDirectory = os.path.dirname(target_path)
-        shortcut.save()
-        logger.info(f"Создан ярлык: {shortcut_path} -> {target_path}")
-        return True
+        with create_shortcut_writer(backend) as writer:
+            return writer.write(target_path, shortcut_path)
     except Exception as e:
         logger.error(f"Ошибка при создании ярлыка {shortcut_path}: {e}")
         return False
-    finally:
-        pythoncom.CoUninitialize()  # Освобождение COM
 
-def sort_desktop():
-    """Сортирует файлы на рабочем столе согласно правилам"""
-    logger.info("Начало процесса сортировки...")
-    
-    config = load_config()
-    logger.info(f"Загружена конфигурация: {config}")
-    
-    desktop_path = get_desktop_path()
-    logger.info(f"Путь к рабочему столу: {desktop_path}")
-    
+def ensure_folder(path, known_folders):
+    """
+    Создает папку, если её нет. Каждая папка проверяется не более одного раза
+    за запуск: известные папки хранятся в known_folders.
+    Возвращает True, если папка была создана.
+    """
+    if path in known_folders:
+        return False
+    created = not os.path.isdir(path)
+    if created:
+        os.makedirs(path, exist_ok=True)
+    known_folders.add(path)
+    return created
+
+def _no_progress(event):
+    pass
+
+def find_duplicate_targets(targets, cache, workers=DEFAULT_WORKERS):
+    """
+    Ищет дубликаты среди файлов, которые собираются перемещать, и файлов,
+    уже лежащих в их папках назначения. Файл сравнивается только с файлами
+    своей папки назначения.
+    targets - список (entry, target_folder, rule); cache - HashCache
+    (не сохраняется, см. execute_plan).
+    Возвращает словарь: путь дубликата -> оставленная копия (ScanEntry).
+    Оставляется файл, уже лежащий в папке назначения, иначе - файл с самым
+    коротким именем ("file.pdf", а не "file (1).pdf").
+    """
+    # Путь файла -> папка назначения, в пределах которой ищутся его дубликаты
+    folder_of = {entry.path: folder for entry, folder, _rule in targets if entry.is_file}
+    candidates = [entry for entry, _folder, _rule in targets if entry.is_file]
+    if not candidates:
+        return {}
+    existing = []
+    for folder in set(folder_of.values()):
+        try:
+            entries = scan_directory(folder)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать папку {folder} для поиска дубликатов: {e}")
+            continue
+        for entry in entries:
+            folder_of.setdefault(entry.path, folder)
+        existing += entries
+
+    groups = find_duplicates(candidates, existing, cache, workers, scope=lambda e: folder_of[e.path])
+
+    candidate_paths = {entry.path for entry in candidates}
+    duplicates = {}
+    for group in groups:
+        kept = min(group, key=lambda e: (e.path in candidate_paths, len(e.name), e.mtime, e.name))
+        for entry in group:
+            if entry is not kept and entry.path in candidate_paths:
+                duplicates[entry.path] = kept
+    logger.info(f"Найдено дубликатов: {len(duplicates)} в {len(groups)} группах")
+    return duplicates
+
+def plan_sort(names=None, config=None, scan_state=None, locality=True, desktop_path=None, timings=None):
+    """
+    Строит план сортировки, ничего не изменяя на диске.
+    names - если указан, планируются только элементы с этими именами.
+    config - конфигурация (по умолчанию загружается).
+    scan_state - кэш решений прошлых запусков (по умолчанию загружается);
+    неизменившиеся элементы с известным решением в план не попадают.
+    locality - упорядочить перемещения: сначала переименования, затем
+    межтомовые копирования по папкам назначения.
+    desktop_path - сортируемая папка (по умолчанию рабочий стол).
+    timings - словарь, в который записывается время этапов scan и match (с).
+    Возвращает SortPlan или None, если план построить нельзя.
+    """
+    if config is None:
+        config = load_config()
+    if timings is None:
+        timings = {}
+
+    if desktop_path is None:
+        desktop_path = get_desktop_path()
+    logger.debug("Путь к рабочему столу: %s", desktop_path)
+
     organized_dir = config.get("organized_files_dir")
-    logger.info(f"Директория для организованных файлов: {organized_dir}")
-    
+    logger.debug("Директория для организованных файлов: %s", organized_dir)
+
     if not organized_dir:
         logger.error("Не указана директория для организованных файлов")
-        return
-    
-    if not os.path.exists(organized_dir):
-        os.makedirs(organized_dir)
-        logger.info(f"Создана директория для организованных файлов: {organized_dir}")
-    
-    # Загружаем историю
-    history = load_history()
-    current_operation = {
-        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "moved_files": []
-    }
-    
+        return None
+
+    started = time.perf_counter()
     try:
-        items_on_desktop = os.listdir(desktop_path)
-        logger.info(f"Найдено файлов на рабочем столе: {len(items_on_desktop)}")
-        logger.info(f"Файлы на рабочем столе: {items_on_desktop}")
+        if names is None:
+            entries = scan_directory(desktop_path)
+        else:
+            entries = scan_names(desktop_path, names)
+        logger.debug("Найдено файлов на рабочем столе: %d", len(entries))
     except Exception as e:
         logger.error(f"Ошибка при чтении содержимого рабочего стола: {e}")
-        return
-    
-    rules = config.get("sorting_rules", [])
+        return None
+    timings["scan"] = time.perf_counter() - started
+    started = time.perf_counter()
+
+    rule_index = RuleIndex.from_config(config)
     folder_mode = config.get("folder_shortcut_mode", "others")
-    logger.info(f"Загружено правил сортировки: {len(rules)}")
-    logger.info(f"Режим обработки папок: {folder_mode}")
-    
-    for item in items_on_desktop:
-        item_path = os.path.join(desktop_path, item)
-        logger.info(f"Обработка элемента: {item}")
-        
+    logger.debug("Загружено правил сортировки: %d, режим обработки папок: %s", len(rule_index), folder_mode)
+
+    if scan_state is None:
+        scan_state = ScanState.load(config_fingerprint(config))
+    reused_decisions = 0
+
+    collision_policy = config.get("collision_policy", COLLISION_RENAME)
+    if collision_policy not in COLLISION_POLICIES:
+        logger.warning(f"Неизвестная политика конфликтов имен {collision_policy}, используется {COLLISION_RENAME}")
+        collision_policy = COLLISION_RENAME
+
+    # Том рабочего стола и папок назначения определяется один раз на папку
+    desktop_device = device_of(desktop_path)
+    folder_devices = {}
+    # Имена в папках назначения: один scandir на папку вместо stat на элемент
+    name_index = FolderNameIndex()
+
+    moves = []
+    decisions = []
+    # Элементы с найденным правилом: (entry, target_folder, rule)
+    targets = []
+    organized_key = os.path.normcase(os.path.abspath(organized_dir))
+
+    def plan_move(entry, target_folder, rule):
+        if target_folder not in folder_devices:
+            folder_devices[target_folder] = device_of(target_folder)
+        same_device = desktop_device is not None and folder_devices[target_folder] == desktop_device
+        target_name, collision = resolve_collision(collision_policy, name_index, target_folder, entry)
+        if collision is not None:
+            logger.debug("Конфликт имен для %s в %s: %s (%s)", entry.name, target_folder, collision, target_name)
+        target_path = os.path.join(target_folder, target_name)
+        size = entry.size
+        if entry.is_dir:
+            # Переименование папки не зависит от её объема, копирование - зависит
+            size = 0 if same_device else tree_size(entry.path)
+        moves.append(PlannedMove(entry.path, target_path, rule, size, same_device,
+                                 collision is not None, collision, entry))
+
+    for entry in entries:
+        item = entry.name
+
+        if scan_state.cached_decision(entry) is not None:
+            reused_decisions += 1
+            continue
+
+        logger.debug("Обработка элемента: %s", item)
+
         # Пропускаем ярлыки и специальные файлы
-        if item.endswith('.lnk') or item.startswith('~$'):
-            logger.info(f"Пропущен файл {item} (ярлык или специальный файл)")
+        if item.endswith(SHORTCUT_SUFFIXES) or item.startswith('~$') or entry.link:
+            logger.debug("Пропущен файл %s (ярлык или специальный файл)", item)
+            decisions.append((entry, DECISION_SKIPPED))
+            continue
+
+        # Папка для организованных файлов может лежать на самом рабочем столе
+        if entry.is_dir and os.path.normcase(os.path.abspath(entry.path)) == organized_key:
+            logger.debug("Пропущена папка %s (директория для организованных файлов)", item)
+            decisions.append((entry, DECISION_SKIPPED))
             continue
 
         # Определяем правило для файла/папки
-        matched_rule = None
-        for rule in rules:
-            if rule["type"] == "extension" and os.path.isfile(item_path):
-                if item.lower().endswith(rule["extension"].lower()):
-                    matched_rule = rule
-                    logger.info(f"Найдено правило для файла {item}: {rule}")
-                    break
-            elif rule["type"] == "folder" and os.path.isdir(item_path):
-                if item.lower() == rule["extension"].lower():
-                    matched_rule = rule
-                    logger.info(f"Найдено правило для папки {item}: {rule}")
-                    break
+        matched_rule = rule_index.match_entry(entry)
 
         if matched_rule:
-            # Создаем папку назначения если её нет
-            target_folder = os.path.join(organized_dir, matched_rule["folder"])
-            if not os.path.exists(target_folder):
-                os.makedirs(target_folder)
-                logger.info(f"Создана папка назначения: {target_folder}")
-            
-            # Перемещаем файл/папку
-            target_path = os.path.join(target_folder, item)
-            try:
-                shutil.move(item_path, target_path)
-                logger.info(f"Перемещен файл/папка: {item_path} -> {target_path}")
-                
-                # Создаем ярлык
-                shortcut_path = os.path.join(desktop_path, f"{item}.lnk")
-                if create_shortcut(target_path, shortcut_path):
-                    current_operation["moved_files"].append((item_path, target_path))
-                    logger.info(f"Операция успешно записана в историю")
-            except Exception as e:
-                logger.error(f"Ошибка при перемещении {item}: {e}")
-        else:
-            logger.info(f"Не найдено правило для {item}")
-        
-        # Обработка папок без правил
-        if not matched_rule and os.path.isdir(item_path) and folder_mode:
-            logger.info(f"Обработка папки без правила: {item}")
-            others_folder = os.path.join(organized_dir, "Others")
+            logger.debug("Найдено правило для %s: %s", item, matched_rule)
+            targets.append((entry, os.path.join(organized_dir, rule_index.folder_for(matched_rule, entry)),
+                            matched_rule))
+        elif entry.is_dir and folder_mode:
+            # Обработка папок без правил
+            logger.debug("Обработка папки без правила: %s", item)
             if folder_mode == "others":
-                if not os.path.exists(others_folder):
-                    os.makedirs(others_folder)
-                    logger.info(f"Создана папка Others: {others_folder}")
-                target_path = os.path.join(others_folder, item)
+                targets.append((entry, os.path.join(organized_dir, "Others"), None))
             else:  # per_folder
-                target_path = os.path.join(organized_dir, item)
-                
-            try:
-                if not os.path.exists(target_path):
-                    shutil.move(item_path, target_path)
-                    logger.info(f"Перемещена папка без правила: {item_path} -> {target_path}")
-                    # Создаем ярлык
-                    shortcut_path = os.path.join(desktop_path, f"{item}.lnk")
-                    if create_shortcut(target_path, shortcut_path):
-                        current_operation["moved_files"].append((item_path, target_path))
-                        logger.info(f"Операция с папкой успешно записана в историю")
-            except Exception as e:
-                logger.error(f"Ошибка при перемещении папки {item}: {e}")
-    
+                targets.append((entry, organized_dir, None))
+        elif rule_index.may_match_later(entry):
+            # Правило по дате сработает позже, решение не запоминаем
+            logger.debug("Элемент %s пока не подходит под правило по дате", item)
+        else:
+            logger.debug("Не найдено правило для %s", item)
+            decisions.append((entry, DECISION_UNMATCHED))
+
+    # Дубликаты не перемещаются, поэтому ищутся до разрешения конфликтов имен
+    duplicate_of = {}
+    hash_cache = None
+    if config.get("dedup_enabled", False):
+        hash_cache = HashCache.load()
+        duplicate_of = find_duplicate_targets(targets, hash_cache, config.get("move_workers", DEFAULT_WORKERS))
+
+    for entry, target_folder, rule in targets:
+        if entry.path not in duplicate_of:
+            plan_move(entry, target_folder, rule)
+
+    destinations = {move.source: move.destination for move in moves}
+    duplicates = []
+    for entry, _folder, _rule in targets:
+        kept = duplicate_of.get(entry.path)
+        if kept is not None:
+            duplicates.append(PlannedDuplicate(entry.path, destinations.get(kept.path, kept.path),
+                                               kept.path, entry.size, entry))
+
+    if locality:
+        moves = order_for_locality(moves)
+    timings["match"] = time.perf_counter() - started
+
+    return SortPlan(desktop_path, organized_dir, config, tuple(moves), tuple(duplicates), tuple(decisions),
+                    tuple(entries), reused_decisions, names is not None, hash_cache)
+
+def execute_plan(plan, scan_state=None, workers=None, progress=None, cancel_event=None, timings=None,
+                 counters=None):
+    """
+    Выполняет план сортировки: создает папки назначения, перемещает элементы,
+    создает ярлыки и записывает операцию в историю.
+    Конфликты имен разрешены при планировании (collision_policy);
+    перемещения с решением "skip" пропускаются.
+    Параметры workers, progress и cancel_event - как у sort_desktop.
+    timings - словарь, в который записывается время этапов move, shortcuts
+    и history (с); counters - словарь для счетчиков moved, bytes_moved,
+    duplicates и errors (см. metrics.RunMetrics).
+    """
+    if progress is None:
+        progress = _no_progress
+    if timings is None:
+        timings = {}
+    if counters is None:
+        counters = {}
+    started = time.monotonic()
+    config = plan.config
+    desktop_path = plan.desktop_path
+    if scan_state is None:
+        scan_state = ScanState.load(config_fingerprint(config))
+
+    current_operation = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "moved_files": [],
+        "duplicates": []
+    }
+
+    for entry, decision in plan.decisions:
+        scan_state.record(entry, decision)
+
+    # Папки, существование которых уже проверено в этом запуске
+    known_folders = set()
+    if ensure_folder(plan.organized_dir, known_folders):
+        logger.info(f"Создана директория для организованных файлов: {plan.organized_dir}")
+
+    # Перемещения собираются в список и выполняются пулом потоков
+    move_tasks = []
+    for move in plan.moves:
+        if move.collision == RESOLVED_SKIP:
+            # Решение запоминается, чтобы предупреждение не повторялось на каждом цикле мониторинга
+            logger.warning("Пропущен %s: %s уже существует", move.entry.name, move.destination)
+            scan_state.record(move.entry, DECISION_COLLISION, move.destination)
+            continue
+        target_folder = os.path.dirname(move.destination)
+        if ensure_folder(target_folder, known_folders):
+            logger.debug("Создана папка назначения: %s", target_folder)
+        move_tasks.append(MoveTask(move.source, move.destination, move.size, move.entry, move.same_device,
+                                   move.collision == RESOLVED_OVERWRITE))
+
+    # Перемещаем файлы/папки
+    if workers is None:
+        workers = config.get("move_workers", DEFAULT_WORKERS)
+    progress({"event": "matched", "matched": len(move_tasks)})
+    moved_counter = {"moved": 0, "bytes": 0}
+    counter_lock = threading.Lock()
+
+    def on_move_done(task):
+        if not task.ok:
+            return
+        with counter_lock:
+            moved_counter["moved"] += 1
+            moved_counter["bytes"] += task.size
+            event = {"event": "moved", "name": task.payload.name, "matched": len(move_tasks), **moved_counter}
+        progress(event)
+
+    if cancel_event is not None and cancel_event.is_set():
+        logger.info("Сортировка отменена пользователем")
+    stage_started = time.perf_counter()
+    MoveScheduler(workers, move_func=mover(config)).run(move_tasks, cancel_event=cancel_event, on_done=on_move_done)
+    timings["move"] = time.perf_counter() - stage_started
+
+    moved_tasks = []
+    errors = 0
+    for task in move_tasks:
+        item = task.payload.name
+        if task.cancelled:
+            continue
+        if not task.ok:
+            errors += 1
+            logger.error("Ошибка при перемещении %s: %s", item, task.error)
+            continue
+        scan_state.forget(item)
+        moved_tasks.append(task)
+        logger.debug("Перемещен файл/папка: %s -> %s", task.source, task.target)
+
+    # Удаляем дубликаты, если их оставленная копия на месте
+    moved_targets = {task.target for task in moved_tasks}
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    removed_duplicates = []
+    for duplicate in plan.duplicates:
+        if cancelled:
+            break
+        if duplicate.kept != duplicate.kept_source and duplicate.kept not in moved_targets:
+            logger.warning("Дубликат %s оставлен: копия %s не перемещена", duplicate.source, duplicate.kept_source)
+            continue
+        try:
+            st = os.stat(duplicate.source)
+            if st.st_size != duplicate.entry.size or st.st_mtime != duplicate.entry.mtime:
+                logger.warning("Дубликат %s изменился после проверки, оставлен на месте", duplicate.source)
+                continue
+            os.remove(duplicate.source)
+        except OSError as e:
+            logger.error("Ошибка при удалении дубликата %s: %s", duplicate.source, e)
+            continue
+        scan_state.forget(duplicate.entry.name)
+        removed_duplicates.append(duplicate)
+        current_operation["duplicates"].append((duplicate.source, duplicate.kept))
+        logger.debug("Удален дубликат: %s (копия: %s)", duplicate.source, duplicate.kept)
+
+    # Создаем ярлыки одной сессией: на перемещенные элементы и на оставленные
+    # копии удаленных дубликатов (под именем дубликата)
+    stage_started = time.perf_counter()
+    items = [(task.target, task.payload.name, task.payload.is_dir) for task in moved_tasks]
+    items += [(duplicate.kept, duplicate.entry.name, False) for duplicate in removed_duplicates]
+    if items:
+        try:
+            with create_shortcut_writer(config.get("shortcut_backend", "auto")) as writer:
+                results = writer.write_batch(shortcut_pairs(writer, desktop_path, items))
+                timing = writer.timing_summary()
+                logger.info(f"Создано ярлыков: {timing['count']} ({writer.name}) за {timing['total']:.3f} с, "
+                            f"в среднем {timing['avg'] * 1000:.1f} мс, максимум {timing['max'] * 1000:.1f} мс")
+        except Exception as e:
+            logger.error(f"Ошибка при создании ярлыков: {e}")
+            results = [False] * len(items)
+
+        for (target, _name, _is_dir), created in zip(items, results):
+            if not created:
+                logger.warning("Ярлык для %s не создан", target)
+
+    # Перемещение записывается и без ярлыка: иначе его нельзя было бы откатить
+    current_operation["moved_files"] = [(task.source, task.target) for task in moved_tasks]
+    timings["shortcuts"] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    if not plan.incremental:
+        scan_state.retain(e.name for e in plan.entries)
+    scan_state.save()
+    if plan.hash_cache is not None:
+        if not plan.incremental:
+            plan.hash_cache.prune()
+        plan.hash_cache.save()
+
     # Сохраняем историю только если были перемещения
-    if current_operation["moved_files"]:
-        history.append(current_operation)
-        save_history(history)
-        logger.info(f"История обновлена. Добавлено {len(current_operation['moved_files'])} операций")
-    else:
-        logger.info("Нет файлов для перемещения или все файлы уже организованы")
+    if current_operation["moved_files"] or current_operation["duplicates"]:
+        append_history_entry(current_operation)
+    timings["history"] = time.perf_counter() - stage_started
+    counters.update(moved=len(current_operation["moved_files"]), bytes_moved=moved_counter["bytes"],
+                    duplicates=len(current_operation["duplicates"]), errors=errors)
+
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    # Одна строка итогов на запуск; подробности по элементам - на уровне DEBUG
+    logger.info("Сортировка%s: просмотрено %d, перемещено %d, дубликатов удалено %d, "
+                "без изменений %d, ошибок %d за %.2f с",
+                " отменена" if cancelled else "", len(plan.entries), len(current_operation["moved_files"]),
+                len(current_operation["duplicates"]), plan.reused, errors, time.monotonic() - started)
+    progress({"event": "finished", "moved": len(current_operation["moved_files"]), "cancelled": cancelled})
+    return current_operation
+
+def shortcut_pairs(writer, desktop_path, items):
+    """
+    Пары (цель, путь ярлыка) для items - троек (цель, имя элемента на
+    рабочем столе, папка ли это). Занятые имена ярлыков (например, ярлык
+    на одноименный файл, перемещенный раньше) заменяются свободными вида
+    "имя (N)", как и имена в папках назначения.
+    """
+    name_index = FolderNameIndex()
+    pairs = []
+    for target, item_name, item_is_dir in items:
+        name = os.path.basename(writer.shortcut_path(desktop_path, item_name))
+        # Без расширения ярлыка (symlink) номер ставится как у самого элемента
+        is_dir = item_is_dir and not writer.suffix
+        if name_index.contains(desktop_path, name):
+            name = name_index.allocate(desktop_path, name, is_dir)
+        else:
+            name_index.add(desktop_path, name, is_dir)
+        pairs.append((target, os.path.join(desktop_path, name)))
+    return pairs
+
+def _should_skip(entry):
+    """Ярлыки, временные файлы Office и символические ссылки не сортируются"""
+    return entry.name.endswith(SHORTCUT_SUFFIXES) or entry.name.startswith('~$') or entry.link
+
+def sort_source_root(root, config=None, workers=None, progress=None, cancel_event=None,
+                     profile=None, limiter=None):
+    """
+    Рекурсивно сортирует один корень-источник из source_roots.
+    root - словарь: path, max_depth (None - без ограничения), exclude
+    (шаблоны имен папок, по умолчанию scanner.DEFAULT_EXCLUDES) и
+    необязательный destination (по умолчанию organized_files_dir).
+
+    Обход потоковый (scanner.TreeWalker): каждый подошедший элемент сразу
+    передается на перемещение, не дожидаясь конца обхода. Папка, подошедшая
+    под правило, перемещается целиком и не обходится; остальные папки
+    обходятся. Ярлыки для элементов корней не создаются, поиск дубликатов
+    и кэш решений (scan_state) для корней не используются.
+    Перемещения корня записываются в историю одной операцией.
+    profile - имя профиля: записывается в операцию истории и в события.
+    limiter - общий move_scheduler.FairLimiter для нескольких корней.
+    """
+    if progress is None:
+        progress = _no_progress
+    if config is None:
+        config = load_config()
+    root_path = root.get("path")
+    destination = root.get("destination") or config.get("organized_files_dir")
+    if not root_path or not os.path.isdir(root_path):
+        logger.error(f"Корень-источник не найден: {root_path}")
+        return None
+    if not destination:
+        logger.error(f"Не указана папка назначения для корня {root_path}")
+        return None
+    logger.debug("Сортировка корня %s -> %s", root_path, destination)
+    started = time.monotonic()
+
+    rule_index = RuleIndex.from_config(config)
+    collision_policy = config.get("collision_policy", COLLISION_RENAME)
+    if collision_policy not in COLLISION_POLICIES:
+        collision_policy = COLLISION_RENAME
+    if workers is None:
+        workers = config.get("move_workers", DEFAULT_WORKERS)
+
+    walker = TreeWalker(root_path, root.get("max_depth"), root.get("exclude", DEFAULT_EXCLUDES),
+                        excluded_paths=(destination, config.get("organized_files_dir") or destination))
+    root_device = device_of(root_path)
+    folder_devices = {}
+    name_index = FolderNameIndex()
+    known_folders = set()
+    ensure_folder(destination, known_folders)
+
+    current_operation = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "moved_files": [],
+        "duplicates": []
+    }
+    if profile is not None:
+        current_operation["profile"] = profile
+    run = RunMetrics(profile or root_path)
+    counter = {"matched": 0, "moved": 0, "bytes": 0, "errors": 0}
+    counter_lock = threading.Lock()
+
+    # Завершенные задачи не хранятся: на больших корнях список всех
+    # MoveTask занимал бы память до конца обхода
+    def on_move_done(task):
+        if task.error is not None:
+            logger.error("Ошибка при перемещении %s: %s", task.source, task.error)
+            with counter_lock:
+                counter["errors"] += 1
+            return
+        if not task.ok:
+            return
+        with counter_lock:
+            current_operation["moved_files"].append((task.source, task.target))
+            counter["moved"] += 1
+            counter["bytes"] += task.size
+            event = {"event": "moved", "name": task.payload.name, "matched": counter["matched"],
+                     "moved": counter["moved"], "bytes": counter["bytes"]}
+        if profile is not None:
+            event["profile"] = profile
+        progress(event)
+
+    with run.stage("walk"), MoveScheduler(workers, move_func=mover(config), limiter=limiter, limiter_key=profile or root_path).stream(cancel_event, on_move_done) as stream:
+        for entry in walker:
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("Сортировка отменена пользователем")
+                break
+            if _should_skip(entry):
+                if entry.is_dir:
+                    walker.skip(entry)
+                continue
+            rule = rule_index.match_entry(entry)
+            if rule is None:
+                continue
+            if entry.is_dir:
+                walker.skip(entry)
+            target_folder = os.path.join(destination, rule_index.folder_for(rule, entry))
+            if target_folder not in folder_devices:
+                folder_devices[target_folder] = device_of(target_folder)
+            same_device = root_device is not None and folder_devices[target_folder] == root_device
+            target_name, collision = resolve_collision(collision_policy, name_index, target_folder, entry)
+            if collision == RESOLVED_SKIP:
+                logger.warning("Пропущен %s: %s уже есть в %s", entry.path, target_name, target_folder)
+                continue
+            ensure_folder(target_folder, known_folders)
+            size = entry.size
+            if entry.is_dir:
+                size = 0 if same_device else tree_size(entry.path)
+            task = MoveTask(entry.path, os.path.join(target_folder, target_name), size, entry, same_device,
+                            collision == RESOLVED_OVERWRITE)
+            with counter_lock:
+                counter["matched"] += 1
+            logger.debug("В очереди %s -> %s", task.source, task.target)
+            stream.submit(task)
+
+    errors = counter["errors"]
+    logger.info("Корень %s%s: просмотрено %d элементов в %d папках, перемещено %d из %d, ошибок %d за %.2f с",
+                root_path, f" (профиль {profile})" if profile else "", walker.entries, walker.directories,
+                counter["moved"], counter["matched"], errors, time.monotonic() - started)
+
+    with run.stage("history"):
+        if current_operation["moved_files"]:
+            append_history_entry(current_operation)
+    run.counters.update(scanned=walker.entries, matched=counter["matched"], moved=counter["moved"],
+                        bytes_moved=counter["bytes"], errors=errors)
+    record_run(run.finish(cancel_event is not None and cancel_event.is_set()))
+    return current_operation
+
+def sort_profiles(config=None, workers=None, progress=None, cancel_event=None, names=None):
+    """
+    Сортирует профили из config["profiles"] одновременно, по потоку на
+    профиль. Перемещения всех профилей делят общий FairLimiter на
+    io_concurrency одновременных операций; место освобождается по кругу
+    между профилями, поэтому большой профиль не задерживает остальные.
+    names - если указан, сортируются только профили с этими именами.
+    workers - число потоков перемещения на профиль (по умолчанию
+    move_workers профиля или общей конфигурации).
+    Возвращает словарь: имя профиля -> операция истории (или None).
+    """
+    if config is None:
+        config = load_config()
+    profiles = [p for p in load_profiles(config) if names is None or p["name"] in names]
+    if not profiles:
+        return {}
+    limiter = FairLimiter(config.get("io_concurrency", DEFAULT_IO_CONCURRENCY))
+    logger.info(f"Сортировка профилей: {', '.join(p['name'] for p in profiles)} "
+                f"(одновременных перемещений: {limiter.limit})")
+
+    def run(profile):
+        try:
+            return sort_source_root(profile_root(profile), profile_config(config, profile), workers, progress,
+                                    cancel_event, profile=profile["name"], limiter=limiter)
+        except Exception as e:
+            logger.error(f"Ошибка при сортировке профиля {profile['name']}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(profiles), thread_name_prefix="profile") as pool:
+        results = list(pool.map(run, profiles))
+    return {profile["name"]: result for profile, result in zip(profiles, results)}
+
+def sort_source_roots(config=None, workers=None, progress=None, cancel_event=None):
+    """
+    Сортирует по очереди все корни-источники из source_roots (строка -
+    только путь). Возвращает список операций истории (None для корней,
+    которые не удалось отсортировать).
+    """
+    if config is None:
+        config = load_config()
+    operations = []
+    for root in config.get("source_roots", []):
+        if isinstance(root, str):
+            root = {"path": root}
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        operations.append(sort_source_root(root, config, workers, progress, cancel_event))
+    return operations
+
+def sort_all(workers=None, progress=None, cancel_event=None, profiles=True):
+    """
+    Сортирует рабочий стол, затем все корни-источники из source_roots и
+    (если profiles) все профили из config["profiles"].
+    Событие finished отправляется один раз, после последнего корня.
+    Возвращает итоги сортировки рабочего стола (как sort_desktop).
+    """
+    if progress is None:
+        progress = _no_progress
+    state = {"moved": 0}
+
+    def forward(event):
+        if event["event"] == "finished":
+            state["moved"] += event["moved"]
+        else:
+            progress(event)
+
+    result = sort_desktop(workers=workers, progress=forward, cancel_event=cancel_event)
+    config = load_config()
+    for operation in sort_source_roots(config, workers, forward, cancel_event):
+        if operation is not None:
+            state["moved"] += len(operation["moved_files"])
+    if profiles and not (cancel_event is not None and cancel_event.is_set()):
+        for operation in sort_profiles(config, workers, forward, cancel_event).values():
+            if operation is not None:
+                state["moved"] += len(operation["moved_files"])
+    if result is not None:
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        progress({"event": "finished", "moved": state["moved"], "cancelled": cancelled})
+    return result
+
+def sort_desktop(names=None, workers=None, progress=None, cancel_event=None):
+    """
+    Сортирует файлы на рабочем столе согласно правилам: строит план
+    (plan_sort) и выполняет его (execute_plan).
+    names - если указан, обрабатываются только элементы с этими именами
+    (инкрементальная сортировка по событиям наблюдателя).
+    workers - число потоков перемещения (по умолчанию move_workers из конфигурации).
+    progress - функция, получающая события хода сортировки (словари, см. sort_worker).
+    cancel_event - threading.Event; после установки сортировка останавливается
+    между элементами, уже перемещенные файлы записываются в историю.
+    Возвращает итоги запуска (metrics.RunMetrics; операция истории - в
+    поле operation) или None, если сортировка не выполнена. Итоги
+    дописываются в журнал метрик.
+    """
+    if progress is None:
+        progress = _no_progress
+    logger.debug("Начало процесса сортировки")
+
+    config = load_config()
+
+    # Решения прошлых запусков для неизменившихся элементов
+    scan_state = ScanState.load(config_fingerprint(config))
+    run = RunMetrics()
+    plan = plan_sort(names, config, scan_state, timings=run.stages)
+    if plan is None:
+        return None
+    run.counters.update(scanned=len(plan.entries), matched=len(plan.moves), reused=plan.reused)
+    progress({"event": "scanned", "scanned": len(plan.entries)})
+
+    run.operation = execute_plan(plan, scan_state, workers, progress, cancel_event,
+                                 timings=run.stages, counters=run.counters)
+    record_run(run.finish(cancel_event is not None and cancel_event.is_set()))
+    return run
@@ -0,0 +1,208 @@
+"""Хранилище истории перемещений в SQLite с индексами для быстрых запросов"""
+
+import os
+import sqlite3
+import threading
+
+HISTORY_DB = 'history.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    profile TEXT
+);
+CREATE TABLE IF NOT EXISTS moves (
+    id INTEGER PRIMARY KEY,
+    operation_id INTEGER NOT NULL REFERENCES operations(id) ON DELETE CASCADE,
+    original_path TEXT NOT NULL,
+    destination_path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    id INTEGER PRIMARY KEY,
+    operation_id INTEGER NOT NULL REFERENCES operations(id) ON DELETE CASCADE,
+    original_path TEXT NOT NULL,
+    kept_path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_operations_timestamp ON operations(timestamp);
+CREATE INDEX IF NOT EXISTS idx_operations_profile ON operations(profile);
+CREATE INDEX IF NOT EXISTS idx_moves_operation ON moves(operation_id);
+CREATE INDEX IF NOT EXISTS idx_moves_original ON moves(original_path);
+CREATE INDEX IF NOT EXISTS idx_moves_destination ON moves(destination_path);
+CREATE INDEX IF NOT EXISTS idx_moves_category ON moves(category);
+CREATE INDEX IF NOT EXISTS idx_moves_name ON moves(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_duplicates_operation ON duplicates(operation_id);
+"""
+
+
+def move_category(destination_path):
+    """Категория перемещения - имя папки назначения"""
+    return os.path.basename(os.path.dirname(destination_path))
+
+
+class HistoryDB:
+    """
+    История перемещений в SQLite.
+
+    Операции хранятся в таблице operations, отдельные перемещения - в moves,
+    удаленные дубликаты со ссылкой на оставленную копию - в duplicates.
+    Откат удаляет строки перемещений и дубликатов; пустая операция удаляется.
+    profile операции - имя профиля сортировки (NULL - рабочий стол).
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM operations LIMIT 1").fetchone() is None
+
+    def add_operation(self, timestamp, moved_files, op_id=None, duplicates=(), profile=None):
+        """Добавляет операцию, её перемещения и дубликаты, возвращает идентификатор операции"""
+        with self._lock, self._conn:
+            cur = self._conn.execute("INSERT INTO operations (id, timestamp, profile) VALUES (?, ?, ?)",
+                                     (op_id, timestamp, profile))
+            op_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO moves (operation_id, original_path, destination_path, name, category) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(op_id, old, new, os.path.basename(new), move_category(new)) for old, new in moved_files])
+            self._conn.executemany(
+                "INSERT INTO duplicates (operation_id, original_path, kept_path) VALUES (?, ?, ?)",
+                [(op_id, original, kept) for original, kept in duplicates])
+            return op_id
+
+    def reserve_ids(self, last_id):
+        """Новые операции получат идентификаторы больше last_id"""
+        with self._lock, self._conn:
+            updated = self._conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'operations'",
+                                         (last_id,)).rowcount
+            if not updated:
+                self._conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('operations', ?)", (last_id,))
+
+    def remove_moves(self, op_id, files, duplicates=()):
+        """Удаляет откатанные перемещения и восстановленные дубликаты; пустая операция удаляется целиком"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM moves WHERE operation_id = ? AND original_path = ? AND destination_path = ?",
+                [(op_id, old, new) for old, new in files])
+            self._conn.executemany(
+                "DELETE FROM duplicates WHERE operation_id = ? AND original_path = ? AND kept_path = ?",
+                [(op_id, original, kept) for original, kept in duplicates])
+            self._conn.execute(
+                "DELETE FROM operations WHERE id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM moves WHERE operation_id = ?) AND NOT EXISTS "
+                "(SELECT 1 FROM duplicates WHERE operation_id = ?)", (op_id, op_id, op_id))
+
+    def count_operations(self, profile=None):
+        query = "SELECT COUNT(*) FROM operations"
+        params = []
+        if profile is not None:
+            query += " WHERE profile = ?"
+            params.append(profile)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def list_operations(self, offset=0, limit=None, after_id=None, profile=None):
+        """Постраничный список операций в хронологическом порядке (profile - только операции профиля)"""
+        query = ("SELECT o.id, o.timestamp, o.profile, "
+                 "(SELECT COUNT(*) FROM moves m WHERE m.operation_id = o.id) AS move_count, "
+                 "(SELECT COUNT(*) FROM duplicates d WHERE d.operation_id = o.id) AS duplicate_count "
+                 "FROM operations o WHERE o.id > ?")
+        params = [-1 if after_id is None else after_id]
+        if profile is not None:
+            query += " AND o.profile = ?"
+            params.append(profile)
+        query += " ORDER BY o.id LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_operation(self, op_id):
+        """Операция по идентификатору или None"""
+        with self._lock:
+            row = self._conn.execute("SELECT id, timestamp, profile FROM operations WHERE id = ?",
+                                     (op_id,)).fetchone()
+        return dict(row) if row else None
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM moves")
+            self._conn.execute("DELETE FROM duplicates")
+            self._conn.execute("DELETE FROM operations")
+
+    def operation_moves(self, op_id, category=None):
+        """Перемещения операции (список пар old_path, new_path)"""
+        query = "SELECT original_path, destination_path FROM moves WHERE operation_id = ?"
+        params = [op_id]
+        if category is not None:
+            query += " AND category = ?"
+            params.append(category)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [[row[0], row[1]] for row in rows]
+
+    def operation_duplicates(self, op_id):
+        """Удаленные дубликаты операции (список пар original_path, kept_path)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT original_path, kept_path FROM duplicates WHERE operation_id = ? ORDER BY id",
+                (op_id,)).fetchall()
+        return [[row[0], row[1]] for row in rows]
+
+    def operation_categories(self, op_id):
+        """Категории операции с числом перемещений в каждой"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT category, COUNT(*) FROM moves WHERE operation_id = ? "
+                "GROUP BY category ORDER BY MIN(id)", (op_id,)).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def find_moves(self, name=None, category=None, original_path=None, destination_path=None,
+                   since=None, until=None, offset=0, limit=None):
+        """
+        Поиск перемещений. since/until - строки времени в формате истории
+        ("%Y-%m-%d %H:%M:%S"), границы включительно.
+        """
+        conditions = []
+        params = []
+        if name is not None:
+            conditions.append("m.name = ? COLLATE NOCASE")
+            params.append(name)
+        if category is not None:
+            conditions.append("m.category = ?")
+            params.append(category)
+        if original_path is not None:
+            conditions.append("m.original_path = ?")
+            params.append(original_path)
+        if destination_path is not None:
+            conditions.append("m.destination_path = ?")
+            params.append(destination_path)
+        if since is not None:
+            conditions.append("o.timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("o.timestamp <= ?")
+            params.append(until)
+
+        query = ("SELECT m.operation_id, o.timestamp, m.original_path, m.destination_path, m.category "
+                 "FROM moves m JOIN operations o ON o.id = m.operation_id")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY m.id LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
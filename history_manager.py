@@ -1,84 +1,575 @@
 import json
 import os
 import datetime
-import shutil
+import threading
+from config_manager import load_config
+from history_db import HistoryDB, move_category
+from transfer import copy_file
 from logger import get_logger
 
 logger = get_logger(__name__)
 
+# Старый формат: весь список операций в одном JSON-файле
 HISTORY_FILE = 'history.json'
+# Журнал: по одной JSON-записи на строку, только дописывание
+HISTORY_JOURNAL = 'history.jsonl'
+# Индекс смещений записей журнала: по строке [id, смещение, конец записи]
+# на запись журнала, только дописывание
+HISTORY_INDEX = 'history.idx'
 
-def initialize_history():
-    """Инициализирует файл истории с пустым списком"""
+# После стольких записей об откате журнал перезаписывается без них
+COMPACT_TOMBSTONES = 50
+
+HISTORY_BACKEND_JOURNAL = "journal"
+HISTORY_BACKEND_SQLITE = "sqlite"
+
+_db = None
+
+_lock = threading.RLock()
+# Кэш разобранного журнала: повторная загрузка читает только дописанный хвост
+_cache = {"offset": 0, "inode": None, "entries": {}, "index": [], "tombstones": 0, "next_id": 1}
+
+
+def _reset_cache():
+    _cache.update(offset=0, inode=None, entries={}, index=[], tombstones=0, next_id=1)
+
+
+def _apply_record(record):
+    """Применяет одну запись журнала к кэшу"""
+    if record["op"] == "meta":
+        # Заголовок уплотненного журнала: идентификаторы удаленных операций не выдаются повторно
+        _cache["next_id"] = max(_cache["next_id"], record["next_id"])
+        return
+    op_id = record["id"]
+    if record["op"] == "add":
+        _cache["entries"][op_id] = {
+            "id": op_id,
+            "timestamp": record["timestamp"],
+            "moved_files": [list(f) for f in record["moved_files"]],
+            "duplicates": [list(d) for d in record.get("duplicates", [])],
+            "profile": record.get("profile"),
+        }
+        _cache["next_id"] = max(_cache["next_id"], op_id + 1)
+    elif record["op"] == "revert":
+        _cache["tombstones"] += 1
+        entry = _cache["entries"].get(op_id)
+        if entry is not None:
+            _apply_revert(entry, record)
+            if not entry["moved_files"] and not entry["duplicates"]:
+                del _cache["entries"][op_id]
+
+
+def _apply_revert(entry, record):
+    """Убирает из операции откатанные перемещения и восстановленные дубликаты"""
+    reverted = {tuple(f) for f in record["files"]}
+    entry["moved_files"] = [f for f in entry["moved_files"] if tuple(f) not in reverted]
+    restored = {tuple(d) for d in record.get("duplicates", [])}
+    entry["duplicates"] = [d for d in entry["duplicates"] if tuple(d) not in restored]
+
+
+def _copy_entry(entry):
+    return {"id": entry["id"], "timestamp": entry["timestamp"],
+            "moved_files": [list(f) for f in entry["moved_files"]],
+            "duplicates": [list(d) for d in entry["duplicates"]],
+            "profile": entry.get("profile")}
+
+
+def _read_tail():
+    """Дочитывает записи, добавленные в журнал после последней загрузки"""
+    try:
+        st = os.stat(HISTORY_JOURNAL)
+    except FileNotFoundError:
+        _reset_cache()
+        return
+    size = st.st_size
+    if size < _cache["offset"] or (_cache["inode"] is not None and st.st_ino != _cache["inode"]):
+        # Журнал был перезаписан (уплотнение в другом процессе)
+        _reset_cache()
+    _cache["inode"] = st.st_ino
+    if size == _cache["offset"]:
+        return
+
+    start = _cache["offset"]
+    indexed = len(_cache["index"])
+    with open(HISTORY_JOURNAL, 'rb') as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Недописанная строка (сбой во время записи) - игнорируем её
+                logger.warning("В журнале истории найдена недописанная запись, она пропущена")
+                break
+            try:
+                record = json.loads(line)
+                _apply_record(record)
+                _cache["index"].append([record.get("id"), offset, offset + len(line)])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Поврежденная запись в журнале истории (смещение {offset}): {e}")
+            offset += len(line)
+        _cache["offset"] = offset
+    _save_index(start, indexed)
+
+
+def _index_lines(rows):
+    return b"".join(json.dumps(row).encode('utf-8') + b"\n" for row in rows)
+
+
+def _index_end():
+    """Позиция журнала, до которой доходит индекс, или None, если индекса нет или он поврежден"""
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=4, ensure_ascii=False)
-        logger.info("Создан новый файл истории")
+        with open(HISTORY_INDEX, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return 0
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+        if not tail.endswith(b"\n"):
+            return None
+        return json.loads(tail.splitlines()[-1])[2]
+    except (OSError, ValueError, IndexError, TypeError):
+        return None
+
+
+def _save_index(start, indexed):
+    """
+    Дописывает в индекс записи, прочитанные из журнала с позиции start
+    (в кэше - начиная с номера indexed). Индекс перезаписывается целиком,
+    только если он отсутствует или не совпадает с журналом (например,
+    после уплотнения), поэтому добавление операции не переписывает его.
+    """
+    try:
+        end = _index_end()
+        if start and end == start:
+            with open(HISTORY_INDEX, 'ab') as f:
+                f.write(_index_lines(_cache["index"][indexed:]))
+        elif end != _cache["offset"]:
+            _atomic_write(HISTORY_INDEX, _index_lines(_cache["index"]))
     except Exception as e:
-        logger.error(f"Ошибка при инициализации файла истории: {e}")
+        logger.warning(f"Не удалось сохранить индекс истории: {e}")
 
-def load_history():
-    """Загружает историю из файла"""
+
+def _atomic_write(path, data):
+    """Записывает файл через временный файл, fsync и переименование"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _append_records(records):
+    """Дописывает записи в конец журнала (кэш должен быть актуален)"""
+    data = b"".join(json.dumps(r, ensure_ascii=False).encode('utf-8') + b"\n" for r in records)
+    if os.path.getsize(HISTORY_JOURNAL) > _cache["offset"]:
+        # Отрезаем недописанную строку, иначе новая запись склеится с ней
+        with open(HISTORY_JOURNAL, 'r+b') as f:
+            f.truncate(_cache["offset"])
+    with open(HISTORY_JOURNAL, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _migrate_legacy_history():
+    """Переносит историю из history.json в журнал (однократно)"""
+    if os.path.exists(HISTORY_JOURNAL) or not os.path.exists(HISTORY_FILE):
+        return
     try:
-        if not os.path.exists(HISTORY_FILE):
-            initialize_history()
-            return []
-            
         with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
             content = f.read().strip()
-            if not content:  # Если файл пустой
-                return []
-            return json.loads(content)
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка при чтении файла истории: {e}")
-        initialize_history()
-        return []
+        legacy = json.loads(content) if content else []
     except Exception as e:
-        logger.error(f"Непредвиденная ошибка при загрузке истории: {e}")
-        return []
+        logger.error(f"Не удалось прочитать {HISTORY_FILE} для переноса в журнал: {e}")
+        return
+
+    records = []
+    for op_id, entry in enumerate(legacy, start=1):
+        records.append({
+            "op": "add",
+            "id": op_id,
+            "timestamp": entry.get("timestamp", ""),
+            "moved_files": entry.get("moved_files", []),
+        })
+    _atomic_write(HISTORY_JOURNAL, b"".join(
+        json.dumps(r, ensure_ascii=False).encode('utf-8') + b"\n" for r in records))
+    os.replace(HISTORY_FILE, HISTORY_FILE + '.bak')
+    logger.info(f"История перенесена в журнал: {len(records)} операций")
+
+
+def _get_db():
+    """Возвращает HistoryDB, если в конфигурации выбран бэкенд sqlite, иначе None"""
+    global _db
+    if load_config().get("history_backend", HISTORY_BACKEND_JOURNAL) != HISTORY_BACKEND_SQLITE:
+        return None
+    with _lock:
+        if _db is None:
+            _db = HistoryDB()
+            if _db.is_empty():
+                # Переносим существующую историю из журнала
+                history = _load_journal()
+                for entry in history:
+                    _db.add_operation(entry["timestamp"], entry["moved_files"], op_id=entry["id"],
+                                      duplicates=entry["duplicates"], profile=entry["profile"])
+                _db.reserve_ids(_cache["next_id"] - 1)
+                if history:
+                    logger.info(f"История перенесена в SQLite: {len(history)} операций")
+        return _db
+
+
+def initialize_history():
+    """Создает пустой журнал истории"""
+    with _lock:
+        try:
+            _atomic_write(HISTORY_JOURNAL, b"")
+            _reset_cache()
+            _save_index(0, 0)
+            logger.info("Создан новый файл истории")
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации файла истории: {e}")
+
+
+def load_history():
+    """Загружает историю (список операций в хронологическом порядке)"""
+    db = _get_db()
+    if db is not None:
+        return [{"id": op["id"], "timestamp": op["timestamp"], "moved_files": db.operation_moves(op["id"]),
+                 "duplicates": db.operation_duplicates(op["id"]), "profile": op["profile"]}
+                for op in db.list_operations()]
+    return _load_journal()
+
+
+def _load_journal():
+    with _lock:
+        try:
+            _migrate_legacy_history()
+            if not os.path.exists(HISTORY_JOURNAL):
+                initialize_history()
+                return []
+            _read_tail()
+            return [_copy_entry(e) for e in _cache["entries"].values()]
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка при загрузке истории: {e}")
+            return []
+
+
+def load_history_entry(op_id):
+    """Загружает одну операцию по идентификатору, читая только её записи через индекс"""
+    db = _get_db()
+    if db is not None:
+        op = db.get_operation(op_id)
+        if op is None:
+            return None
+        return {"id": op_id, "timestamp": op["timestamp"], "moved_files": db.operation_moves(op_id),
+                "duplicates": db.operation_duplicates(op_id), "profile": op["profile"]}
+    with _lock:
+        try:
+            offsets = []
+            end = 0
+            with open(HISTORY_INDEX, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete history index")
+                    record_id, offset, end = json.loads(line)
+                    if record_id == op_id:
+                        offsets.append(offset)
+            # Индекс действителен, только если доходит до конца журнала
+            if end != os.path.getsize(HISTORY_JOURNAL):
+                raise ValueError("stale history index")
+        except Exception:
+            offsets = []
+        if not offsets:
+            return next((e for e in _load_journal() if e["id"] == op_id), None)
+
+        entry = None
+        with open(HISTORY_JOURNAL, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                record = json.loads(f.readline())
+                if record["op"] == "add":
+                    entry = {"id": op_id, "timestamp": record["timestamp"],
+                             "moved_files": [list(p) for p in record["moved_files"]],
+                             "duplicates": [list(d) for d in record.get("duplicates", [])],
+                             "profile": record.get("profile")}
+                elif entry is not None:
+                    _apply_revert(entry, record)
+        if entry is not None and not entry["moved_files"] and not entry["duplicates"]:
+            return None
+        return entry
+
+
+def append_history_entry(entry):
+    """
+    Дописывает операцию в журнал и возвращает её идентификатор.
+    entry - словарь с ключами timestamp, moved_files и (необязательно)
+    duplicates - пары (original_path, kept_path) удаленных дубликатов,
+    profile - имя профиля сортировки (нет или None - рабочий стол).
+    """
+    db = _get_db()
+    if db is not None:
+        try:
+            entry["id"] = db.add_operation(entry["timestamp"], entry["moved_files"],
+                                           duplicates=entry.get("duplicates", ()), profile=entry.get("profile"))
+            logger.info("История успешно сохранена")
+            return entry["id"]
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении истории: {e}")
+            return None
+    with _lock:
+        try:
+            _load_journal()
+            op_id = _cache["next_id"]
+            record = {
+                "op": "add",
+                "id": op_id,
+                "timestamp": entry["timestamp"],
+                "moved_files": [list(f) for f in entry["moved_files"]],
+            }
+            if entry.get("duplicates"):
+                record["duplicates"] = [list(d) for d in entry["duplicates"]]
+            if entry.get("profile"):
+                record["profile"] = entry["profile"]
+            _append_records([record])
+            entry["id"] = op_id
+            _read_tail()
+            logger.info("История успешно сохранена")
+            return op_id
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении истории: {e}")
+            return None
+
+
+def record_revert(op_id, files, duplicates=()):
+    """
+    Записывает в журнал откат файлов операции (files - список пар old_path, new_path)
+    и восстановление дубликатов (duplicates - список пар original_path, kept_path)
+    """
+    if not files and not duplicates:
+        return
+    db = _get_db()
+    if db is not None:
+        try:
+            db.remove_moves(op_id, files, duplicates)
+        except Exception as e:
+            logger.error(f"Ошибка при записи отката в историю: {e}")
+        return
+    with _lock:
+        try:
+            _load_journal()
+            record = {"op": "revert", "id": op_id, "files": [list(f) for f in files]}
+            if duplicates:
+                record["duplicates"] = [list(d) for d in duplicates]
+            _append_records([record])
+            _read_tail()
+            if _cache["tombstones"] >= COMPACT_TOMBSTONES:
+                compact_history()
+        except Exception as e:
+            logger.error(f"Ошибка при записи отката в историю: {e}")
+
+
+def compact_history():
+    """Перезаписывает журнал, оставляя только актуальные операции"""
+    with _lock:
+        history = _load_journal()
+        _write_journal(history)
+        logger.info(f"Журнал истории уплотнен: {len(history)} операций")
+
+
+def _write_journal(history):
+    _read_tail()
+    next_id = max([_cache["next_id"]] + [(e.get("id") or 0) + 1 for e in history])
+    records = []
+    for entry in history:
+        if not entry["moved_files"] and not entry.get("duplicates"):
+            continue
+        if not entry.get("id"):
+            entry["id"] = next_id
+            next_id += 1
+        record = {"op": "add", "id": entry["id"], "timestamp": entry["timestamp"],
+                  "moved_files": [list(f) for f in entry["moved_files"]]}
+        if entry.get("duplicates"):
+            record["duplicates"] = [list(d) for d in entry["duplicates"]]
+        if entry.get("profile"):
+            record["profile"] = entry["profile"]
+        records.append(record)
+    # Первая запись хранит следующий идентификатор: после уплотнения он не
+    # вычисляется заново по оставшимся операциям, поэтому list_operations(after_id)
+    # не пропускает и не повторяет операции
+    records.insert(0, {"op": "meta", "next_id": next_id})
+    _atomic_write(HISTORY_JOURNAL, b"".join(
+        json.dumps(r, ensure_ascii=False).encode('utf-8') + b"\n" for r in records))
+    _reset_cache()
+    _read_tail()
+
 
 def save_history(history):
-    """Сохраняет историю в файл"""
-    try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=4, ensure_ascii=False)
-        logger.info("История успешно сохранена")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении истории: {e}")
+    """Сохраняет историю целиком (атомарная перезапись журнала)"""
+    db = _get_db()
+    if db is not None:
+        db.clear()
+        for entry in history:
+            if entry["moved_files"] or entry.get("duplicates"):
+                entry["id"] = db.add_operation(entry["timestamp"], entry["moved_files"], op_id=entry.get("id"),
+                                               duplicates=entry.get("duplicates", ()), profile=entry.get("profile"))
+        return
+    with _lock:
+        try:
+            _write_journal(history)
+            logger.info("История успешно сохранена")
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении истории: {e}")
+
+
+def count_operations(profile=None):
+    """Число операций в истории (profile - только операции профиля)"""
+    db = _get_db()
+    if db is not None:
+        return db.count_operations(profile)
+    with _lock:
+        _load_journal()
+        if profile is None:
+            return len(_cache["entries"])
+        return sum(1 for e in _cache["entries"].values() if e["profile"] == profile)
+
+
+def list_operations(offset=0, limit=None, after_id=None, profile=None):
+    """
+    Постраничный список операций в хронологическом порядке.
+    Каждая операция - словарь с ключами id, timestamp, profile, move_count и duplicate_count.
+    after_id - вернуть только операции, добавленные после указанной.
+    profile - вернуть только операции профиля сортировки.
+    """
+    db = _get_db()
+    if db is not None:
+        return db.list_operations(offset, limit, after_id, profile)
+    with _lock:
+        _load_journal()
+        entries = list(_cache["entries"].values())
+    if after_id is not None:
+        entries = [e for e in entries if e["id"] > after_id]
+    if profile is not None:
+        entries = [e for e in entries if e["profile"] == profile]
+    end = None if limit is None else offset + limit
+    return [{"id": e["id"], "timestamp": e["timestamp"], "profile": e["profile"],
+             "move_count": len(e["moved_files"]), "duplicate_count": len(e["duplicates"])}
+            for e in entries[offset:end]]
+
+
+def get_operation_moves(op_id, category=None):
+    """Перемещения операции (пары old_path, new_path), при необходимости только одной категории"""
+    db = _get_db()
+    if db is not None:
+        return db.operation_moves(op_id, category)
+    with _lock:
+        _load_journal()
+        entry = _cache["entries"].get(op_id)
+        moves = [list(f) for f in entry["moved_files"]] if entry else []
+    if category is not None:
+        moves = [f for f in moves if move_category(f[1]) == category]
+    return moves
+
+
+def get_operation_duplicates(op_id):
+    """Удаленные дубликаты операции (пары original_path, kept_path)"""
+    db = _get_db()
+    if db is not None:
+        return db.operation_duplicates(op_id)
+    with _lock:
+        _load_journal()
+        entry = _cache["entries"].get(op_id)
+        return [list(d) for d in entry["duplicates"]] if entry else []
+
+
+def get_operation_categories(op_id):
+    """Категории операции в порядке появления: список пар (категория, число файлов)"""
+    db = _get_db()
+    if db is not None:
+        return db.operation_categories(op_id)
+    counts = {}
+    for _old, new in get_operation_moves(op_id):
+        category = move_category(new)
+        counts[category] = counts.get(category, 0) + 1
+    return list(counts.items())
+
+
+def find_moves(name=None, category=None, original_path=None, destination_path=None,
+               since=None, until=None, offset=0, limit=None):
+    """
+    Поиск перемещений по имени файла, категории, пути или диапазону дат.
+    Возвращает словари с ключами operation_id, timestamp, original_path,
+    destination_path и category.
+    """
+    db = _get_db()
+    if db is not None:
+        return db.find_moves(name, category, original_path, destination_path, since, until, offset, limit)
+
+    found = []
+    for entry in _load_journal():
+        if since is not None and entry["timestamp"] < since:
+            continue
+        if until is not None and entry["timestamp"] > until:
+            continue
+        for old, new in entry["moved_files"]:
+            move = {"operation_id": entry["id"], "timestamp": entry["timestamp"],
+                    "original_path": old, "destination_path": new, "category": move_category(new)}
+            if name is not None and os.path.basename(new).lower() != name.lower():
+                continue
+            if category is not None and move["category"] != category:
+                continue
+            if original_path is not None and old != original_path:
+                continue
+            if destination_path is not None and new != destination_path:
+                continue
+            found.append(move)
+    end = None if limit is None else offset + limit
+    return found[offset:end]
+
 
 def add_history_entry(moved_files):
     """
     Добавляет запись об операции сортировки в историю.
     moved_files - список кортежей (old_path, new_path)
     """
-    try:
-        history = load_history()
-        entry = {
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "moved_files": moved_files
-        }
-        history.insert(0, entry)  # Добавляем запись в начало списка
-        save_history(history)
-        logger.info(f"Добавлена новая запись в историю")
-        logger.debug(f"Детали записи: {entry}")
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении записи в историю: {e}")
+    entry = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "moved_files": moved_files
+    }
+    if append_history_entry(entry) is not None:
+        logger.info("Добавлена новая запись в историю")
+        logger.debug("Детали записи: %s", entry)
+
 
-def revert_history_entry(entry):
+def restore_duplicates(duplicates):
     """
-    Откатывает изменения для конкретной записи, перемещая файлы обратно.
+    Восстанавливает удаленные дубликаты копированием оставленной копии.
+    Возвращает список восстановленных пар (original_path, kept_path).
     """
-    try:
-        for file_info in entry["moved_files"]:
-            old_path, new_path = file_info
-            logger.debug(f"Откат файла: {new_path} -> {old_path}")
-            if os.path.exists(new_path):
-                # Создаём папку, если её нет
-                os.makedirs(os.path.dirname(old_path), exist_ok=True)
-                shutil.move(new_path, old_path)
-                logger.info(f"Файл успешно откатан: {new_path} -> {old_path}")
-            else:
-                logger.warning(f"Файл для отката не найден: {new_path}")
-    except Exception as e:
-        logger.error(f"Ошибка при откате изменений: {e}")
-    # Запись из истории удалится после отката в DesktopOrganizerGUI
+    restored = []
+    for original_path, kept_path in duplicates:
+        try:
+            if not os.path.exists(kept_path):
+                logger.warning(f"Оставленная копия для восстановления дубликата не найдена: {kept_path}")
+                continue
+            if os.path.exists(original_path):
+                logger.warning(f"Дубликат не восстановлен, путь занят: {original_path}")
+                continue
+            os.makedirs(os.path.dirname(original_path), exist_ok=True)
+            copy_file(kept_path, original_path, load_config().get("transfer_verify", False))
+            restored.append([original_path, kept_path])
+            logger.debug("Дубликат восстановлен: %s -> %s", kept_path, original_path)
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении дубликата {original_path}: {e}")
+    return restored
+
+
+def revert_history_entry(entry, workers=None, progress=None, cancel_event=None):
+    """
+    Откатывает операцию entry (словарь из load_history): строит план
+    отката и выполняет его пулом потоков, см. revert.revert_operation.
+    Возвращает список откатанных пар (old_path, new_path).
+    """
+    # revert импортирует history_manager, поэтому импорт - при вызове
+    from revert import revert_operation
+    result = revert_operation(entry.get("id"), entry["moved_files"], entry.get("duplicates", []),
+                              workers, progress, cancel_event)
+    return result["files"]
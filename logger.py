@@ -1,15 +1,48 @@
+import atexit
 import logging
-from config_manager import load_config
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config_manager import load_config, subscribe
+
+LOG_FILE = 'desktop_organizer.log'
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
 
 config = load_config()
 
-logging.basicConfig(
-    level=config.get("log_level", "INFO"),
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    filename='desktop_organizer.log',
-    filemode='a',
-    encoding='utf-8'
+# Запись в файл выполняет отдельный поток QueueListener: потоки сортировки
+# только кладут запись в очередь и не ждут диска. Файл ротируется по размеру.
+_file_handler = RotatingFileHandler(
+    LOG_FILE,
+    maxBytes=config.get("log_max_bytes", 1024 * 1024),
+    backupCount=config.get("log_backup_count", 3),
+    encoding='utf-8',
+    delay=True
 )
+_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+_queue = queue.SimpleQueue()
+_listener = QueueListener(_queue, _file_handler, respect_handler_level=False)
+
+_queue_handler = QueueHandler(_queue)
+# Сообщение подставляется в аргументы один раз, оформление - в потоке записи
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=config.get("log_level", "INFO"), handlers=[_queue_handler])
+_listener.start()
+# Записи, оставшиеся в очереди, дописываются при выходе
+atexit.register(_listener.stop)
+
+
+def _on_config_change(new_config, old_config):
+    level = new_config.get("log_level", "INFO")
+    if level != old_config.get("log_level", "INFO"):
+        try:
+            logging.getLogger().setLevel(level)
+        except (ValueError, TypeError):
+            pass
+
+
+subscribe(_on_config_change)
+
 
 def get_logger(name):
     return logging.getLogger(name)
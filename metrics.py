@@ -0,0 +1,180 @@
+"""Метрики запусков сортировки: время этапов, счетчики, журнал JSON Lines и экспорт для Prometheus"""
+
+import copy
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+METRICS_FILE = 'metrics.jsonl'
+# При превышении размера журнал метрик переименовывается в metrics.jsonl.1
+METRICS_MAX_BYTES = 1024 * 1024
+
+# Этапы сортировки рабочего стола (для корней-источников обход и перемещение
+# идут одновременно и учитываются одним этапом walk)
+STAGES = ("scan", "match", "move", "shortcuts", "history", "walk")
+COUNTERS = ("scanned", "matched", "moved", "bytes_moved", "duplicates", "reused", "errors")
+
+
+class RunMetrics:
+    """
+    Итоги одного запуска сортировки.
+
+    stages - время этапов в секундах, counters - счетчики элементов и байт.
+    Словари передаются в plan_sort/execute_plan (параметры timings и
+    counters), которые заполняют их по ходу работы.
+    """
+
+    def __init__(self, source="desktop"):
+        self.source = source
+        self.timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.stages = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.cancelled = False
+        self.duration = 0.0
+        # Операция истории этого запуска (словарь из execute_plan) или None
+        self.operation = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """Засекает время этапа; повторные вызовы суммируются"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def finish(self, cancelled=False):
+        self.cancelled = cancelled
+        self.duration = time.perf_counter() - self._started
+        return self
+
+    def to_dict(self):
+        return {"timestamp": self.timestamp, "source": self.source, "duration": round(self.duration, 6),
+                "cancelled": self.cancelled, "stages": {k: round(v, 6) for k, v in self.stages.items()},
+                "counters": dict(self.counters)}
+
+
+class MetricsRegistry:
+    """Накопленные с запуска процесса метрики по источникам (для /metrics)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Источник -> {"runs", "counters", "stage_sum", "last_timestamp", "last_duration"}
+        self._sources = {}
+
+    def record(self, run):
+        with self._lock:
+            data = self._sources.setdefault(run.source, {
+                "runs": 0, "counters": dict.fromkeys(COUNTERS, 0), "stage_sum": {},
+                "last_timestamp": 0.0, "last_duration": 0.0})
+            data["runs"] += 1
+            for name, value in run.counters.items():
+                data["counters"][name] = data["counters"].get(name, 0) + value
+            for name, value in run.stages.items():
+                data["stage_sum"][name] = data["stage_sum"].get(name, 0.0) + value
+            data["last_timestamp"] = time.time()
+            data["last_duration"] = run.duration
+
+    def render_prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            sources = copy.deepcopy(self._sources)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        metric("organizer_runs_total", "counter", "Completed sort runs.",
+               [({"source": s}, d["runs"]) for s, d in sources.items()])
+        for counter in COUNTERS:
+            metric(f"organizer_{counter}_total", "counter", f"Sum of {counter} over sort runs.",
+                   [({"source": s}, d["counters"].get(counter, 0)) for s, d in sources.items()])
+        metric("organizer_stage_seconds_total", "counter", "Time spent in each sort stage.",
+               [({"source": s, "stage": stage}, f"{value:.6f}")
+                for s, d in sources.items() for stage, value in d["stage_sum"].items()])
+        metric("organizer_last_run_timestamp_seconds", "gauge", "Unix time of the last completed run.",
+               [({"source": s}, f"{d['last_timestamp']:.3f}") for s, d in sources.items()])
+        metric("organizer_last_run_duration_seconds", "gauge", "Duration of the last completed run.",
+               [({"source": s}, f"{d['last_duration']:.6f}") for s, d in sources.items()])
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+_file_lock = threading.Lock()
+
+
+def record_run(run, path=METRICS_FILE):
+    """Добавляет итоги запуска в реестр процесса и в журнал метрик"""
+    registry.record(run)
+    line = json.dumps(run.to_dict(), ensure_ascii=False) + "\n"
+    with _file_lock:
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > METRICS_MAX_BYTES:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning("Не удалось записать метрики: %s", e)
+
+
+def load_recent_runs(limit=100, path=METRICS_FILE):
+    """Последние limit записей журнала метрик (старые первыми)"""
+    runs = deque(maxlen=limit)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Не удалось прочитать метрики: %s", e)
+    return list(runs)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Метрики: " + format, *args)
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Запускает HTTP-сервер с метриками Prometheus по адресу /metrics в
+    фоновом потоке. По умолчанию доступен только локально.
+    Возвращает сервер (остановка через shutdown()).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    logger.info("Адрес метрик: http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,148 @@
+"""Определение типа файла по сигнатуре (magic number) без внешних зависимостей"""
+
+import threading
+
+# Сколько байт начала файла читается для определения типа
+SNIFF_SIZE = 4096
+# Сколько результатов хранится в памяти между запусками
+MEMO_LIMIT = 10000
+
+# Сигнатуры: (смещение, байты, MIME-тип). Проверяются по порядку.
+MAGIC_TABLE = (
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"8BPS", "image/vnd.adobe.photoshop"),
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\xff\xfb", "audio/mpeg"),
+    (0, b"\xff\xf3", "audio/mpeg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"\x1a\x45\xdf\xa3", "video/x-matroska"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+    (0, b"{\\rtf", "application/rtf"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"MZ", "application/vnd.microsoft.portable-executable"),
+    (0, b"BM", "image/bmp"),
+)
+
+# Подтипы контейнера RIFF (байты 8-11)
+RIFF_TYPES = {b"WAVE": "audio/wav", b"AVI ": "video/x-msvideo", b"WEBP": "image/webp"}
+
+# Марки контейнера ISO BMFF (байты 8-11 после "ftyp")
+FTYP_BRANDS = {
+    b"M4A ": "audio/mp4",
+    b"qt  ": "video/quicktime",
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"avif": "image/avif",
+}
+
+# Документы на основе ZIP определяются по именам файлов внутри архива
+ZIP_MARKERS = (
+    (b"mimetypeapplication/epub+zip", "application/epub+zip"),
+    (b"word/", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    (b"xl/", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    (b"ppt/", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+)
+
+TEXT_MARKERS = (
+    (b"<!doctype html", "text/html"),
+    (b"<html", "text/html"),
+    (b"<?xml", "application/xml"),
+)
+
+
+def sniff_bytes(data):
+    """Определяет MIME-тип по первым байтам файла; None, если тип не распознан"""
+    if data[:4] == b"RIFF" and bytes(data[8:12]) in RIFF_TYPES:
+        return RIFF_TYPES[bytes(data[8:12])]
+    if data[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(bytes(data[8:12]), "video/mp4")
+    if data[:4] == b"PK\x03\x04":
+        head = bytes(data)
+        for marker, mime in ZIP_MARKERS:
+            if head.find(marker) != -1:
+                return mime
+        return "application/zip"
+    for offset, magic, mime in MAGIC_TABLE:
+        if data[offset:offset + len(magic)] == magic:
+            return mime
+    return _sniff_text(data)
+
+
+def _sniff_text(data):
+    data = bytes(data)
+    if not data or b"\x00" in data:
+        return None
+    head = data[:64].lstrip().lower()
+    for marker, mime in TEXT_MARKERS:
+        if head.startswith(marker):
+            return mime
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Буфер мог оборвать многобайтовый символ в конце
+        if e.start < len(data) - 3:
+            return None
+    return "text/plain"
+
+
+class MimeSniffer:
+    """
+    Определяет MIME-тип файлов, читая не больше SNIFF_SIZE байт в один
+    переиспользуемый буфер. Результаты запоминаются по (inode, mtime), так
+    что неизменившийся файл повторно не читается.
+    """
+
+    def __init__(self, sniff_size=SNIFF_SIZE, memo_limit=MEMO_LIMIT):
+        self._buffer = bytearray(sniff_size)
+        self._view = memoryview(self._buffer)
+        self._lock = threading.Lock()
+        self._memo = {}
+        self.memo_limit = memo_limit
+
+    def sniff(self, path):
+        """MIME-тип файла по пути или None"""
+        with self._lock:
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    count = f.readinto(self._buffer)
+            except OSError:
+                return None
+            return sniff_bytes(self._view[:count])
+
+    def sniff_entry(self, entry):
+        """MIME-тип для записи сканирования (scanner.ScanEntry) с запоминанием"""
+        # На Windows inode недоступен (0), тогда ключом служит путь
+        key = (entry.inode or entry.path, entry.mtime)
+        mime = self._memo.get(key, False)
+        if mime is False:
+            mime = self.sniff(entry.path)
+            if len(self._memo) >= self.memo_limit:
+                self._memo.clear()
+            self._memo[key] = mime
+        return mime
+
+
+_default_sniffer = None
+
+
+def default_sniffer():
+    """Общий для процесса MimeSniffer"""
+    global _default_sniffer
+    if _default_sniffer is None:
+        _default_sniffer = MimeSniffer()
+    return _default_sniffer
@@ -1,21 +1,184 @@
+import os
 import time
 import threading
-from config_manager import load_config
-from file_sorter import sort_desktop
+from config_manager import load_config, subscribe
+from file_sorter import sort_desktop, sort_all, sort_profiles, sort_source_roots, get_desktop_path
+from profiles import load_profiles
+from scanner import scan_directory
+from shortcuts import SHORTCUT_SUFFIXES
+from watcher import DesktopWatcher
+from profiling import profiled, profiling_options
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-def start_monitoring():
+MONITOR_MODE_INTERVAL = "interval"
+MONITOR_MODE_WATCH = "watch"
+# Как часто монитор проверяет файл конфигурации на изменения (с)
+CONFIG_POLL_INTERVAL = 5
+
+def start_monitoring(mode=None, backend=None, workers=None, profile=None):
+    """
+    profile - пара (cpu, memory): профилируется первый цикл мониторинга
+    (см. profiling.profiled); по умолчанию из скрытых настроек.
+    """
     config = load_config()
+    mode = mode or config.get("monitor_mode", MONITOR_MODE_INTERVAL)
+    profile = profile or profiling_options(config)
+    # Профили обслуживаются тем же процессом в любом режиме
+    start_profile_monitoring(workers=workers)
+    if mode == MONITOR_MODE_WATCH:
+        # Наблюдатель следит только за рабочим столом; корни-источники
+        # сортируются периодически, как в режиме interval
+        start_source_root_monitoring(workers=workers)
+        return start_watching(backend=backend, workers=workers, profile=profile)
+
     interval = config.get("check_interval", 300)
     logger.info("Monitoring started. Checking desktop every %s seconds.", interval)
-    
+
+    # Новый check_interval применяется сразу, не дожидаясь конца текущего ожидания
+    interval_changed = threading.Event()
+
+    def on_config_change(new_config, old_config):
+        if new_config.get("check_interval") != old_config.get("check_interval"):
+            logger.info("Check interval changed to %s seconds.", new_config.get("check_interval"))
+            interval_changed.set()
+
+    subscribe(on_config_change)
+
     def monitor_loop():
+        with profiled("monitor", *profile):
+            sort_all(workers=workers, profiles=False)
         while True:
-            sort_desktop()
-            time.sleep(interval)
+            started = time.monotonic()
+            while True:
+                # Перечитывание конфигурации дешевое: файл проверяется по mtime и размеру
+                interval = load_config().get("check_interval", 300)
+                remaining = interval - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                interval_changed.wait(min(remaining, CONFIG_POLL_INTERVAL))
+                interval_changed.clear()
+            sort_all(workers=workers, profiles=False)
 
     t = threading.Thread(target=monitor_loop, daemon=True)
     t.start()
     return t
+
+def start_source_root_monitoring(workers=None):
+    """
+    Периодически сортирует корни-источники из source_roots раз в
+    check_interval (для режима watch). Список корней и интервал
+    перечитываются из конфигурации на каждом круге.
+    Возвращает запущенный поток.
+    """
+    def roots_loop():
+        while True:
+            started = time.monotonic()
+            config = load_config()
+            if config.get("source_roots"):
+                sort_source_roots(config, workers=workers)
+            while True:
+                remaining = load_config().get("check_interval", 300) - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, CONFIG_POLL_INTERVAL))
+
+    t = threading.Thread(target=roots_loop, daemon=True, name="source-root-monitor")
+    t.start()
+    return t
+
+def start_profile_monitoring(workers=None):
+    """
+    Периодически сортирует профили из config["profiles"], каждый со своим
+    check_interval. Профили, подошедшие по времени, сортируются вместе
+    (sort_profiles) с общим ограничением ввода-вывода. Список профилей
+    перечитывается из конфигурации на каждом круге.
+    Возвращает запущенный поток.
+    """
+    def profile_loop():
+        # Имя профиля -> время следующей сортировки (time.monotonic)
+        due = {}
+        announced = None
+        while True:
+            config = load_config()
+            profiles = {p["name"]: p for p in load_profiles(config)}
+            if sorted(profiles) != announced:
+                announced = sorted(profiles)
+                if announced:
+                    logger.info("Monitoring %d sorting profiles: %s", len(announced), ", ".join(announced))
+            now = time.monotonic()
+            for name in list(due):
+                if name not in profiles:
+                    del due[name]
+            ready = [name for name in profiles if due.get(name, now) <= now]
+            if ready:
+                sort_profiles(config, workers=workers, names=ready)
+                finished = time.monotonic()
+                for name in ready:
+                    interval = profiles[name].get("check_interval", config.get("check_interval", 300))
+                    due[name] = finished + interval
+            wait = min([d - time.monotonic() for d in due.values()] + [CONFIG_POLL_INTERVAL])
+            time.sleep(max(wait, 0.1))
+
+    t = threading.Thread(target=profile_loop, daemon=True, name="profile-monitor")
+    t.start()
+    return t
+
+def _is_sort_output(folder, name, organized_dir):
+    """
+    Элемент, который сортировка создает сама: ярлык .lnk/.desktop,
+    символическая ссылка (ярлык бэкенда symlink) или папка организованных файлов
+    """
+    path = os.path.join(folder, name)
+    if name.endswith(SHORTCUT_SUFFIXES) or os.path.islink(path):
+        return True
+    return bool(organized_dir) and os.path.normcase(os.path.abspath(path)) == \
+        os.path.normcase(os.path.abspath(organized_dir))
+
+def start_watching(backend=None, on_sorted=None, workers=None, profile=None):
+    """
+    Запускает событийный мониторинг: сортируются только созданные или
+    переименованные элементы после окна debounce.
+    on_sorted - вызывается после каждой инкрементальной сортировки.
+    workers - число потоков перемещения (по умолчанию из конфигурации).
+    profile - пара (cpu, memory): профилируется первая пачка (по умолчанию
+    из скрытых настроек profile_cpu/profile_memory).
+    Возвращает запущенный DesktopWatcher (остановка через stop()).
+    """
+    config = load_config()
+    backend = backend or config.get("watch_backend", "auto")
+    debounce = config.get("watch_debounce", 2)
+    desktop_path = get_desktop_path()
+    # Профилируется только первая пачка: последующие обычно малы
+    pending_profile = [profile or profiling_options(config)]
+
+    def on_batch(names):
+        # Ярлыки и папка организованных файлов не сортируются; без фильтра
+        # созданные самой сортировкой элементы запускали бы еще одну пустую
+        # сортировку через окно debounce
+        organized_dir = load_config().get("organized_files_dir")
+        names = [name for name in names if not _is_sort_output(desktop_path, name, organized_dir)]
+        if not names:
+            return
+        logger.debug("Изменены элементы рабочего стола: %s", names)
+        with profiled("watch", *(pending_profile.pop() if pending_profile else (False, False))):
+            sort_desktop(names, workers=workers)
+        if on_sorted:
+            on_sorted()
+
+    desktop_watcher = DesktopWatcher(desktop_path, on_batch, backend=backend, debounce=debounce).start()
+    logger.info("Monitoring started. Watching desktop for changes (%s backend, %s s debounce).",
+                desktop_watcher.backend, debounce)
+
+    def on_config_change(new_config, old_config):
+        delay = new_config.get("watch_debounce", 2)
+        if delay != desktop_watcher.debouncer.delay:
+            desktop_watcher.debouncer.delay = delay
+            logger.info("Watch debounce changed to %s seconds.", delay)
+
+    desktop_watcher.subscribe_config(on_config_change)
+
+    # Элементы, появившиеся до запуска, обрабатываются первой пачкой
+    desktop_watcher.debouncer.touch(e.name for e in scan_directory(desktop_path))
+    return desktop_watcher
@@ -0,0 +1,272 @@
+"""Параллельное перемещение файлов с ограниченным пулом потоков"""
+
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from transfer import move_path
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_WORKERS = 4
+# Сколько байт одновременно могут копировать межтомовые перемещения
+DEFAULT_COPY_BUDGET = 256 * 1024 * 1024
+# Сколько задач потоковой сортировки может ждать выполнения
+DEFAULT_MAX_PENDING = 1000
+
+
+class MoveTask:
+    """Одно перемещение: источник, цель и размер (для межтомового копирования)"""
+
+    __slots__ = ("source", "target", "size", "payload", "same_device", "overwrite", "error", "cancelled")
+
+    def __init__(self, source, target, size=0, payload=None, same_device=None, overwrite=False):
+        self.source = source
+        self.target = target
+        self.size = size
+        # Произвольные данные вызывающего кода (запись сканирования и т.п.)
+        self.payload = payload
+        # Известно ли заранее, что источник и цель на одном томе (None - определить по stat)
+        self.same_device = same_device
+        # Цель существует и заменяется (решение overwrite при конфликте имен)
+        self.overwrite = overwrite
+        self.error = None
+        # Задача пропущена из-за отмены сортировки
+        self.cancelled = False
+
+    @property
+    def ok(self):
+        return self.error is None and not self.cancelled
+
+
+class ByteBudget:
+    """
+    Ограничение на суммарный объем одновременно копируемых данных.
+    Файл больше всего бюджета пропускается, когда других копирований нет.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self._cond.wait()
+            self.in_flight += size
+
+    def release(self, size):
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+
+class FairLimiter:
+    """
+    Общее ограничение числа одновременных перемещений для нескольких
+    источников (профилей). Освободившееся место отдается ожидающим по кругу,
+    по одному ключу за раз, поэтому источник с длинной очередью не
+    вытесняет остальные.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self._cond = threading.Condition()
+        # Ключ -> очередь ожидающих (списки [получено]); порядок ключей - очередь обхода
+        self._waiting = collections.OrderedDict()
+
+    def acquire(self, key):
+        with self._cond:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                return
+            ticket = [False]
+            self._waiting.setdefault(key, collections.deque()).append(ticket)
+            self._cond.wait_for(lambda: ticket[0])
+
+    def release(self):
+        with self._cond:
+            if not self._waiting:
+                self.active -= 1
+                return
+            # Место переходит к первому ключу, который затем уходит в конец круга
+            key, queue = self._waiting.popitem(last=False)
+            queue.popleft()[0] = True
+            if queue:
+                self._waiting[key] = queue
+            self._cond.notify_all()
+
+
+def _device_of(path):
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+class MoveScheduler:
+    """
+    Выполняет перемещения в двух очередях: быстрая - переименования в пределах
+    одного тома, медленная - копирование между томами с ограничением по объему.
+    Перемещения в одну папку назначения выполняются строго по порядку.
+    limiter и limiter_key - общий для нескольких планировщиков FairLimiter
+    и ключ этого планировщика в нём (глобальное ограничение ввода-вывода).
+    move_func(source, target, overwrite) - функция перемещения.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, copy_budget=DEFAULT_COPY_BUDGET, move_func=move_path,
+                 limiter=None, limiter_key=None):
+        self.workers = max(1, int(workers))
+        self.copy_workers = max(1, self.workers // 2)
+        self.budget = ByteBudget(copy_budget)
+        self.move_func = move_func
+        self.limiter = limiter
+        self.limiter_key = limiter_key
+        self._cancel_event = None
+        self._on_done = None
+
+    def run(self, tasks, cancel_event=None, on_done=None, serial_folders=True):
+        """
+        Выполняет задачи и возвращает их в исходном порядке с заполненным error.
+        cancel_event - после его установки оставшиеся задачи помечаются cancelled.
+        on_done(task) - вызывается из рабочего потока после каждой задачи.
+        serial_folders - выполнять задачи с общей папкой назначения по очереди;
+        False, если конфликты имен уже исключены (например, при откате).
+        """
+        if not tasks:
+            return tasks
+        self._cancel_event = cancel_event
+        self._on_done = on_done
+
+        # Группируем по папке назначения, сохраняя порядок внутри группы
+        groups = {}
+        for task in tasks:
+            key = os.path.dirname(task.target) if serial_folders else task.target
+            groups.setdefault(key, []).append(task)
+
+        source_devices = {}
+        fast_lane = []
+        slow_lane = []
+        for folder, group in groups.items():
+            same_device = group[0].same_device
+            if same_device is None:
+                source_dir = os.path.dirname(group[0].source)
+                if source_dir not in source_devices:
+                    source_devices[source_dir] = _device_of(source_dir)
+                target_dir = os.path.dirname(group[0].target)
+                same_device = (source_devices[source_dir] is not None
+                               and source_devices[source_dir] == _device_of(target_dir))
+            (fast_lane if same_device else slow_lane).append(group)
+
+        logger.debug("Очереди перемещения: групп переименования %d, групп копирования %d", len(fast_lane), len(slow_lane))
+
+        if self.workers == 1:
+            for group in fast_lane + slow_lane:
+                self._run_group(group, throttled=False)
+            return tasks
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="move") as fast, \
+                ThreadPoolExecutor(max_workers=self.copy_workers, thread_name_prefix="copy") as slow:
+            futures = [fast.submit(self._run_group, g, False) for g in fast_lane]
+            futures += [slow.submit(self._run_group, g, True) for g in slow_lane]
+            for future in futures:
+                future.result()
+        return tasks
+
+    def _run_group(self, group, throttled):
+        for task in group:
+            self._run_task(task, throttled)
+
+    def _run_task(self, task, throttled, cancel_event=None, on_done=None):
+        cancel_event = cancel_event or self._cancel_event
+        on_done = on_done or self._on_done
+        if cancel_event is not None and cancel_event.is_set():
+            task.cancelled = True
+            return
+        if throttled:
+            self.budget.acquire(task.size)
+        if self.limiter is not None:
+            self.limiter.acquire(self.limiter_key)
+        try:
+            self.move_func(task.source, task.target, task.overwrite)
+        except Exception as e:
+            task.error = e
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+            if throttled:
+                self.budget.release(task.size)
+        if on_done is not None:
+            on_done(task)
+
+    def stream(self, cancel_event=None, on_done=None, max_pending=DEFAULT_MAX_PENDING):
+        """
+        Потоковый режим: задачи передаются через submit() по мере появления
+        и начинают выполняться сразу. Используется как контекстный менеджер;
+        при выходе дожидается завершения всех задач. См. MoveStream.
+        """
+        return MoveStream(self, cancel_event, on_done, max_pending)
+
+
+class MoveStream:
+    """
+    Выполнение перемещений по мере их поступления.
+
+    Задачи в одну папку назначения выполняются строго по очереди (своя
+    очередь на папку), разные папки - параллельно. Задачи с same_device=False
+    идут в пул копирования с ограничением по объему. submit() блокируется,
+    когда ожидают выполнения max_pending задач, поэтому источник задач
+    не обгоняет перемещения и память ограничена.
+    """
+
+    def __init__(self, scheduler, cancel_event=None, on_done=None, max_pending=DEFAULT_MAX_PENDING):
+        self.scheduler = scheduler
+        self.cancel_event = cancel_event
+        self.on_done = on_done
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._fast = None
+        self._slow = None
+        self.submitted = 0
+
+    def __enter__(self):
+        self._fast = ThreadPoolExecutor(max_workers=self.scheduler.workers, thread_name_prefix="move")
+        self._slow = ThreadPoolExecutor(max_workers=self.scheduler.copy_workers, thread_name_prefix="copy")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._fast.shutdown(wait=True)
+        self._slow.shutdown(wait=True)
+
+    def submit(self, task):
+        """Ставит задачу в очередь её папки назначения"""
+        self._slots.acquire()
+        self.submitted += 1
+        folder = os.path.dirname(task.target)
+        throttled = task.same_device is False
+        with self._lock:
+            lane = self._lanes.get(folder)
+            if lane is not None:
+                lane.append(task)
+                return
+            self._lanes[folder] = collections.deque([task])
+        (self._slow if throttled else self._fast).submit(self._drain, folder, throttled)
+
+    def _drain(self, folder, throttled):
+        while True:
+            with self._lock:
+                lane = self._lanes[folder]
+                if not lane:
+                    del self._lanes[folder]
+                    return
+                task = lane.popleft()
+            try:
+                self.scheduler._run_task(task, throttled, self.cancel_event, self.on_done)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике перемещения {task.source}: {e}")
+            finally:
+                self._slots.release()
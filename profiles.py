@@ -0,0 +1,59 @@
+"""Профили сортировки: несколько наборов (источник, назначение, правила) в одной конфигурации"""
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Сколько перемещений всех профилей может выполняться одновременно
+DEFAULT_IO_CONCURRENCY = 4
+
+# Параметры профиля, заменяющие одноименные параметры общей конфигурации
+PROFILE_OVERRIDES = ("sorting_rules", "collision_policy", "move_workers", "check_interval")
+
+
+def load_profiles(config):
+    """
+    Проверенные профили из config["profiles"].
+
+    Профиль - словарь: name, source, destination и необязательные
+    sorting_rules, collision_policy, move_workers, check_interval (по
+    умолчанию - из общей конфигурации), max_depth (по умолчанию 0 - только
+    сам источник, как рабочий стол) и exclude. Профили без обязательных
+    полей и с повторяющимися именами пропускаются.
+    """
+    profiles = []
+    names = set()
+    for profile in config.get("profiles", []):
+        if not isinstance(profile, dict):
+            logger.warning(f"Профиль сортировки должен быть словарем: {profile!r}")
+            continue
+        name = profile.get("name")
+        missing = [key for key in ("name", "source", "destination") if not profile.get(key)]
+        if missing:
+            logger.warning(f"Профиль {name or profile!r} пропущен: не указаны {', '.join(missing)}")
+            continue
+        if name in names:
+            logger.warning(f"Профиль {name} пропущен: имя уже используется")
+            continue
+        names.add(name)
+        profiles.append(profile)
+    return profiles
+
+
+def profile_config(config, profile):
+    """Конфигурация для сортировки профиля: общая с параметрами профиля поверх"""
+    merged = dict(config)
+    for key in PROFILE_OVERRIDES:
+        if key in profile:
+            merged[key] = profile[key]
+    merged["organized_files_dir"] = profile["destination"]
+    return merged
+
+
+def profile_root(profile):
+    """Корень-источник профиля в формате source_roots (см. file_sorter.sort_source_root)"""
+    root = {"path": profile["source"], "destination": profile["destination"],
+            "max_depth": profile.get("max_depth", 0)}
+    if "exclude" in profile:
+        root["exclude"] = profile["exclude"]
+    return root
@@ -0,0 +1,159 @@
+"""Профилирование сортировки по запросу: cProfile и tracemalloc с отчетами рядом с журналом"""
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from logger import get_logger, LOG_FILE
+
+logger = get_logger(__name__)
+
+# Сколько функций и мест выделения памяти попадает в отчет
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 30
+# Сколько самых горячих функций выводится в журнал
+SUMMARY_FUNCTIONS = 5
+# Глубина стека для мест выделения памяти
+TRACEMALLOC_FRAMES = 5
+
+# В процессе может работать только один cProfile, а трассировку tracemalloc
+# остановил бы первый завершившийся запуск: параллельная сортировка
+# (например, монитор и кнопка в GUI) выполняется без профилирования
+_profile_lock = threading.Lock()
+
+
+def profiling_options(config, cpu=False, memory=False):
+    """
+    Пара (cpu, memory): флаги командной строки --profile/--trace-memory
+    или скрытые настройки profile_cpu/profile_memory (их нет в GUI, они
+    задаются в config.json для сбора профилей на рабочих машинах).
+    """
+    return (bool(cpu or config.get("profile_cpu", False)),
+            bool(memory or config.get("profile_memory", False)))
+
+
+def report_base(name, directory=None):
+    """
+    Путь отчетов без расширения рядом с журналом: profile-<name>-<время>;
+    при совпадении времени с уже сохраненным отчетом добавляется номер
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(LOG_FILE))
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(directory, f"profile-{name}-{stamp}")
+    number = 1
+    candidate = base
+    while os.path.exists(candidate + ".txt"):
+        number += 1
+        candidate = f"{base}-{number}"
+    return candidate
+
+
+def hottest_functions(stats, limit=SUMMARY_FUNCTIONS):
+    """Функции с наибольшим собственным временем: (описание, число вызовов, tottime, cumtime)"""
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        location = f"{os.path.basename(filename)}:{line}({function})" if line else function
+        rows.append((location, calls, tottime, cumtime))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:limit]
+
+
+def _write_cpu_report(f, profiler, pstats_path):
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(pstats_path)
+    f.write(f"CPU profile: {pstats_path}\n\nHottest functions (own time):\n")
+    for location, calls, tottime, cumtime in hottest_functions(stats, TOP_FUNCTIONS):
+        f.write(f"  {tottime:10.4f} s own  {cumtime:10.4f} s total  {calls:>9} calls  {location}\n")
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    f.write("\nBy cumulative time:\n")
+    f.write(text.getvalue())
+    return stats
+
+
+def _write_memory_report(f, snapshot, peak):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    top = snapshot.statistics("traceback")[:TOP_ALLOCATIONS]
+    f.write(f"\nPeak traced memory: {peak / 1024 / 1024:.1f} MB\n\nTop allocations still alive at the end:\n")
+    for stat in top:
+        f.write(f"  {stat.size / 1024:10.1f} KB  {stat.count:>9} blocks\n")
+        for line in stat.traceback.format():
+            f.write(f"      {line}\n")
+
+
+@contextmanager
+def profiled(name, cpu=False, memory=False, directory=None):
+    """
+    Профилирует блок кода в текущем потоке.
+
+    cpu - cProfile: статистика сохраняется в profile-<name>-<время>.pstats
+    (открывается pstats или snakeviz). memory - tracemalloc: пик и места
+    выделения памяти. Текстовый отчет (горячие функции и выделения памяти)
+    пишется в profile-<name>-<время>.txt, краткая сводка - в журнал.
+    Перемещения выполняются потоками MoveScheduler, поэтому в профиле они
+    видны как ожидание; время сканирования, сопоставления, ярлыков и
+    истории учитывается полностью. Без cpu и memory ничего не делает.
+    """
+    if not cpu and not memory:
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        logger.info("Профилирование %s пропущено: уже выполняется другое профилирование", name)
+        yield
+        return
+
+    profiler = cProfile.Profile() if cpu else None
+    # Если трассировка уже включена (например, бенчмарком), она не останавливается
+    own_tracing = memory and not tracemalloc.is_tracing()
+    if own_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    elif memory and hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+        tracemalloc.reset_peak()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            snapshot = peak = None
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if own_tracing:
+                    tracemalloc.stop()
+            try:
+                _save_reports(name, profiler, snapshot, peak, directory)
+            except OSError as e:
+                logger.error("Не удалось сохранить профиль %s: %s", name, e)
+    finally:
+        _profile_lock.release()
+
+
+def _save_reports(name, profiler, snapshot, peak, directory):
+    base = report_base(name, directory)
+    report = base + ".txt"
+    stats = None
+    with open(report, "w", encoding="utf-8") as f:
+        if profiler is not None:
+            stats = _write_cpu_report(f, profiler, base + ".pstats")
+        if snapshot is not None:
+            _write_memory_report(f, snapshot, peak)
+
+    if stats is not None:
+        hottest = "; ".join(f"{location} {tottime:.3f} s"
+                            for location, _, tottime, _ in hottest_functions(stats))
+        logger.info("Профиль %s: %.3f s, самые горячие функции: %s", name, stats.total_tt, hottest)
+    if peak is not None:
+        logger.info("Профиль %s: пик памяти %.1f MB", name, peak / 1024 / 1024)
+    logger.info("Отчет профилирования: %s", report)
@@ -0,0 +1,294 @@
+"""Откат операций истории: план отката и его параллельное выполнение"""
+
+import os
+import re
+import threading
+from collections import namedtuple
+from history_manager import record_revert, restore_duplicates
+from move_scheduler import MoveScheduler, MoveTask, DEFAULT_WORKERS
+from shortcuts import SHORTCUT_SUFFIXES, is_shortcut_to
+from sort_plan import device_of
+from transfer import move_path
+from collisions import split_name
+from sort_worker import EventWorker
+from config_manager import load_config
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Состояние элемента в плане отката
+REVERT_MOVE = "move"
+REVERT_MISSING = "missing"
+REVERT_CONFLICT = "conflict"
+
+# Один элемент плана отката.
+#   original    - путь до сортировки (куда элемент возвращается)
+#   current     - текущий путь элемента (назначение сортировки)
+#   shortcut    - ярлык на рабочем столе, указывающий на current (или None)
+#   size        - размер для межтомового копирования (0 для переименования)
+#   same_device - original и current на одном томе
+#   status      - REVERT_MOVE, REVERT_MISSING (элемента нет) или REVERT_CONFLICT (original занят)
+PlannedRevert = namedtuple("PlannedRevert", "original current shortcut size same_device status")
+
+# "основа (N)" - ярлык, получивший номер при конфликте имен на рабочем столе
+_NUMBERED_RE = re.compile(r"^(?P<stem>.*) \(\d+\)$")
+
+# План отката операции.
+#   op_id      - идентификатор операции в истории (None - не записывать откат)
+#   reverts    - кортеж PlannedRevert
+#   duplicates - тройки (original_path, kept_path, shortcut) дубликатов для восстановления;
+#                shortcut - ярлык на оставленную копию под именем дубликата (или None)
+RevertPlan = namedtuple("RevertPlan", "op_id reverts duplicates")
+
+
+class _Listings:
+    """Имена в папках: один scandir на папку вместо stat на каждый путь"""
+
+    def __init__(self):
+        self._folders = {}
+        self._numbered = {}
+
+    def get(self, folder):
+        names = self._folders.get(folder)
+        if names is None:
+            # Имя -> является ли элемент символической ссылкой
+            names = {}
+            # Имя без номера -> имена вида "основа (N).ext" (см. collisions.FolderNameIndex)
+            numbered = {}
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        names[os.path.normcase(entry.name)] = entry.is_symlink()
+                        for is_dir in (False, True):
+                            stem, ext = split_name(entry.name, is_dir)
+                            match = _NUMBERED_RE.match(stem)
+                            if match:
+                                key = os.path.normcase(match.group("stem") + ext)
+                                numbered.setdefault(key, []).append(entry.name)
+            except OSError:
+                pass
+            self._folders[folder] = names
+            self._numbered[folder] = numbered
+        return names
+
+    def numbered(self, folder, name):
+        """Имена вида "основа (N).ext" в папке, выделенные вместо занятого имени name"""
+        self.get(folder)
+        return self._numbered[folder].get(os.path.normcase(name), [])
+
+
+def _find_shortcut(listings, path, target):
+    """
+    Ищет ярлык, оставленный сортировкой на месте path и указывающий на
+    target: "имя.lnk", "имя.desktop", ссылку с тем же именем (бэкенд
+    symlink - не конфликт) или, при конфликте имен на рабочем столе,
+    ярлык вида "имя (N).lnk". Возвращает (ярлык или None, занят ли path
+    другим элементом). Единственный кандидат не читается: это проверяется
+    перед удалением (is_shortcut_to).
+    """
+    folder, name = os.path.split(path)
+    names = listings.get(folder)
+    candidates = [path + suffix for suffix in SHORTCUT_SUFFIXES if os.path.normcase(name + suffix) in names]
+    occupied = False
+    key = os.path.normcase(name)
+    if key in names:
+        if names[key] and is_shortcut_to(path, target):
+            candidates.insert(0, path)
+        else:
+            occupied = True
+    for base in [name + suffix for suffix in SHORTCUT_SUFFIXES] + [name]:
+        candidates += [os.path.join(folder, numbered) for numbered in listings.numbered(folder, base)]
+
+    if len(candidates) <= 1:
+        return (candidates[0] if candidates else None), occupied
+    for candidate in candidates:
+        if is_shortcut_to(candidate, target):
+            return candidate, occupied
+    return None, occupied
+
+
+def plan_revert(op_id, moves, duplicates=()):
+    """
+    Строит план отката, ничего не изменяя на диске.
+    moves - пары (old_path, new_path) из истории, duplicates - пары
+    (original_path, kept_path). Для каждого перемещения проверяется, что
+    элемент на месте, что исходный путь свободен, и ищется оставленный
+    сортировкой ярлык (см. _find_shortcut); для дубликатов - ярлык на
+    оставленную копию.
+    """
+    listings = _Listings()
+    devices = {}
+
+    def device(folder):
+        if folder not in devices:
+            devices[folder] = device_of(folder)
+        return devices[folder]
+
+    reverts = []
+    for old_path, new_path in moves:
+        old_folder, old_name = os.path.split(old_path)
+        new_folder, new_name = os.path.split(new_path)
+        same_device = device(old_folder) is not None and device(old_folder) == device(new_folder)
+        if os.path.normcase(new_name) not in listings.get(new_folder):
+            reverts.append(PlannedRevert(old_path, new_path, None, 0, same_device, REVERT_MISSING))
+            continue
+
+        shortcut, occupied = _find_shortcut(listings, old_path, new_path)
+        status = REVERT_CONFLICT if occupied else REVERT_MOVE
+
+        size = 0
+        if not same_device and status == REVERT_MOVE:
+            try:
+                size = os.stat(new_path).st_size
+            except OSError:
+                pass
+        reverts.append(PlannedRevert(old_path, new_path, shortcut, size, same_device, status))
+    planned_duplicates = tuple((original, kept, _find_shortcut(listings, original, kept)[0])
+                               for original, kept in duplicates)
+    return RevertPlan(op_id, tuple(reverts), planned_duplicates)
+
+
+def _restore_in_place(original, shortcut, target, restore):
+    """
+    Выполняет restore() - возврат элемента на место original - и удаляет
+    ярлык shortcut, если он указывает на target. Ярлык .lnk/.desktop
+    удаляется только после успешного restore(); ссылка, занимающая
+    исходное имя (бэкенд symlink), удаляется до него и восстанавливается,
+    если restore() вернул False или вызвал исключение.
+    """
+    if shortcut is None or not is_shortcut_to(shortcut, target):
+        return restore()
+    if shortcut != original:
+        if not restore():
+            return False
+        try:
+            os.remove(shortcut)
+        except OSError as e:
+            logger.warning("Не удалось удалить ярлык %s: %s", shortcut, e)
+        return True
+    link_target = os.readlink(shortcut)
+    os.remove(shortcut)
+    restored = False
+    try:
+        restored = restore()
+    finally:
+        if not restored:
+            os.symlink(link_target, shortcut)
+    return restored
+
+
+def _revert_one(current, original, shortcut, verify=False):
+    """Возвращает элемент на место и удаляет ярлык, указывающий на current"""
+    def restore():
+        move_path(current, original, verify)
+        return True
+    _restore_in_place(original, shortcut, current, restore)
+
+
+def _restore_duplicates(duplicates):
+    """Восстанавливает дубликаты и удаляет ярлыки на их оставленные копии"""
+    restored = []
+    for original, kept, shortcut in duplicates:
+        if _restore_in_place(original, shortcut, kept, lambda: bool(restore_duplicates([(original, kept)]))):
+            restored.append([original, kept])
+    return restored
+
+
+def _no_progress(event):
+    pass
+
+
+def execute_revert(plan, workers=None, progress=None, cancel_event=None):
+    """
+    Выполняет план отката: восстанавливает дубликаты (пока оставленные
+    копии на месте), затем возвращает элементы пулом потоков
+    (MoveScheduler) и записывает в историю одну запись об откате.
+    progress получает события: planned (total, missing, conflicts),
+    reverted (name, reverted, total) и finished (reverted, restored,
+    missing, conflicts, errors, cancelled).
+    Возвращает словарь с теми же полями, что и событие finished, и
+    списком откатанных пар в "files".
+    """
+    if progress is None:
+        progress = _no_progress
+    config = load_config()
+    if workers is None:
+        workers = config.get("move_workers", DEFAULT_WORKERS)
+    verify = config.get("transfer_verify", False)
+
+    pending = [r for r in plan.reverts if r.status == REVERT_MOVE]
+    missing = sum(1 for r in plan.reverts if r.status == REVERT_MISSING)
+    conflicts = [r for r in plan.reverts if r.status == REVERT_CONFLICT]
+    for r in conflicts:
+        logger.warning("Откат %s пропущен: %s уже существует", r.current, r.original)
+    progress({"event": "planned", "total": len(pending), "missing": missing, "conflicts": len(conflicts)})
+
+    restored = _restore_duplicates(plan.duplicates)
+
+    for folder in {os.path.dirname(r.original) for r in pending}:
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as e:
+            logger.error("Не удалось создать папку %s для отката: %s", folder, e)
+
+    tasks = [MoveTask(r.current, r.original, r.size, r, r.same_device) for r in pending]
+    counter = {"reverted": 0}
+    counter_lock = threading.Lock()
+
+    def on_done(task):
+        if not task.ok:
+            return
+        with counter_lock:
+            counter["reverted"] += 1
+            event = {"event": "reverted", "name": os.path.basename(task.target),
+                     "reverted": counter["reverted"], "total": len(tasks)}
+        progress(event)
+
+    # Ярлык удаляется в том же потоке, что и перемещение его элемента
+    shortcuts = {r.current: r.shortcut for r in pending}
+    scheduler = MoveScheduler(workers, move_func=lambda current, original, overwrite=False: _revert_one(
+        current, original, shortcuts[current], verify))
+    scheduler.run(tasks, cancel_event=cancel_event, on_done=on_done, serial_folders=False)
+
+    files = []
+    errors = 0
+    for task in tasks:
+        if task.ok:
+            files.append([task.target, task.source])
+        elif task.error is not None:
+            errors += 1
+            logger.error("Ошибка при откате %s: %s", task.source, task.error)
+
+    if plan.op_id is not None:
+        record_revert(plan.op_id, files, restored)
+    cancelled = cancel_event is not None and cancel_event.is_set()
+    logger.info("Откат операции %s: возвращено %d из %d, восстановлено дубликатов %d, "
+                "не найдено %d, конфликтов %d, ошибок %d%s",
+                plan.op_id, len(files), len(plan.reverts), len(restored), missing, len(conflicts), errors,
+                " (отменен)" if cancelled else "")
+    result = {"reverted": len(files), "restored": len(restored), "missing": missing,
+              "conflicts": len(conflicts), "errors": errors, "cancelled": cancelled}
+    progress({"event": "finished", **result})
+    result["files"] = files
+    return result
+
+
+def revert_operation(op_id, moves, duplicates=(), workers=None, progress=None, cancel_event=None):
+    """Строит и выполняет план отката (см. plan_revert и execute_revert)"""
+    return execute_revert(plan_revert(op_id, moves, duplicates), workers, progress, cancel_event)
+
+
+class RevertWorker(EventWorker):
+    """Выполняет revert_operation в фоновом потоке (события - см. sort_worker.EventWorker)"""
+
+    task_name = "откате"
+
+    def __init__(self, op_id, moves, duplicates=(), workers=None):
+        super().__init__(workers)
+        self.op_id = op_id
+        self.moves = moves
+        self.duplicates = duplicates
+
+    def work(self):
+        return revert_operation(self.op_id, self.moves, self.duplicates, self.workers,
+                                self.events.put, self.cancel_event)
@@ -0,0 +1,374 @@
+"""Индекс правил сортировки для быстрого сопоставления элементов рабочего стола"""
+
+import fnmatch
+import functools
+import re
+import time
+from mime_sniffer import default_sniffer
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SECONDS_PER_DAY = 86400
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+              "g": 1024 ** 3, "gb": 1024 ** 3, "t": 1024 ** 4, "tb": 1024 ** 4}
+# Ключи условий правил date/size
+CONDITION_KEYS = ("older_than_days", "newer_than_days", "min_size", "max_size")
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?b?)\s*$", re.IGNORECASE)
+
+
+def parse_size(value):
+    """Размер в байтах из числа или строки (например, 100MB или 1.5 GB)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    match = _SIZE_RE.match(str(value))
+    if not match:
+        raise ValueError(f"неверный размер: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+class Condition:
+    """
+    Скомпилированные условия правила date/size. Пороги вычисляются один раз
+    при построении индекса и сравниваются с полями ScanEntry без обращения
+    к файловой системе.
+    """
+
+    __slots__ = ("position", "rule", "min_size", "max_size", "older_cutoff", "newer_cutoff")
+
+    def __init__(self, position, rule, now):
+        self.position = position
+        self.rule = rule
+        self.min_size = parse_size(rule["min_size"]) if "min_size" in rule else None
+        self.max_size = parse_size(rule["max_size"]) if "max_size" in rule else None
+        self.older_cutoff = (now - float(rule["older_than_days"]) * SECONDS_PER_DAY
+                             if "older_than_days" in rule else None)
+        self.newer_cutoff = (now - float(rule["newer_than_days"]) * SECONDS_PER_DAY
+                             if "newer_than_days" in rule else None)
+
+    def _static_match(self, entry):
+        if self.min_size is not None and entry.size < self.min_size:
+            return False
+        if self.max_size is not None and entry.size > self.max_size:
+            return False
+        if self.newer_cutoff is not None and entry.mtime < self.newer_cutoff:
+            return False
+        return True
+
+    def matches(self, entry):
+        if self.older_cutoff is not None and entry.mtime > self.older_cutoff:
+            return False
+        return self._static_match(entry)
+
+    def waiting(self, entry):
+        """Элемент подойдет под правило позже, когда станет достаточно старым"""
+        return (self.older_cutoff is not None and entry.mtime > self.older_cutoff
+                and self._static_match(entry))
+
+
+class PatternMatcher:
+    """
+    Правила glob и regex, объединенные в одно регулярное выражение-альтернативу
+    с именованной группой на каждое правило. Имя сопоставляется одним вызовом
+    match; альтернативы проверяются слева направо, поэтому при нескольких
+    совпадениях выигрывает правило, стоящее раньше в списке.
+    Glob должен совпасть с именем целиком, regex ищется в любом месте имени.
+    Регистр букв не учитывается.
+    """
+
+    def __init__(self, patterns):
+        # patterns - кортеж (тип, шаблон); индексы совпадают с positions
+        self.patterns = patterns
+        self._group_index = {}
+        self._fallback = None
+        sources = []
+        for i, (rule_type, pattern) in enumerate(patterns):
+            source = self._source(rule_type, pattern)
+            try:
+                re.compile(source, re.IGNORECASE)
+            except re.error as e:
+                logger.warning(f"Шаблон {rule_type} {pattern!r} пропущен: {e}")
+                continue
+            sources.append((i, source))
+            self._group_index[f"r{i}"] = i
+        try:
+            combined = "|".join(f"(?P<r{i}>{source})" for i, source in sources)
+            self._regex = re.compile(combined, re.IGNORECASE) if sources else None
+        except re.error as e:
+            # Например, одинаковые именованные группы в разных правилах:
+            # тогда шаблоны проверяются по одному
+            logger.warning(f"Шаблоны правил не объединены в одно выражение ({e}), проверяются по очереди")
+            self._regex = None
+            self._fallback = [(i, re.compile(source, re.IGNORECASE)) for i, source in sources]
+
+    @staticmethod
+    def _source(rule_type, pattern):
+        if rule_type == "glob":
+            # fnmatch.translate дает (?s:...)\Z - совпадение со всем именем
+            return fnmatch.translate(pattern)
+        return f".*?(?:{pattern})"
+
+    def match(self, name):
+        """Индекс первого совпавшего шаблона или None"""
+        if self._regex is not None:
+            m = self._regex.match(name)
+            if m is None:
+                return None
+            index = self._group_index.get(m.lastgroup)
+            if index is None:
+                # lastgroup указывает на вложенную группу пользователя
+                index = next(self._group_index[g] for g, v in m.groupdict().items()
+                             if v is not None and g in self._group_index)
+            return index
+        for index, regex in self._fallback or ():
+            if regex.match(name):
+                return index
+        return None
+
+
+def _first(*hits):
+    """Совпадение (позиция, правило), стоящее раньше в списке правил, или None"""
+    found = [hit for hit in hits if hit is not None]
+    return min(found, key=lambda hit: hit[0]) if found else None
+
+
+@functools.lru_cache(maxsize=16)
+def compile_patterns(patterns):
+    """
+    PatternMatcher для кортежа (тип, шаблон). Результат кэшируется, поэтому
+    выражение перестраивается, только когда меняются сами правила.
+    """
+    return PatternMatcher(patterns)
+
+
+class RuleIndex:
+    """
+    Скомпилированный индекс правил сортировки.
+
+    Строится один раз из списка sorting_rules и позволяет находить правило
+    для элемента словарными поисками вместо перебора всего списка правил.
+    При совпадении нескольких расширений выигрывает самое длинное
+    (".tar.gz" раньше ".gz"), при одинаковых ключах - первое правило в списке.
+    Расширение без точки в начале ("pdf") считается расширением ".pdf".
+
+    Правила типа "mime" (в поле extension - MIME-тип, например "application/pdf",
+    или семейство "image/*") проверяются для файлов, не подошедших по имени:
+    тип определяется по сигнатуре в начале файла.
+
+    Правила типов "date" и "size" задают условия по данным сканирования:
+    older_than_days, newer_than_days (по mtime), min_size, max_size (байты
+    или строки вида "100MB"). Поле extension необязательно и ограничивает
+    правило файлами с этим расширением. В folder можно указать {year},
+    {month} и {day} - части даты изменения файла ("Photos/{year}/{month}").
+    Условия группируются по расширению, поэтому для элемента проверяются
+    только правила его расширения и правила без расширения.
+
+    Правила "glob" ("Screenshot*.png") и "regex" ("invoice_\\d+") хранят шаблон
+    в поле extension и применяются к файлам и папкам (см. PatternMatcher).
+
+    Из нескольких совпавших правил glob, regex, date, size, расширений и
+    папок выбирается стоящее раньше в списке: для этого индекс хранит
+    позицию каждого правила.
+    """
+
+    def __init__(self, rules, sniffer=None, now=None):
+        self.rules = list(rules)
+        # Расширение или имя папки -> (позиция в списке, правило)
+        self._extensions = {}
+        self._folders = {}
+        # MIME-тип или семейство -> (позиция в списке, правило)
+        self._mimes = {}
+        self._mime_families = {}
+        self._sniffer = sniffer
+        # Условные правила (date, size): расширение -> [Condition], без расширения - отдельно
+        self._conditions = {}
+        self._conditions_any = []
+        now = time.time() if now is None else now
+        # Правила glob и regex: позиции в списке и объединенное выражение
+        pattern_positions = []
+        patterns = []
+
+        for position, rule in enumerate(self.rules):
+            key = rule.get("extension", "").lower()
+            if rule.get("type") in ("date", "size"):
+                self._add_condition(position, rule, key, now)
+                continue
+            if not key:
+                continue
+            if rule.get("type") in ("glob", "regex"):
+                pattern_positions.append(position)
+                patterns.append((rule["type"], rule["extension"]))
+                continue
+            if rule.get("type") == "extension":
+                # Расширение без точки ("pdf") приводится к ".pdf", как в условных
+                # правилах, и участвует в общем поиске по суффиксам
+                if not key.startswith("."):
+                    key = "." + key
+                self._extensions.setdefault(key, (position, rule))
+            elif rule.get("type") == "folder":
+                self._folders.setdefault(key, (position, rule))
+            elif rule.get("type") == "mime":
+                if key.endswith("/*"):
+                    self._mime_families.setdefault(key[:-2], (position, rule))
+                else:
+                    self._mimes.setdefault(key, (position, rule))
+
+        self._pattern_positions = pattern_positions
+        self._patterns = compile_patterns(tuple(patterns)) if patterns else None
+
+    def _add_condition(self, position, rule, key, now):
+        try:
+            condition = Condition(position, rule, now)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Правило {rule} пропущено: {e}")
+            return
+        if not key:
+            self._conditions_any.append(condition)
+        else:
+            if not key.startswith("."):
+                key = "." + key
+            self._conditions.setdefault(key, []).append(condition)
+
+    def _candidate_conditions(self, lowered):
+        """Условные правила, применимые к файлу с именем lowered, в порядке списка"""
+        found = list(self._conditions_any)
+        if self._conditions:
+            dot = lowered.find(".")
+            while dot != -1:
+                found += self._conditions.get(lowered[dot:], ())
+                dot = lowered.find(".", dot + 1)
+            found.sort(key=lambda c: c.position)
+        return found
+
+    def _first_condition(self, entry, before=None):
+        """Первое выполненное условное правило; before - проверять только правила до этой позиции"""
+        for condition in self._candidate_conditions(entry.name.lower()):
+            if before is not None and condition.position >= before:
+                break
+            if condition.matches(entry):
+                return condition
+        return None
+
+    def match_conditions(self, entry):
+        """Возвращает первое условное правило (date, size), которому удовлетворяет файл, или None"""
+        condition = self._first_condition(entry)
+        return condition.rule if condition is not None else None
+
+    def _match_pattern(self, name):
+        """(позиция, правило) первого совпавшего правила glob/regex или None"""
+        if self._patterns is None:
+            return None
+        index = self._patterns.match(name)
+        if index is None:
+            return None
+        position = self._pattern_positions[index]
+        return position, self.rules[position]
+
+    def match_pattern(self, name):
+        """Возвращает первое правило glob/regex, совпавшее с именем, или None"""
+        hit = self._match_pattern(name)
+        return hit[1] if hit else None
+
+    def may_match_later(self, entry):
+        """
+        Может ли файл без правила подойти под правило со временем
+        (older_than_days еще не наступил). Решение для такого файла
+        нельзя запоминать между запусками.
+        """
+        if not entry.is_file:
+            return False
+        return any(c.waiting(entry) for c in self._candidate_conditions(entry.name.lower()))
+
+    @staticmethod
+    def describe_conditions(rule):
+        """Условия правила в виде строки ("older_than_days=30, min_size=100MB")"""
+        return ", ".join(f"{key}={rule[key]}" for key in CONDITION_KEYS if key in rule)
+
+    @staticmethod
+    def folder_for(rule, entry):
+        """Папка назначения правила для элемента с подстановкой {year}, {month}, {day}"""
+        folder = rule["folder"]
+        if "{" not in folder:
+            return folder
+        t = time.localtime(entry.mtime)
+        return folder.format(year=f"{t.tm_year:04d}", month=f"{t.tm_mon:02d}", day=f"{t.tm_mday:02d}")
+
+    @classmethod
+    def from_config(cls, config):
+        """Строит индекс из конфигурации"""
+        return cls(config.get("sorting_rules", []))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _match_extension(self, lowered):
+        """(позиция, правило) для самого длинного совпавшего расширения или None"""
+        if self._extensions:
+            # Перебираем суффиксы от самого длинного к самому короткому
+            dot = lowered.find(".")
+            while dot != -1:
+                hit = self._extensions.get(lowered[dot:])
+                if hit is not None:
+                    return hit
+                dot = lowered.find(".", dot + 1)
+        return None
+
+    def _match_name(self, name):
+        """(позиция, правило) первого в списке правила glob/regex или расширения для файла"""
+        return _first(self._match_pattern(name), self._match_extension(name.lower()))
+
+    def match_file(self, name):
+        """Возвращает правило для файла или None"""
+        hit = self._match_name(name)
+        return hit[1] if hit else None
+
+    def match_mime(self, mime):
+        """Возвращает правило для MIME-типа или None (при нескольких - первое в списке)"""
+        if not mime:
+            return None
+        exact = self._mimes.get(mime)
+        family = self._mime_families.get(mime.split("/", 1)[0])
+        if exact and family:
+            return min(exact, family, key=lambda hit: hit[0])[1]
+        hit = exact or family
+        return hit[1] if hit else None
+
+    def match_folder(self, name):
+        """Возвращает правило для папки или None"""
+        hit = _first(self._match_pattern(name), self._folders.get(name.lower()))
+        return hit[1] if hit else None
+
+    def match(self, name, is_dir):
+        """Возвращает правило для элемента рабочего стола или None"""
+        if is_dir:
+            return self.match_folder(name)
+        return self.match_file(name)
+
+    def match_entry(self, entry):
+        """Возвращает правило для записи сканирования (scanner.ScanEntry) или None"""
+        if entry.is_dir:
+            return self.match_folder(entry.name)
+        if entry.is_file:
+            hit = self._match_name(entry.name)
+            if self._conditions or self._conditions_any:
+                # Условия проверяются только до позиции уже найденного правила
+                condition = self._first_condition(entry, hit[0] if hit else None)
+                if condition is not None:
+                    return condition.rule
+            rule = hit[1] if hit else None
+            if rule is None and (self._mimes or self._mime_families):
+                if self._sniffer is None:
+                    self._sniffer = default_sniffer()
+                rule = self.match_mime(self._sniffer.sniff_entry(entry))
+            return rule
+        return None
+
+    def find_by_extension(self, extension):
+        """Возвращает все правила с указанным расширением/названием папки"""
+        key = extension.lower()
+        return [r for r in self.rules if r.get("extension", "").lower() == key]
+
+    def without_extension(self, extension):
+        """Возвращает список правил без правил с указанным расширением/названием папки"""
+        key = extension.lower()
+        return [r for r in self.rules if r.get("extension", "").lower() != key]
@@ -46,9 +46,8 @@ def setup_portable_environment():
         with open('config.json', 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=4)
     
-    if not os.path.exists('history.json'):
-        with open('history.json', 'w', encoding='utf-8') as f:
-            json.dump([], f)
+    if not os.path.exists('history.jsonl') and not os.path.exists('history.json'):
+        open('history.jsonl', 'w', encoding='utf-8').close()
 
 def main():
     """Основная функция запуска"""
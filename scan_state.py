@@ -0,0 +1,106 @@
+"""Сохраненное состояние сканирования для инкрементальной сортировки"""
+
+import hashlib
+import json
+import os
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+SCAN_STATE_FILE = 'scan_state.json'
+
+DECISION_SKIPPED = "skipped"
+DECISION_UNMATCHED = "unmatched"
+# Элемент не перемещен: назначение занято, а collision_policy - skip
+DECISION_COLLISION = "collision"
+
+
+def config_fingerprint(config):
+    """Отпечаток параметров конфигурации, от которых зависят решения сортировки"""
+    relevant = {
+        "sorting_rules": config.get("sorting_rules", []),
+        "folder_shortcut_mode": config.get("folder_shortcut_mode", "others"),
+        "collision_policy": config.get("collision_policy", "rename"),
+    }
+    data = json.dumps(relevant, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class ScanState:
+    """
+    Решения, принятые для элементов рабочего стола в прошлых запусках.
+
+    Для каждого оставшегося на месте элемента хранятся mtime, size и решение
+    (пропущен, не найдено правило или назначение занято). Элемент с теми же
+    mtime и size повторно не обрабатывается; для занятого назначения -
+    пока оно существует. При смене отпечатка конфигурации кэш сбрасывается
+    целиком.
+    """
+
+    def __init__(self, fingerprint, entries=None):
+        self.fingerprint = fingerprint
+        self.entries = entries or {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, fingerprint, path=SCAN_STATE_FILE):
+        """Загружает состояние; при несовпадении отпечатка возвращает пустое"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(fingerprint)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать состояние сканирования: {e}")
+            return cls(fingerprint)
+
+        if data.get("fingerprint") != fingerprint:
+            logger.info("Правила сортировки изменились, кэш решений сброшен")
+            state = cls(fingerprint)
+            state.dirty = True
+            return state
+        return cls(fingerprint, data.get("entries", {}))
+
+    def cached_decision(self, entry):
+        """Возвращает сохраненное решение для ScanEntry, если элемент не изменился"""
+        cached = self.entries.get(entry.name)
+        if cached and cached["mtime"] == entry.mtime and cached["size"] == entry.size:
+            if cached["decision"] == DECISION_COLLISION and not os.path.lexists(cached.get("blocked_by", "")):
+                return None
+            return cached["decision"]
+        return None
+
+    def record(self, entry, decision, blocked_by=None):
+        """Запоминает решение для элемента; blocked_by - занятое назначение (DECISION_COLLISION)"""
+        record = {"mtime": entry.mtime, "size": entry.size, "decision": decision}
+        if blocked_by is not None:
+            record["blocked_by"] = blocked_by
+        self.entries[entry.name] = record
+        self.dirty = True
+
+    def forget(self, name):
+        """Удаляет элемент из кэша (например, после перемещения)"""
+        if self.entries.pop(name, None) is not None:
+            self.dirty = True
+
+    def retain(self, names):
+        """Оставляет в кэше только элементы, которые есть на рабочем столе"""
+        names = set(names)
+        stale = [name for name in self.entries if name not in names]
+        for name in stale:
+            del self.entries[name]
+        if stale:
+            self.dirty = True
+
+    def save(self, path=SCAN_STATE_FILE):
+        """Сохраняет состояние, если оно изменилось"""
+        if not self.dirty:
+            return
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"fingerprint": self.fingerprint, "entries": self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.dirty = False
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояния сканирования: {e}")
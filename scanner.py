@@ -0,0 +1,182 @@
+"""Однопроходное сканирование директорий через os.scandir"""
+
+import fnmatch
+import os
+import re
+import stat
+
+KIND_FILE = "file"
+KIND_DIR = "dir"
+KIND_OTHER = "other"
+
+
+class ScanEntry:
+    """
+    Компактная запись об элементе директории.
+
+    Все поля заполняются из одного вызова stat при сканировании, поэтому
+    дальнейшие проверки типа, размера и времени изменения не обращаются
+    к файловой системе. На Windows inode без дополнительного вызова
+    недоступен и равен 0. link - элемент является символической ссылкой
+    (kind описывает цель ссылки).
+    """
+
+    __slots__ = ("name", "path", "kind", "size", "mtime", "inode", "link")
+
+    def __init__(self, name, path, kind, size, mtime, inode, link=False):
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.link = link
+
+    @property
+    def is_file(self):
+        return self.kind == KIND_FILE
+
+    @property
+    def is_dir(self):
+        return self.kind == KIND_DIR
+
+    def __repr__(self):
+        return f"ScanEntry({self.name!r}, kind={self.kind}, size={self.size})"
+
+
+def kind_from_mode(mode):
+    """Определяет тип элемента по st_mode"""
+    if stat.S_ISDIR(mode):
+        return KIND_DIR
+    if stat.S_ISREG(mode):
+        return KIND_FILE
+    return KIND_OTHER
+
+
+def entry_from_dir_entry(dir_entry):
+    """Создает ScanEntry из os.DirEntry, выполняя не более одного stat"""
+    # Признак ссылки берется из данных scandir без отдельного вызова
+    link = dir_entry.is_symlink()
+    try:
+        st = dir_entry.stat()
+    except OSError:
+        # Битая ссылка или элемент удален во время сканирования
+        return ScanEntry(dir_entry.name, dir_entry.path, KIND_OTHER, 0, 0.0, 0, link)
+
+    return ScanEntry(dir_entry.name, dir_entry.path, kind_from_mode(st.st_mode),
+                     st.st_size, st.st_mtime, st.st_ino, link)
+
+
+def scan_directory(path):
+    """Возвращает список ScanEntry для всех элементов директории"""
+    with os.scandir(path) as it:
+        return [entry_from_dir_entry(e) for e in it]
+
+
+def entry_from_path(path):
+    """Создает ScanEntry для одного пути. Возвращает None, если элемента нет"""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return ScanEntry(os.path.basename(path), path, KIND_OTHER, 0, 0.0, 0)
+
+    # Второй вызов нужен только для символических ссылок
+    link = stat.S_ISLNK(st.st_mode)
+    if link:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return ScanEntry(os.path.basename(path), path, KIND_OTHER, 0, 0.0, 0, link)
+
+    return ScanEntry(os.path.basename(path), path, kind_from_mode(st.st_mode),
+                     st.st_size, st.st_mtime, st.st_ino, link)
+
+
+def scan_names(path, names):
+    """Возвращает ScanEntry только для указанных имен внутри директории"""
+    entries = []
+    for name in names:
+        entry = entry_from_path(os.path.join(path, name))
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+# Папки, которые по умолчанию не обходятся при рекурсивном сканировании
+DEFAULT_EXCLUDES = (".git", "node_modules", "__pycache__", "$RECYCLE.BIN", "System Volume Information")
+
+
+class TreeWalker:
+    """
+    Потоковый обход дерева папок через os.scandir.
+
+    Элементы отдаются по мере чтения, в глубину; в памяти держится только
+    стек открытых итераторов scandir (по одному на уровень), поэтому
+    потребление памяти не зависит от числа файлов. max_depth - глубина
+    вложенности (0 - только сам корень, None - без ограничения).
+    exclude - шаблоны имен папок (fnmatch, без учета регистра), которые не
+    обходятся; excluded_paths - пути папок, которые не обходятся и не
+    отдаются (например, папка назначения внутри корня).
+    Символические ссылки на папки не обходятся.
+
+    Папка отдается до обхода её содержимого; вызов skip(entry) сразу после
+    получения папки отменяет спуск в неё (например, если она перемещается
+    целиком).
+    """
+
+    def __init__(self, root, max_depth=None, exclude=DEFAULT_EXCLUDES, excluded_paths=()):
+        self.root = root
+        self.max_depth = max_depth
+        self._exclude = [re.compile(fnmatch.translate(p), re.IGNORECASE) for p in exclude]
+        self._excluded_paths = {os.path.normcase(os.path.abspath(p)) for p in excluded_paths}
+        self._skipped = None
+        self.directories = 0
+        self.entries = 0
+
+    def skip(self, entry):
+        """Не спускаться в только что полученную папку"""
+        self._skipped = entry.path
+
+    def _excluded(self, entry):
+        if any(p.match(entry.name) for p in self._exclude):
+            return True
+        return os.path.normcase(os.path.abspath(entry.path)) in self._excluded_paths
+
+    def __iter__(self):
+        stack = []
+        try:
+            stack.append((os.scandir(self.root), 0))
+            self.directories += 1
+        except OSError:
+            return
+        try:
+            while stack:
+                it, depth = stack[-1]
+                try:
+                    dir_entry = next(it, None)
+                except OSError:
+                    dir_entry = None
+                if dir_entry is None:
+                    it.close()
+                    stack.pop()
+                    continue
+
+                entry = entry_from_dir_entry(dir_entry)
+                if entry.is_dir and self._excluded(entry):
+                    continue
+                self.entries += 1
+                self._skipped = None
+                yield entry
+
+                if (entry.is_dir and not entry.link and self._skipped != entry.path
+                        and (self.max_depth is None or depth < self.max_depth)):
+                    try:
+                        stack.append((os.scandir(entry.path), depth + 1))
+                        self.directories += 1
+                    except OSError:
+                        pass
+        finally:
+            for it, _depth in stack:
+                it.close()
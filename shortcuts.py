@@ -0,0 +1,268 @@
+"""Создание ярлыков пачкой через подключаемые бэкенды"""
+
+import os
+import struct
+import sys
+import time
+from logger import get_logger
+
+try:
+    import pythoncom
+    import win32com.client
+except ImportError:
+    pythoncom = None
+
+logger = get_logger(__name__)
+
+BACKEND_AUTO = "auto"
+BACKEND_WIN32 = "win32"
+BACKEND_LNK = "lnk"
+BACKEND_SYMLINK = "symlink"
+BACKEND_DESKTOP = "desktop"
+BACKEND_NONE = "none"
+
+
+class ShortcutWriter:
+    """
+    Базовый класс бэкенда ярлыков.
+
+    Используется как контекстный менеджер: сессия (например, COM) открывается
+    один раз на запуск сортировки, затем ярлыки пишутся пачкой через
+    write_batch. Время создания каждого ярлыка сохраняется в timings.
+    """
+
+    name = None
+    # Расширение файла ярлыка, добавляемое к имени элемента
+    suffix = ".lnk"
+
+    def __init__(self):
+        self.timings = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def shortcut_path(self, folder, item_name):
+        """Путь ярлыка для элемента item_name в папке folder"""
+        return os.path.join(folder, item_name + self.suffix)
+
+    def write(self, target_path, shortcut_path):
+        """Создает ярлык, возвращает True при успехе"""
+        start = time.perf_counter()
+        try:
+            self._write(target_path, shortcut_path)
+            logger.debug("Создан ярлык: %s -> %s", shortcut_path, target_path)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при создании ярлыка {shortcut_path}: {e}")
+            return False
+        finally:
+            self.timings.append((shortcut_path, time.perf_counter() - start))
+
+    def write_batch(self, pairs):
+        """Создает ярлыки для пар (target_path, shortcut_path), возвращает список результатов"""
+        return [self.write(target, shortcut) for target, shortcut in pairs]
+
+    def timing_summary(self):
+        """Сводка по времени: число ярлыков, суммарное, среднее и максимальное время (с)"""
+        durations = [d for _, d in self.timings]
+        if not durations:
+            return {"count": 0, "total": 0.0, "avg": 0.0, "max": 0.0}
+        total = sum(durations)
+        return {"count": len(durations), "total": total, "avg": total / len(durations), "max": max(durations)}
+
+    def _write(self, target_path, shortcut_path):
+        raise NotImplementedError
+
+
+class Win32ShortcutWriter(ShortcutWriter):
+    """Ярлыки .lnk через WScript.Shell (pywin32), одна COM-сессия на пачку"""
+
+    name = BACKEND_WIN32
+
+    def __init__(self):
+        super().__init__()
+        if pythoncom is None:
+            raise RuntimeError("pywin32 не установлен")
+        self._shell = None
+
+    def open(self):
+        pythoncom.CoInitialize()  # Инициализация COM
+        self._shell = win32com.client.Dispatch("WScript.Shell")
+
+    def close(self):
+        self._shell = None
+        pythoncom.CoUninitialize()  # Освобождение COM
+
+    def _write(self, target_path, shortcut_path):
+        shortcut = self._shell.CreateShortCut(shortcut_path)
+        shortcut.Targetpath = target_path
+        shortcut.WorkingDirectory = os.path.dirname(target_path)
+        shortcut.save()
+
+
+# Константы формата Shell Link (MS-SHLLINK)
+_LINK_CLSID = bytes.fromhex("0114020000000000c000000000000046")
+_HAS_LINK_INFO = 0x00000002
+_HAS_WORKING_DIR = 0x00000010
+_IS_UNICODE = 0x00000080
+_FILE_ATTRIBUTE_DIRECTORY = 0x10
+_FILE_ATTRIBUTE_ARCHIVE = 0x20
+_SW_SHOWNORMAL = 1
+_DRIVE_FIXED = 3
+# Разница между эпохами FILETIME (1601) и POSIX (1970) в 100-нс интервалах
+_FILETIME_UNIX_EPOCH = 116444736000000000
+
+
+def _filetime(timestamp):
+    """Переводит POSIX-время в FILETIME (100-нс интервалы с 1601 года)"""
+    return max(0, int(timestamp * 10_000_000) + _FILETIME_UNIX_EPOCH)
+
+
+def build_lnk(target_path, is_dir=False, size=0, mtime=0.0, working_dir=None):
+    """Собирает содержимое файла .lnk с локальным путем к цели"""
+    if working_dir is None:
+        working_dir = os.path.dirname(target_path)
+
+    header = struct.pack(
+        "<I16sII3QIIIHHII",
+        0x4C, _LINK_CLSID,
+        _HAS_LINK_INFO | _HAS_WORKING_DIR | _IS_UNICODE,
+        _FILE_ATTRIBUTE_DIRECTORY if is_dir else _FILE_ATTRIBUTE_ARCHIVE,
+        _filetime(mtime), _filetime(mtime), _filetime(mtime),
+        size & 0xFFFFFFFF, 0, _SW_SHOWNORMAL, 0, 0, 0, 0)
+
+    # LinkInfo: VolumeID + LocalBasePath (ANSI и Unicode)
+    volume_id = struct.pack("<IIII", 0x11, _DRIVE_FIXED, 0, 0x10) + b"\0"
+    base_path_ansi = target_path.encode("mbcs" if sys.platform == "win32" else "ascii", "replace") + b"\0"
+    suffix_ansi = b"\0"
+    base_path_unicode = target_path.encode("utf-16-le") + b"\0\0"
+    suffix_unicode = b"\0\0"
+
+    header_size = 0x24
+    volume_offset = header_size
+    base_offset = volume_offset + len(volume_id)
+    suffix_offset = base_offset + len(base_path_ansi)
+    base_unicode_offset = suffix_offset + len(suffix_ansi)
+    suffix_unicode_offset = base_unicode_offset + len(base_path_unicode)
+    link_info_size = suffix_unicode_offset + len(suffix_unicode)
+    link_info = struct.pack(
+        "<IIIIIIIII",
+        link_info_size, header_size, 0x1, volume_offset, base_offset, 0, suffix_offset,
+        base_unicode_offset, suffix_unicode_offset,
+    ) + volume_id + base_path_ansi + suffix_ansi + base_path_unicode + suffix_unicode
+
+    working_dir_data = struct.pack("<H", len(working_dir)) + working_dir.encode("utf-16-le")
+    # Пустой TerminalBlock завершает файл
+    return header + link_info + working_dir_data + b"\0\0\0\0"
+
+
+class LnkShortcutWriter(ShortcutWriter):
+    """Ярлыки .lnk, записываемые напрямую в бинарном формате (без COM)"""
+
+    name = BACKEND_LNK
+
+    def _write(self, target_path, shortcut_path):
+        try:
+            st = os.stat(target_path)
+            is_dir = os.path.isdir(target_path)
+            data = build_lnk(target_path, is_dir, st.st_size, st.st_mtime)
+        except OSError:
+            data = build_lnk(target_path)
+        with open(shortcut_path, "wb") as f:
+            f.write(data)
+
+
+class SymlinkShortcutWriter(ShortcutWriter):
+    """Символические ссылки с тем же именем, что и перемещенный элемент (POSIX)"""
+
+    name = BACKEND_SYMLINK
+    suffix = ""
+
+    def _write(self, target_path, shortcut_path):
+        os.symlink(target_path, shortcut_path)
+
+
+class DesktopEntryShortcutWriter(ShortcutWriter):
+    """Ярлыки .desktop (freedesktop.org, тип Link) для рабочих столов Linux"""
+
+    name = BACKEND_DESKTOP
+    suffix = ".desktop"
+
+    def _write(self, target_path, shortcut_path):
+        content = (
+            "[Desktop Entry]\n"
+            "Type=Link\n"
+            f"Name={os.path.basename(target_path)}\n"
+            f"URL=file://{target_path}\n"
+        )
+        with open(shortcut_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+class NullShortcutWriter(ShortcutWriter):
+    """Ярлыки не создаются (серверы без рабочего стола, бенчмарки); запись всегда успешна"""
+
+    name = BACKEND_NONE
+    suffix = ""
+
+    def _write(self, target_path, shortcut_path):
+        pass
+
+
+WRITERS = {
+    BACKEND_WIN32: Win32ShortcutWriter,
+    BACKEND_LNK: LnkShortcutWriter,
+    BACKEND_SYMLINK: SymlinkShortcutWriter,
+    BACKEND_DESKTOP: DesktopEntryShortcutWriter,
+    BACKEND_NONE: NullShortcutWriter,
+}
+
+# Расширения файлов, которые считаются ярлыками и не сортируются
+SHORTCUT_SUFFIXES = (".lnk", ".desktop")
+
+
+def is_shortcut_to(shortcut_path, target_path):
+    """
+    Указывает ли ярлык (символическая ссылка, .desktop или .lnk) на
+    target_path. Используется при откате, чтобы не удалить чужой файл.
+    """
+    try:
+        if os.path.islink(shortcut_path):
+            return os.readlink(shortcut_path) == target_path
+        if shortcut_path.endswith(".desktop"):
+            with open(shortcut_path, "r", encoding="utf-8") as f:
+                return f"URL=file://{target_path}\n" in f.read()
+        if shortcut_path.endswith(".lnk"):
+            with open(shortcut_path, "rb") as f:
+                data = f.read()
+            # Путь к цели хранится в LinkInfo в Unicode и (или) в ANSI
+            return (target_path.encode("utf-16-le") in data
+                    or target_path.encode("mbcs" if sys.platform == "win32" else "utf-8", "replace") in data)
+    except (OSError, UnicodeDecodeError):
+        return False
+    return False
+
+
+def create_shortcut_writer(backend=BACKEND_AUTO):
+    """
+    Создает бэкенд ярлыков. "auto" - pywin32 на Windows, если он установлен,
+    иначе двоичная запись .lnk на Windows и .desktop на остальных системах.
+    """
+    if backend == BACKEND_AUTO:
+        if sys.platform == "win32":
+            backend = BACKEND_WIN32 if pythoncom is not None else BACKEND_LNK
+        else:
+            backend = BACKEND_DESKTOP
+    if backend not in WRITERS:
+        raise ValueError(f"Неизвестный бэкенд ярлыков: {backend}")
+    return WRITERS[backend]()
@@ -0,0 +1,154 @@
+"""План сортировки: неизменяемый список перемещений, его стоимость и порядок выполнения"""
+
+import os
+from collections import namedtuple
+from rule_index import RuleIndex
+
+# Одно запланированное перемещение.
+#   source, destination - пути до и после перемещения
+#   rule        - сработавшее правило (None для папок без правила, см. folder_shortcut_mode)
+#   size        - оценка объема данных в байтах
+#   same_device - источник и назначение на одном томе (переименование, а не копирование)
+#   conflict    - элемент с таким именем уже есть в папке назначения
+#   collision   - как разрешен конфликт (None, "renamed", "overwrite", "skip", см. collisions)
+#   entry       - запись сканирования (ScanEntry) источника
+PlannedMove = namedtuple("PlannedMove", "source destination rule size same_device conflict collision entry")
+
+# Дубликат, который удаляется вместо перемещения.
+#   source      - путь дубликата на рабочем столе
+#   kept        - путь оставленной копии после сортировки
+#   kept_source - текущий путь оставленной копии (совпадает с kept, если она уже в папке назначения)
+#   size        - размер файла в байтах
+#   entry       - запись сканирования (ScanEntry) дубликата
+PlannedDuplicate = namedtuple("PlannedDuplicate", "source kept kept_source size entry")
+
+# План сортировки целиком.
+#   moves     - кортеж PlannedMove в порядке выполнения
+#   duplicates - кортеж PlannedDuplicate (пустой, если поиск дубликатов выключен)
+#   decisions - кортеж пар (entry, decision) для элементов, которые не перемещаются
+#   entries   - все просканированные элементы
+#   reused    - число элементов, пропущенных по кэшу решений прошлых запусков
+#   incremental - план построен по списку имен, а не по всему рабочему столу
+#   hash_cache - кэш хэшей поиска дубликатов (dedup.HashCache) или None; сохраняется
+#                при выполнении плана, поэтому построение плана ничего не пишет на диск
+SortPlan = namedtuple(
+    "SortPlan",
+    "desktop_path organized_dir config moves duplicates decisions entries reused incremental hash_cache")
+
+
+def device_of(path):
+    """
+    Идентификатор тома для пути. Если путь еще не существует (папка
+    назначения будет создана), берется ближайший существующий родитель.
+    """
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def tree_size(path):
+    """Суммарный размер файлов в папке (для оценки межтомового копирования)"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+
+def order_for_locality(moves):
+    """
+    Порядок выполнения с учетом локальности: сначала переименования в
+    пределах тома, затем межтомовые копирования, сгруппированные по папке
+    назначения. Внутри группы исходный порядок сохраняется.
+    """
+    renames = [m for m in moves if m.same_device]
+    copies = [m for m in moves if not m.same_device]
+    folder_order = {}
+    for move in copies:
+        folder_order.setdefault(os.path.dirname(move.destination), len(folder_order))
+    copies.sort(key=lambda m: folder_order[os.path.dirname(m.destination)])
+    return tuple(renames + copies)
+
+
+def estimate_cost(plan):
+    """
+    Оценка ввода-вывода плана: переименования почти бесплатны (только
+    метаданные), межтомовые перемещения копируют данные целиком.
+    """
+    cost = {"moves": 0, "renames": 0, "copies": 0, "copy_bytes": 0,
+            "rename_bytes": 0, "conflicts": 0, "skipped": 0, "folders": 0,
+            "duplicates": len(plan.duplicates), "duplicate_bytes": sum(d.size for d in plan.duplicates)}
+    folders = set()
+    for move in plan.moves:
+        if move.collision == "skip":
+            cost["conflicts"] += 1
+            cost["skipped"] += 1
+            continue
+        cost["moves"] += 1
+        if move.same_device:
+            cost["renames"] += 1
+            cost["rename_bytes"] += move.size
+        else:
+            cost["copies"] += 1
+            cost["copy_bytes"] += move.size
+        if move.conflict:
+            cost["conflicts"] += 1
+        folders.add(os.path.dirname(move.destination))
+    cost["folders"] = len(folders)
+    return cost
+
+
+def describe_rule(move):
+    if move.rule is None:
+        return "folder without rule"
+    description = f"{move.rule['type']}:{move.rule.get('extension', '')}"
+    conditions = RuleIndex.describe_conditions(move.rule)
+    return f"{description} ({conditions})" if conditions else description
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_plan(plan):
+    """Текстовое представление плана и его стоимости для вывода в консоль"""
+    lines = []
+    for i, move in enumerate(plan.moves, start=1):
+        flags = ("rename" if move.same_device else "copy") + (f", conflict: {move.collision}" if move.conflict else "")
+        lines.append(f"{i}. {move.entry.name} -> {move.destination} "
+                     f"[{describe_rule(move)}; {format_size(move.size)}; {flags}]")
+    for duplicate in plan.duplicates:
+        lines.append(f"-  {duplicate.entry.name} [duplicate of {duplicate.kept}; {format_size(duplicate.size)}]")
+    if not plan.moves and not plan.duplicates:
+        lines.append("Nothing to move.")
+    cost = estimate_cost(plan)
+    lines.append("")
+    lines.append(f"Planned moves: {cost['moves']} into {cost['folders']} folders "
+                 f"({plan.reused} unchanged items skipped)")
+    lines.append(f"Renames (same volume): {cost['renames']}, {format_size(cost['rename_bytes'])} of metadata-only moves")
+    lines.append(f"Copies (cross volume): {cost['copies']}, {format_size(cost['copy_bytes'])} to copy")
+    if cost["duplicates"]:
+        lines.append(f"Duplicates (removed, shortcut to the kept copy): {cost['duplicates']}, "
+                     f"{format_size(cost['duplicate_bytes'])} not moved")
+    if cost["conflicts"]:
+        lines.append(f"Conflicts (destination exists): {cost['conflicts']}, {cost['skipped']} will be skipped")
+    return "\n".join(lines)
@@ -0,0 +1,108 @@
+"""Сортировка и откат в фоновом потоке с потоком событий о ходе выполнения"""
+
+import queue
+import threading
+from config_manager import load_config
+from file_sorter import sort_all
+from profiling import profiled, profiling_options
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# События (словари с ключом "event"):
+#   scanned  - прочитан рабочий стол: scanned
+#   matched  - определены перемещения: matched
+#   moved    - перемещен элемент: name, moved, bytes, matched
+#              (для корней-источников matched - число найденных на данный момент;
+#              у перемещений профилей есть ключ profile)
+#   finished - сортировка завершена: moved, cancelled
+#   error    - сортировка не выполнена: error
+TERMINAL_EVENTS = ("finished", "error")
+
+
+class EventWorker(threading.Thread):
+    """
+    Фоновый поток с очередью событий events и флагом отмены cancel_event.
+    Подкласс выполняет задачу в work() и передает события в events.put;
+    последним событием всегда идет finished или error. Результат work()
+    сохраняется в result.
+    """
+
+    # Название задачи для сообщения об ошибке ("Ошибка при <...> в фоновом потоке")
+    task_name = "выполнении задачи"
+
+    def __init__(self, workers=None):
+        super().__init__(daemon=True)
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.workers = workers
+        self.result = None
+
+    def work(self):
+        raise NotImplementedError
+
+    def run(self):
+        try:
+            self.result = self.work()
+        except Exception as e:
+            logger.error("Ошибка при %s в фоновом потоке: %s", self.task_name, e)
+            self.events.put({"event": "error", "error": str(e)})
+
+    def cancel(self):
+        """Запрашивает остановку между элементами"""
+        self.cancel_event.set()
+
+    def poll(self):
+        """Возвращает все накопившиеся события без ожидания"""
+        events = []
+        try:
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def next_event(self, timeout=None):
+        """Ждет следующее событие; по истечении timeout возвращает None"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class SortWorker(EventWorker):
+    """
+    Выполняет sort_all (рабочий стол и корни-источники) в фоновом потоке.
+    profile - пара (cpu, memory) для profiled; по умолчанию из скрытых
+    настроек profile_cpu/profile_memory.
+    """
+
+    task_name = "сортировке"
+
+    def __init__(self, workers=None, profile=None):
+        super().__init__(workers)
+        self.profile = profile
+
+    def work(self):
+        profile = self.profile or profiling_options(load_config())
+        with profiled("sort", *profile):
+            result = sort_all(workers=self.workers, progress=self.events.put, cancel_event=self.cancel_event)
+        if result is None:
+            self.events.put({"event": "error", "error": "Сортировка не выполнена, подробности в журнале"})
+        return result
+
+
+def format_event(event):
+    """Текстовое представление события для вывода в консоль"""
+    kind = event["event"]
+    if kind == "scanned":
+        return f"Scanned {event['scanned']} items"
+    if kind == "matched":
+        return f"Matched {event['matched']} items to move"
+    if kind == "moved":
+        prefix = f"{event['profile']}: " if event.get("profile") else ""
+        return f"{prefix}[{event['moved']}/{event['matched']}] Moved {event['name']} ({event['bytes']} bytes total)"
+    if kind == "finished":
+        suffix = " (cancelled)" if event["cancelled"] else ""
+        return f"Finished: {event['moved']} items moved{suffix}"
+    return f"Error: {event.get('error')}"
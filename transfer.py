@@ -0,0 +1,235 @@
+"""Перемещение между томами: копирование без буферов в пространстве пользователя, проверка и докачка"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Размер буфера для копирования через readinto и для контрольной суммы
+BUFFER_SIZE = 8 * 1024 * 1024
+# Сколько байт передается одним вызовом copy_file_range/sendfile
+CHUNK_SIZE = 64 * 1024 * 1024
+# Файлы от этого размера копируются с маркером докачки
+RESUME_MIN_SIZE = 64 * 1024 * 1024
+# Как часто (в байтах) маркер докачки обновляется после fsync
+CHECKPOINT_SIZE = 256 * 1024 * 1024
+
+PART_SUFFIX = ".part"
+MARKER_SUFFIX = ".part.json"
+
+METHOD_COPY_FILE_RANGE = "copy_file_range"
+METHOD_SENDFILE = "sendfile"
+METHOD_READINTO = "readinto"
+METHODS = (METHOD_COPY_FILE_RANGE, METHOD_SENDFILE, METHOD_READINTO)
+
+# Ошибки, после которых системный вызов не поддерживается для этой пары файлов
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+class VerificationError(OSError):
+    """Контрольная сумма копии не совпала с исходным файлом"""
+
+
+def available_methods():
+    """Способы копирования, доступные на этой платформе, в порядке предпочтения"""
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(METHOD_COPY_FILE_RANGE)
+    if hasattr(os, "sendfile") and not os.name == "nt":
+        methods.append(METHOD_SENDFILE)
+    methods.append(METHOD_READINTO)
+    return methods
+
+
+def file_checksum(path, buffer=None):
+    """Потоковая контрольная сумма файла (BLAKE2b - быстрее SHA-256 на больших файлах)"""
+    h = hashlib.blake2b()
+    if buffer is None:
+        buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            h.update(view[:count])
+    return h.hexdigest()
+
+
+def _copy_range(src_fd, dst_fd, offset, size, method, on_progress):
+    """Копирует байты [offset, size) одним из способов; возвращает новое смещение"""
+    start = offset
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        if method == METHOD_COPY_FILE_RANGE:
+            sent = os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+        else:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            sent = os.sendfile(dst_fd, src_fd, offset, count)
+        if sent == 0:
+            # Некоторые ФС (FUSE, сетевые) сообщают о неподдерживаемом вызове
+            # нулем без errno: тогда пробуется следующий способ
+            if offset == start:
+                raise OSError(errno.EOPNOTSUPP, f"{method} вернул 0 байт")
+            break
+        offset += sent
+        on_progress(offset)
+    return offset
+
+
+def _copy_readinto(src_fd, dst_fd, offset, size, on_progress):
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    src = os.fdopen(os.dup(src_fd), "rb", buffering=0)
+    with src:
+        src.seek(offset)
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        while offset < size:
+            count = src.readinto(buffer)
+            if not count:
+                break
+            written = 0
+            while written < count:
+                written += os.write(dst_fd, view[written:count])
+            offset += count
+            on_progress(offset)
+    return offset
+
+
+def _read_marker(marker_path, source_stat):
+    """Смещение, с которого можно продолжить копирование, или 0"""
+    try:
+        with open(marker_path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+        if marker["size"] == source_stat.st_size and marker["mtime"] == source_stat.st_mtime:
+            return int(marker["copied"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return 0
+
+
+def _write_marker(marker_path, source, source_stat, copied):
+    tmp_path = marker_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "size": source_stat.st_size, "mtime": source_stat.st_mtime,
+                   "copied": copied}, f)
+    os.replace(tmp_path, marker_path)
+
+
+def copy_file(source, target, verify=False, methods=None):
+    """
+    Копирует файл source в target через временный файл target.part.
+
+    Способы пробуются по порядку (по умолчанию available_methods()):
+    copy_file_range и sendfile передают данные внутри ядра, readinto -
+    запасной вариант с большим буфером. Файлы от RESUME_MIN_SIZE байт
+    копируются с маркером target.part.json: после сбоя копирование
+    продолжается с последней сохраненной точки, если исходный файл не
+    изменился. verify - сравнить контрольные суммы до переименования
+    копии в target (при несовпадении VerificationError, копия удаляется).
+    Возвращает способ, которым скопированы данные.
+    """
+    part_path = target + PART_SUFFIX
+    marker_path = target + MARKER_SUFFIX
+    source_stat = os.stat(source)
+    size = source_stat.st_size
+    resumable = size >= RESUME_MIN_SIZE
+
+    offset = 0
+    if resumable and os.path.exists(part_path):
+        offset = min(_read_marker(marker_path, source_stat), os.path.getsize(part_path))
+        if offset:
+            logger.info("Продолжение копирования %s с %d из %d байт", source, offset, size)
+
+    checkpoint = {"at": offset}
+
+    def on_progress(copied):
+        if resumable and copied - checkpoint["at"] >= CHECKPOINT_SIZE:
+            os.fsync(dst_fd)
+            _write_marker(marker_path, source, source_stat, copied)
+            checkpoint["at"] = copied
+
+    used = None
+    with open(source, "rb", buffering=0) as src:
+        src_fd = src.fileno()
+        dst_fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            os.ftruncate(dst_fd, offset)
+            if resumable:
+                _write_marker(marker_path, source, source_stat, offset)
+            for method in methods or available_methods():
+                try:
+                    if method == METHOD_READINTO:
+                        offset = _copy_readinto(src_fd, dst_fd, offset, size, on_progress)
+                    else:
+                        offset = _copy_range(src_fd, dst_fd, offset, size, method, on_progress)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED or method == METHOD_READINTO:
+                        raise
+                    logger.debug("%s не поддерживается для %s (%s), следующий способ", method, source, e)
+                    continue
+                used = method
+                break
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+
+    if offset != size:
+        raise OSError(errno.EIO, f"Скопировано {offset} из {size} байт", source)
+    if verify:
+        buffer = bytearray(BUFFER_SIZE)
+        if file_checksum(source, buffer) != file_checksum(part_path, buffer):
+            _remove_quietly(part_path)
+            _remove_quietly(marker_path)
+            raise VerificationError(errno.EIO, "Контрольная сумма копии не совпала", source)
+    shutil.copystat(source, part_path)
+    os.replace(part_path, target)
+    _remove_quietly(marker_path)
+    return used
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def move_path(source, target, verify=False, overwrite=False):
+    """
+    Перемещает файл или папку. В пределах тома - переименование; между
+    томами файлы копируются через copy_file (с проверкой, если verify),
+    и только после успешного копирования удаляется источник.
+    overwrite - заменить существующий файл target (os.rename на Windows
+    в этом случае завершается ошибкой, поэтому используется os.replace).
+    Замена для shutil.move в MoveScheduler и при откате.
+    """
+    try:
+        if overwrite:
+            os.replace(source, target)
+        else:
+            os.rename(source, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), target)
+        os.unlink(source)
+    elif os.path.isdir(source):
+        shutil.copytree(source, target, symlinks=True,
+                        copy_function=lambda src, dst: copy_file(src, dst, verify))
+        shutil.rmtree(source)
+    else:
+        copy_file(source, target, verify)
+        os.remove(source)
+
+
+def mover(config):
+    """Функция перемещения для MoveScheduler с параметрами из конфигурации"""
+    verify = config.get("transfer_verify", False)
+    return lambda source, target, overwrite=False: move_path(source, target, verify, overwrite)
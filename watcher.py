@@ -0,0 +1,256 @@
+"""Событийное отслеживание изменений на рабочем столе"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from scanner import scan_directory
+from config_manager import subscribe, unsubscribe
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+BACKEND_AUTO = "auto"
+BACKEND_INOTIFY = "inotify"
+BACKEND_POLLING = "polling"
+
+# Флаги inotify из <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Debouncer:
+    """
+    Накапливает имена измененных элементов и отдает их пачкой, когда
+    по каждому имени не было событий в течение окна debounce. Каждое новое
+    событие продлевает ожидание, поэтому файл, который еще докачивается,
+    не будет перемещен посреди записи.
+    """
+
+    def __init__(self, callback, delay):
+        self.callback = callback
+        self.delay = delay
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def touch(self, names):
+        """Отмечает события для указанных имен"""
+        deadline = time.monotonic() + self.delay
+        with self._lock:
+            for name in names:
+                self._pending[name] = deadline
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped:
+            with self._lock:
+                now = time.monotonic()
+                ready = [name for name, deadline in self._pending.items() if deadline <= now]
+                for name in ready:
+                    del self._pending[name]
+                timeout = min(self._pending.values()) - now if self._pending else None
+
+            if ready:
+                try:
+                    self.callback(ready)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке изменений на рабочем столе: {e}")
+                continue
+
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+class BaseWatcher:
+    """Базовый класс наблюдателя: вызывает on_change(names) в фоновом потоке"""
+
+    name = None
+
+    def __init__(self, path, on_change):
+        self.path = path
+        self.on_change = on_change
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"Запущено отслеживание {self.path} ({self.name})")
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        logger.info(f"Отслеживание {self.path} остановлено")
+
+    def _run(self):
+        raise NotImplementedError
+
+
+class PollingWatcher(BaseWatcher):
+    """Переносимый наблюдатель: сравнивает снимки (size, mtime) директории"""
+
+    name = BACKEND_POLLING
+
+    def __init__(self, path, on_change, poll_interval=2.0):
+        super().__init__(path, on_change)
+        self.poll_interval = poll_interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        try:
+            return {e.name: (e.size, e.mtime) for e in scan_directory(self.path)}
+        except OSError as e:
+            logger.error(f"Ошибка при сканировании {self.path}: {e}")
+            return {}
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            snapshot = self._take_snapshot()
+            changed = [name for name, state in snapshot.items() if self._snapshot.get(name) != state]
+            self._snapshot = snapshot
+            if changed:
+                self.on_change(changed)
+
+
+class InotifyWatcher(BaseWatcher):
+    """Наблюдатель на основе inotify (только Linux)"""
+
+    name = BACKEND_INOTIFY
+    MASK = IN_CREATE | IN_MOVED_TO | IN_MODIFY
+
+    def __init__(self, path, on_change):
+        super().__init__(path, on_change)
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                names, overflow = parse_inotify_events(data)
+                if overflow:
+                    # Очередь переполнена: часть событий потеряна, пересканируем всё
+                    logger.warning("Переполнение очереди inotify, выполняется полное сканирование")
+                    names = [e.name for e in scan_directory(self.path)]
+                if names:
+                    self.on_change(names)
+        finally:
+            os.close(self._fd)
+
+
+def parse_inotify_events(data):
+    """Разбирает буфер событий inotify. Возвращает (имена, признак переполнения)"""
+    names = []
+    overflow = False
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        raw_name = data[offset:offset + length].rstrip(b"\0")
+        offset += length
+        if mask & IN_Q_OVERFLOW:
+            overflow = True
+        elif raw_name:
+            names.append(os.fsdecode(raw_name))
+    return names, overflow
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def inotify_available():
+    """Проверяет, доступен ли inotify в текущей системе"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        libc = _load_libc()
+        return hasattr(libc, "inotify_init1")
+    except OSError:
+        return False
+
+
+def create_watcher(path, on_change, backend=BACKEND_AUTO, poll_interval=2.0):
+    """
+    Создает наблюдатель для директории.
+    backend: "auto" (inotify, если доступен, иначе опрос), "inotify" или "polling".
+    """
+    if backend in (BACKEND_AUTO, BACKEND_INOTIFY) and inotify_available():
+        try:
+            return InotifyWatcher(path, on_change)
+        except OSError as e:
+            logger.warning(f"Не удалось запустить inotify, используется опрос: {e}")
+    elif backend == BACKEND_INOTIFY:
+        logger.warning("inotify недоступен в этой системе, используется опрос")
+    return PollingWatcher(path, on_change, poll_interval=poll_interval)
+
+
+class DesktopWatcher:
+    """
+    Связывает наблюдатель и Debouncer: измененные имена после окна тишины
+    передаются в on_batch(names).
+    """
+
+    def __init__(self, path, on_batch, backend=BACKEND_AUTO, debounce=2.0, poll_interval=2.0):
+        self.debouncer = Debouncer(on_batch, debounce)
+        self.watcher = create_watcher(path, self.debouncer.touch, backend=backend,
+                                      poll_interval=poll_interval)
+        self._config_callbacks = []
+
+    @property
+    def backend(self):
+        return self.watcher.name
+
+    def start(self):
+        self.watcher.start()
+        return self
+
+    def subscribe_config(self, callback):
+        """Подписывает callback на изменения конфигурации до остановки наблюдателя"""
+        subscribe(callback)
+        self._config_callbacks.append(callback)
+
+    def stop(self):
+        for callback in self._config_callbacks:
+            unsubscribe(callback)
+        self._config_callbacks = []
+        self.watcher.stop()
+        self.debouncer.stop()